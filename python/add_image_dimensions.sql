@@ -0,0 +1,10 @@
+-- Migration script adding the stored image dimensions and file size to images
+-- Run this script to update existing database tables; the scraper fills the
+-- columns for new images, older rows stay NULL
+
+USE perchance_gallery;
+
+ALTER TABLE images
+    ADD COLUMN width SMALLINT UNSIGNED NULL,
+    ADD COLUMN height SMALLINT UNSIGNED NULL,
+    ADD COLUMN file_size INT UNSIGNED NULL;
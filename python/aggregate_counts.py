@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Stored aggregate counters for the tables view (web/api/tables_data.php).
+
+The tables page used to count every style's, prompt's, tag's and token's images
+or prompts with COUNT(DISTINCT ...) over LEFT JOINs on each request, and then
+sort by the computed count. The counts are now kept in side tables, one row
+per entity:
+
+    art_style_counts        image_count
+    positive_prompt_counts  combinations_count, image_count
+    negative_prompt_counts  combinations_count, image_count
+    tag_counts              image_count
+    token_counts            positive_count, negative_count
+
+Each count column has an index (count, id), so sorting by a count is an index
+scan. image_count counts live (not deleted) images.
+
+The counters are adjusted by deltas in the same transaction as the change:
+
+- the scraper adds its new images and prompt combinations (add_images, add_combinations)
+- near duplicates, retention and delete.php subtract images before marking them deleted
+- update_tags.php subtracts an image's tag links before replacing them and adds the new ones
+- build_token_relationships.py adds the tokens of newly tokenized prompts
+
+Every counter is defined once in COUNTERS, as a query that both the deltas and
+--reconcile run. web/api/utils/counts.php repeats the image and tag queries;
+keep the two in sync. --reconcile recounts everything and corrects rows that
+drifted (crashes between statements, edits made by hand, compress_tag_ids.py).
+The scheduler runs it. Entities nothing refers to yet get their zero row there.
+
+table_counts holds the row count of each table the tables page lists, plus
+the number of live images, for the table counts cache (update_table_counts.py).
+Writers add the rows they insert or delete with add_rows in the same
+transaction; every change bumps the row's generation, so the cache is only
+rewritten when the sum of the generations moved. --reconcile recounts it with
+COUNT(*) like the other counters.
+
+Usage:
+    python aggregate_counts.py --check               # Count counter rows that differ from a recount
+    python aggregate_counts.py --reconcile           # Recount and fix the rows that differ
+    python aggregate_counts.py --reconcile --tables tag_counts table_counts
+"""
+
+import argparse
+import time
+
+from database import LOOKUP_BATCH_SIZE, get_connection
+
+# table -> (key column, entity table, {count column: query})
+# Each query selects (key, {value}) of the rows matching {condition}, grouped by key.
+COUNTERS = {
+    'art_style_counts': ( 'art_style_id', 'art_styles', {
+        'image_count': """
+            SELECT i.art_style_id, {value} FROM images i
+            WHERE i.deleted = 0 AND i.art_style_id IS NOT NULL AND {condition}
+            GROUP BY i.art_style_id
+        """,
+    } ),
+    'positive_prompt_counts': ( 'positive_prompt_id', 'positive_prompts', {
+        'combinations_count': """
+            SELECT pc.positive_prompt_id, {value} FROM prompt_combinations pc
+            WHERE pc.positive_prompt_id IS NOT NULL AND {condition}
+            GROUP BY pc.positive_prompt_id
+        """,
+        'image_count': """
+            SELECT pc.positive_prompt_id, {value} FROM images i
+            JOIN prompt_combinations pc ON pc.id = i.prompt_combination_id
+            WHERE i.deleted = 0 AND pc.positive_prompt_id IS NOT NULL AND {condition}
+            GROUP BY pc.positive_prompt_id
+        """,
+    } ),
+    'negative_prompt_counts': ( 'negative_prompt_id', 'negative_prompts', {
+        'combinations_count': """
+            SELECT pc.negative_prompt_id, {value} FROM prompt_combinations pc
+            WHERE pc.negative_prompt_id IS NOT NULL AND {condition}
+            GROUP BY pc.negative_prompt_id
+        """,
+        'image_count': """
+            SELECT pc.negative_prompt_id, {value} FROM images i
+            JOIN prompt_combinations pc ON pc.id = i.prompt_combination_id
+            WHERE i.deleted = 0 AND pc.negative_prompt_id IS NOT NULL AND {condition}
+            GROUP BY pc.negative_prompt_id
+        """,
+    } ),
+    'tag_counts': ( 'tag_id', 'tags', {
+        'image_count': """
+            SELECT it.tag_id, {value} FROM image_tags it
+            JOIN images i ON i.id = it.image_id
+            WHERE i.deleted = 0 AND {condition}
+            GROUP BY it.tag_id
+        """,
+    } ),
+    'token_counts': ( 'token_id', 'tokens', {
+        'positive_count': """
+            SELECT ppt.token_id, {value} FROM positive_prompt_tokens ppt
+            WHERE {condition}
+            GROUP BY ppt.token_id
+        """,
+        'negative_count': """
+            SELECT npt.token_id, {value} FROM negative_prompt_tokens npt
+            WHERE {condition}
+            GROUP BY npt.token_id
+        """,
+    } ),
+}
+
+# Counters that follow an image's live state, with the condition selecting images
+IMAGE_COUNTERS = (
+    ( 'art_style_counts', 'image_count' ),
+    ( 'positive_prompt_counts', 'image_count' ),
+    ( 'negative_prompt_counts', 'image_count' ),
+    ( 'tag_counts', 'image_count' ),
+)
+
+# table_counts name -> (table, condition of the counted rows)
+TABLE_COUNTS = {
+    'art-styles': ( 'art_styles', '1 = 1' ),
+    'positive-prompts': ( 'positive_prompts', '1 = 1' ),
+    'negative-prompts': ( 'negative_prompts', '1 = 1' ),
+    'tags': ( 'tags', '1 = 1' ),
+    'tokens': ( 'tokens', '1 = 1' ),
+    'images': ( 'images', 'deleted = 0' ),
+}
+
+ROW_COUNTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS table_counts (
+        name VARCHAR(32) PRIMARY KEY,
+        row_count INT NOT NULL DEFAULT 0,
+        generation INT NOT NULL DEFAULT 0
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+
+def counter_table( table ):
+    """CREATE TABLE statement of a counter table."""
+    key, _, columns = COUNTERS[table]
+    definitions = [f"{key} INT PRIMARY KEY"]
+    definitions += [f"{column} INT NOT NULL DEFAULT 0" for column in columns]
+    definitions += [f"INDEX idx_{column} ({column}, {key})" for column in columns]
+    return f"CREATE TABLE IF NOT EXISTS {table} ({', '.join( definitions )}) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci"
+
+def ensure_tables( cursor ):
+    """Create the counter tables if they don't exist yet."""
+    for table in COUNTERS:
+        cursor.execute( counter_table( table ) )
+    cursor.execute( ROW_COUNTS_TABLE )
+
+def add_rows( cursor, name, delta ):
+    """Add delta to a table's row count in table_counts and bump its generation (the caller commits)."""
+    if delta:
+        cursor.execute(
+            "INSERT INTO table_counts (name, row_count, generation) VALUES (%s, %s, 1) "
+            "ON DUPLICATE KEY UPDATE row_count = row_count + VALUES(row_count), generation = generation + 1",
+            ( name, delta )
+        )
+
+def add_counts( cursor, table, column, condition, params, sign=1, into=None ):
+    """Add sign times the counts of the rows matching condition to a counter column.
+
+    Args:
+        condition: SQL condition on the counter's query, with %s placeholders
+        params: Values of the placeholders
+        into: Table to write to (default: table itself)
+    """
+    key, _, queries = COUNTERS[table]
+    into = into or table
+    cursor.execute(
+        f"INSERT INTO {into} ({key}, {column}) " + queries[column].format( value="%s * COUNT(*)", condition=condition )
+        + f" ON DUPLICATE KEY UPDATE {column} = {into}.{column} + VALUES({column})",
+        [sign] + list( params )
+    )
+
+def add_batched( cursor, counters, column_sql, ids, sign=1 ):
+    """Apply add_counts for each counter to ids, LOOKUP_BATCH_SIZE at a time."""
+    ids = sorted( set( ids ) )
+    for start in range( 0, len( ids ), LOOKUP_BATCH_SIZE ):
+        batch = ids[start:start + LOOKUP_BATCH_SIZE]
+        condition = f"{column_sql} IN ({','.join( ['%s'] * len( batch ) )})"
+        for table, column in counters:
+            add_counts( cursor, table, column, condition, batch, sign )
+
+def add_images( cursor, image_ids, sign=1 ):
+    """Count live images into (sign=1) or out of (sign=-1) the style, prompt and tag counters.
+
+    Call with 1 after inserting images and with -1 before marking them deleted;
+    deleted images are never counted, so a repeated subtraction has no effect.
+    The live images are also added to the 'images' row count of table_counts.
+    The caller commits, together with the change itself.
+    """
+    image_ids = sorted( set( image_ids ) )
+    add_batched( cursor, IMAGE_COUNTERS, "i.id", image_ids, sign )
+
+    live = 0
+    for start in range( 0, len( image_ids ), LOOKUP_BATCH_SIZE ):
+        batch = image_ids[start:start + LOOKUP_BATCH_SIZE]
+        cursor.execute( f"SELECT COUNT(*) FROM images WHERE deleted = 0 AND id IN ({','.join( ['%s'] * len( batch ) )})", batch )
+        live += cursor.fetchone()[0]
+    add_rows( cursor, 'images', sign * live )
+
+def add_tag_links( cursor, image_ids, sign=1 ):
+    """Count the current tag links of live images into or out of tag_counts (around a tag edit)."""
+    add_batched( cursor, [( 'tag_counts', 'image_count' )], "it.image_id", image_ids, sign )
+
+def add_combinations( cursor, combination_ids ):
+    """Count newly created prompt combinations into their prompts' combinations_count."""
+    add_batched( cursor, [( 'positive_prompt_counts', 'combinations_count' ), ( 'negative_prompt_counts', 'combinations_count' )],
+                 "pc.id", combination_ids )
+
+def add_prompt_tokens( cursor, positive_prompt_ids=(), negative_prompt_ids=() ):
+    """Count the junction rows of newly tokenized prompts into token_counts."""
+    add_batched( cursor, [( 'token_counts', 'positive_count' )], "ppt.positive_prompt_id", positive_prompt_ids )
+    add_batched( cursor, [( 'token_counts', 'negative_count' )], "npt.negative_prompt_id", negative_prompt_ids )
+
+def reconcile_rows( cursor, fix=True ):
+    """Recount the rows of the tables in table_counts with COUNT(*) (see reconcile)."""
+    cursor.execute( "SELECT name, row_count FROM table_counts" )
+    stored = dict( cursor.fetchall() )
+    missing = stale = 0
+
+    for name, ( table, condition ) in TABLE_COUNTS.items():
+        cursor.execute( f"SELECT COUNT(*) FROM {table} WHERE {condition}" )
+        exact = cursor.fetchone()[0]
+        if name not in stored:
+            missing += 1
+        elif stored[name] != exact:
+            stale += 1
+        else:
+            continue
+        if fix:
+            cursor.execute(
+                "INSERT INTO table_counts (name, row_count, generation) VALUES (%s, %s, 1) "
+                "ON DUPLICATE KEY UPDATE row_count = VALUES(row_count), generation = generation + 1",
+                ( name, exact )
+            )
+
+    extra = [name for name in stored if name not in TABLE_COUNTS]
+    if fix and extra:
+        cursor.execute( f"DELETE FROM table_counts WHERE name IN ({','.join( ['%s'] * len( extra ) )})", extra )
+
+    return {'missing': missing, 'stale': stale, 'extra': len( extra )}
+
+def reconcile( db, tables=None, fix=True ):
+    """Recount counter tables from scratch and compare them with the stored rows.
+
+    The exact counts are built in a temporary table (with a zero row for every
+    entity), then only the rows that differ are written. Run it while nothing
+    else writes, or the changes made during the recount are reported as drift
+    (and fixed by the next run).
+
+    Args:
+        tables: Counter tables to check, including 'table_counts' (default: all)
+        fix: Correct the stored rows (False only counts them)
+
+    Returns:
+        {table: {'missing': n, 'stale': n, 'extra': n}} rows that differed
+    """
+    cursor = db.cursor()
+    results = {}
+
+    try:
+        ensure_tables( cursor )
+        for table in tables or list( COUNTERS ) + ['table_counts']:
+            if table == 'table_counts':
+                results[table] = reconcile_rows( cursor, fix )
+                db.commit()
+                continue
+
+            key, entities, columns = COUNTERS[table]
+            cursor.execute( "DROP TEMPORARY TABLE IF EXISTS counts_exact" )
+            cursor.execute( f"CREATE TEMPORARY TABLE counts_exact LIKE {table}" )
+            cursor.execute( f"INSERT INTO counts_exact ({key}) SELECT id FROM {entities}" )
+            for column in columns:
+                add_counts( cursor, table, column, "1 = 1", [], into='counts_exact' )
+
+            equal = ' AND '.join( f"c.{column} = e.{column}" for column in columns )
+            if fix:
+                cursor.execute( f"INSERT IGNORE INTO {table} SELECT * FROM counts_exact" )
+                missing = cursor.rowcount
+                cursor.execute( f"UPDATE {table} c JOIN counts_exact e ON e.{key} = c.{key} SET "
+                                + ', '.join( f"c.{column} = e.{column}" for column in columns ) + f" WHERE NOT ({equal})" )
+                stale = cursor.rowcount
+                cursor.execute( f"DELETE c FROM {table} c LEFT JOIN counts_exact e ON e.{key} = c.{key} WHERE e.{key} IS NULL" )
+                extra = cursor.rowcount
+            else:
+                cursor.execute( f"SELECT COUNT(*) FROM counts_exact e LEFT JOIN {table} c ON c.{key} = e.{key} WHERE c.{key} IS NULL" )
+                missing = cursor.fetchone()[0]
+                cursor.execute( f"SELECT COUNT(*) FROM {table} c JOIN counts_exact e ON e.{key} = c.{key} WHERE NOT ({equal})" )
+                stale = cursor.fetchone()[0]
+                cursor.execute( f"SELECT COUNT(*) FROM {table} c LEFT JOIN counts_exact e ON e.{key} = c.{key} WHERE e.{key} IS NULL" )
+                extra = cursor.fetchone()[0]
+
+            cursor.execute( "DROP TEMPORARY TABLE counts_exact" )
+            db.commit()
+            results[table] = {'missing': missing, 'stale': stale, 'extra': extra}
+    finally:
+        cursor.close()
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser( description='Check and reconcile the stored aggregate counters' )
+    parser.add_argument( '--check', action='store_true', help='Count counter rows that differ from a recount' )
+    parser.add_argument( '--reconcile', action='store_true', help='Recount and fix the rows that differ' )
+    parser.add_argument( '--tables', nargs='+', choices=list( COUNTERS ) + ['table_counts'], help='Counter tables to process (default: all)' )
+    args = parser.parse_args()
+
+    if not ( args.check or args.reconcile ):
+        parser.error( 'choose --check or --reconcile' )
+
+    db = get_connection()
+    try:
+        start = time.perf_counter()
+        results = reconcile( db, args.tables, fix=args.reconcile )
+        for table, result in results.items():
+            print( f"{table}: {result['missing']:,} missing, {result['stale']:,} stale, {result['extra']:,} extra rows"
+                   + ( " (fixed)" if args.reconcile and any( result.values() ) else "" ) )
+        print( f"Done in {time.perf_counter() - start:.1f}s" )
+        if args.check and any( any( result.values() ) for result in results.values() ):
+            exit( 1 )
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1406 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Python pipeline.
+
+Database benchmarks run against a scratch database on the local MySQL instance,
+which is dropped and recreated on every run. Never point --database at the real
+gallery database.
+
+Usage:
+    python benchmark.py insert                       # Per-row vs batched image inserts
+    python benchmark.py insert --pages 10 --page-size 200
+    python benchmark.py dedup --sizes 100000 1000000    # Scraper startup: JSON + set vs dedup index
+    python benchmark.py tokenize --workers 1 2 4 8      # Serial vs parallel tokenization (checks identical output)
+    python benchmark.py tokenize --fixture fixtures/prompts.jsonl   # Same check on the fixture corpus (no database)
+    python benchmark.py junction --rows 10000000        # Token relationship rebuild: in-memory executemany vs streamed LOAD DATA
+    python benchmark.py styles                          # Style string search: brute force vs suffix automaton
+    python benchmark.py groups --entries 1000000        # Prompt grouping: full rebuild vs incremental store
+    python benchmark.py folders --files 20000           # Group folder materialization per link mode
+    python benchmark.py layout --files 1000000          # Image existence checks and scans: flat vs sharded
+    python benchmark.py hashes --hashes 1000000         # Near-duplicate lookups: linear scan vs multi-index
+    python benchmark.py jpeg --images 300               # Per-image CPU time of the JPEG stage per setting
+    python benchmark.py feed --images 1000000           # Gallery browse pages: joined tables vs gallery feed
+    python benchmark.py search --images 300000          # Prompt search: LIKE / REGEXP scan vs word index
+    python benchmark.py pages --images 1000000          # Browse latency vs page depth: OFFSET vs cursor
+    python benchmark.py counts --images 300000          # Tables view: aggregated counts vs stored counters
+    python benchmark.py crawl                           # Crawler against the local gallery stand-in (checks what is stored)
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import accumulate, islice
+
+BENCHMARK_DATABASE = 'perchance_benchmark'
+
+
+class CountingCursor:
+    """Cursor proxy that counts statements sent to the server."""
+
+    def __init__( self, cursor ):
+        self.cursor = cursor
+        self.statements = 0
+
+    def execute( self, *args, **kwargs ):
+        self.statements += 1
+        return self.cursor.execute( *args, **kwargs )
+
+    def executemany( self, *args, **kwargs ):
+        self.statements += 1 # mysql-connector rewrites INSERT executemany into one multi-row statement
+        return self.cursor.executemany( *args, **kwargs )
+
+    def __getattr__( self, name ):
+        return getattr( self.cursor, name )
+
+
+def create_scratch_database( database ):
+    """Drop and recreate a scratch database with the gallery schema."""
+    from migrate_to_db import OptimalNormalizedDatabaseMigration
+
+    migration = OptimalNormalizedDatabaseMigration( database=database )
+    migration.connect()
+    migration.cursor.execute( f"DROP DATABASE IF EXISTS {database}" )
+    migration.cursor.execute( f"CREATE DATABASE {database}" )
+    migration.cursor.execute( f"USE {database}" )
+    migration.create_normalized_schema()
+    migration.close()
+
+
+def make_items( count, rng, offset=0 ):
+    """Build synthetic scraper items with realistic prompt, title and style reuse."""
+    styles = [f"style_{n}" for n in range( 30 )]
+    negatives = [f"blurry, lowres, watermark {n}" for n in range( 20 )] + ['']
+    items = []
+
+    for n in range( offset, offset + count ):
+        prompt_id = rng.randrange( max( 1, count // 2 ) )
+        items.append( {
+            "prompt": f"a detailed painting of subject {prompt_id}, dramatic lighting, highly detailed",
+            "negative_prompt": rng.choice( negatives ),
+            "seed": str( rng.randrange( 10**9 ) ),
+            "title": f"Untitled {rng.randrange( count )}",
+            "filename": f"bench_{n:08d}.jpg",
+            "date_downloaded": "2024-01-01",
+            "art_style": rng.choice( styles )
+        } )
+
+    return items
+
+
+def benchmark_insert( args ):
+    """Compare DatabaseManager.insert_image (per row) with insert_images (per page)."""
+    from scraper import DatabaseManager
+
+    rng = random.Random( args.seed )
+    pages = [make_items( args.page_size, rng, offset=p * args.page_size ) for p in range( args.pages )]
+
+    for mode in ( 'per-row', 'batched' ):
+        create_scratch_database( args.database )
+        db = DatabaseManager( database=args.database )
+        db.connect()
+        for statement in TAG_TABLES:
+            db.cursor.execute( statement )
+        db.cursor = CountingCursor( db.cursor )
+
+        start = time.perf_counter()
+        for items in pages:
+            if mode == 'per-row':
+                for item in items:
+                    db.insert_image( item )
+            else:
+                db.insert_images( items )
+        elapsed = time.perf_counter() - start
+
+        total = args.pages * args.page_size
+        print( f"{mode:>8}: {total} images in {elapsed:.2f}s "
+               f"({total / elapsed:,.0f} images/s, {db.cursor.statements / args.pages:,.0f} statements per page)" )
+        db.close()
+
+
+def peak_rss():
+    """Peak resident set size of this process in KB.
+
+    ru_maxrss survives fork+exec on Linux (a child would report the benchmark
+    parent's peak), so VmHWM from /proc is preferred where it exists.
+    """
+    try:
+        with open( '/proc/self/status' ) as f:
+            for line in f:
+                if line.startswith( 'VmHWM:' ): return int( line.split()[1] )
+    except OSError:
+        pass
+
+    try:
+        import resource
+        return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    except ImportError:
+        return 0
+
+
+# Child-process startup snippets; each prints "<seconds> <peak RSS in KB>"
+STARTUP_BASELINE = """
+import json, sys, time
+from benchmark import peak_rss
+start = time.perf_counter()
+with open( sys.argv[1], 'r', encoding='utf-8' ) as f:
+    known = {item['filename'] for item in json.load( f ) if item.get( 'filename' )}
+hits = sum( f'bench_{n:08d}.jpg' in known for n in range( 0, 2000000, 1000 ) )
+elapsed = time.perf_counter() - start
+print( elapsed, peak_rss() )
+"""
+
+STARTUP_INDEX = """
+import sys, time
+from benchmark import peak_rss
+from dedup_index import DedupIndex
+start = time.perf_counter()
+index = DedupIndex( sys.argv[1] )
+index.open()
+hits = sum( index.might_contain( f'bench_{n:08d}.jpg' ) for n in range( 0, 2000000, 1000 ) )
+elapsed = time.perf_counter() - start
+print( elapsed, peak_rss() )
+"""
+
+
+def measure_startup( snippet, path ):
+    """Run a startup snippet in a fresh interpreter, returning (seconds, peak RSS in MB)."""
+    output = subprocess.run(
+        [sys.executable, '-c', snippet, path],
+        cwd=os.path.dirname( os.path.abspath( __file__ ) ),
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout.split()
+    return float( output[0] ), int( output[1] ) / 1024
+
+
+def benchmark_dedup( args ):
+    """Compare scraper startup: loading results.json into a set vs opening the dedup index."""
+    from dedup_index import DedupIndex
+
+    rng = random.Random( args.seed )
+
+    with tempfile.TemporaryDirectory() as folder:
+        for size in args.sizes:
+            filenames = [f"bench_{n:08d}.jpg" for n in range( size )]
+
+            # Baseline input: a results.json array of the same size
+            results_path = os.path.join( folder, f"results_{size}.json" )
+            with open( results_path, 'w', encoding='utf-8' ) as f:
+                json.dump( [{'filename': name, 'prompt': f"prompt {rng.randrange( size )}"} for name in filenames], f )
+
+            index_path = os.path.join( folder, f"known_{size}.idx" )
+            build_start = time.perf_counter()
+            index = DedupIndex( index_path )
+            index.add( filenames )
+            index.save( size )
+            index.close()
+            build_elapsed = time.perf_counter() - build_start
+
+            baseline_time, baseline_rss = measure_startup( STARTUP_BASELINE, results_path )
+            index_time, index_rss = measure_startup( STARTUP_INDEX, index_path )
+
+            print( f"{size:>9,} filenames: json+set {baseline_time:.2f}s / {baseline_rss:,.0f} MB, "
+                   f"dedup index {index_time:.3f}s / {index_rss:,.0f} MB (index built in {build_elapsed:.1f}s)" )
+
+
+def make_prompts( count, rng ):
+    """Build synthetic (id, prompt, negative_prompt, style_string) rows with a Zipf-like token mix."""
+    vocabulary = [f"token {n}" for n in range( 20000 )]
+    weights = [1 / ( n + 1 ) for n in range( len( vocabulary ) )]
+    styles = [f"in the style of artist {n}, " for n in range( 30 )] + [None]
+    rows = []
+
+    for prompt_id in range( 1, count + 1 ):
+        tokens = rng.choices( vocabulary, weights, k=rng.randrange( 5, 40 ) )
+        style = rng.choice( styles )
+        prompt = ( style or '' ) + ', '.join( tokens ) + rng.choice( ['.', '\\n', '\n', ''] )
+        negative = '. '.join( rng.choices( vocabulary[:200], k=rng.randrange( 0, 8 ) ) )
+        rows.append( ( prompt_id, prompt, negative, style ) )
+
+    return rows
+
+def load_prompts( path ):
+    """Read (id, prompt, negative_prompt, style_string) rows from a JSON Lines corpus, numbered from 1."""
+    with open( path, 'r', encoding='utf-8' ) as f:
+        records = [json.loads( line ) for line in f if line.strip()]
+    return [( prompt_id, record['prompt'], record['negative_prompt'], record['style_string'] )
+            for prompt_id, record in enumerate( records, 1 )]
+
+
+def benchmark_tokenize( args ):
+    """Compare serial and multi-process tokenization and check that their outputs are identical."""
+    from tokenizer import count_tokens, merge_counts, map_shards, tokenize_prompts, tree_reduce
+
+    rows = load_prompts( args.fixture ) if args.fixture else make_prompts( args.prompts, random.Random( args.seed ) )
+    # The small fixture corpus still gets several shards, so the merge order is exercised
+    shard_size = min( args.shard_size, max( 1, len( rows ) // 8 ) ) if args.fixture else args.shard_size
+    count_rows = [( prompt, negative, style ) for _, prompt, negative, style in rows]
+    prompt_rows = [( prompt_id, prompt ) for prompt_id, prompt, _, _ in rows]
+
+    start = time.perf_counter()
+    expected_counts = count_tokens( count_rows )
+    expected_pairs = tokenize_prompts( prompt_rows )
+    serial = time.perf_counter() - start
+    print( f"{'serial':>10}: {len( rows ):,} prompts in {serial:.2f}s ({shard_size:,} per shard)" )
+
+    mismatches = 0
+    for workers in args.workers:
+        start = time.perf_counter()
+        counts = tree_reduce( map_shards( count_tokens, count_rows, workers, shard_size ), merge_counts )
+        pairs = [pair for shard in map_shards( tokenize_prompts, prompt_rows, workers, shard_size ) for pair in shard]
+        elapsed = time.perf_counter() - start
+
+        # Compare item order too: token IDs and tie order in the top lists follow first appearance
+        identical = ( list( counts[0].items() ) == list( expected_counts[0].items() )
+                      and list( counts[1].items() ) == list( expected_counts[1].items() )
+                      and pairs == expected_pairs )
+        mismatches += not identical
+        print( f"{workers:>2} workers: {elapsed:.2f}s ({serial / elapsed:.1f}x), "
+               f"output {'identical' if identical else 'DIFFERS'}" )
+
+    if mismatches:
+        sys.exit( 1 )
+
+
+JUNCTION_MODES = ( 'executemany', 'load-data', 'load-data-deferred' )
+JUNCTION_TOKENS = 200000
+JUNCTION_STRIDE = 104729    # prime, so a prompt's token IDs never repeat
+
+
+def connect_benchmark_database( database ):
+    """Connect to the scratch database with LOCAL INFILE enabled."""
+    from bulk_loader import loader_connection
+
+    return loader_connection( database )
+
+
+def junction_prompt_text( prompt, per_prompt ):
+    """Text of synthetic prompt number prompt: per_prompt distinct comma-separated tokens."""
+    return ', '.join( f"token {( prompt * 7919 + position * JUNCTION_STRIDE ) % JUNCTION_TOKENS}" for position in range( per_prompt ) )
+
+
+def setup_junction_database( args ):
+    """Create the scratch schema with the positive prompts whose relationships are rebuilt."""
+    create_scratch_database( args.database )
+    db = connect_benchmark_database( args.database )
+    cursor = db.cursor()
+    for statement in TAG_TABLES:
+        cursor.execute( statement )
+
+    prompts = args.rows // args.per_prompt
+    insert_rows( db, cursor, "INSERT INTO positive_prompts (id, hash, prompt_text) VALUES (%s, %s, %s)",
+                 ( ( n, f"{n:064d}", junction_prompt_text( n, args.per_prompt ) ) for n in range( 1, prompts + 1 ) ) )
+    db.close()
+
+
+def run_junction_mode( args ):
+    """Rebuild the token relationships once with one mode and print '<seconds> <peak RSS in KB>'."""
+    from aggregate_counts import reconcile
+    from build_token_relationships import distinct_tokens, full_rebuild, junction_rows, resolve_token_ids
+    from database import iter_rows
+    from tokenizer import map_shards, tokenize_prompts
+
+    db = connect_benchmark_database( args.database )
+    cursor = db.cursor()
+
+    start = time.perf_counter()
+    if args.mode == 'executemany':
+        # The previous approach: every prompt's tokens and every pair in memory, then a single executemany
+        with open( 'create_token_tables.sql', 'r', encoding='utf-8' ) as f:
+            for statement in f.read().split( ';' ):
+                if statement.strip(): cursor.execute( statement )
+        prompts = iter_rows( db, "SELECT id, prompt_text FROM positive_prompts ORDER BY id" )
+        tokenized = [pair for shard in map_shards( tokenize_prompts, prompts ) for pair in shard]
+        token_ids, _ = resolve_token_ids( cursor, db, distinct_tokens( tokenized ), fresh=True )
+        relationships = list( junction_rows( tokenized, token_ids ) )
+        cursor.executemany( "INSERT IGNORE INTO positive_prompt_tokens (positive_prompt_id, token_id) VALUES (%s, %s)", relationships )
+        db.commit()
+        reconcile( db, ['token_counts', 'table_counts'] )
+    else:
+        # The real rebuild path, streamed shard by shard
+        full_rebuild( cursor, db, chunk_rows=args.chunk_rows, defer_indexes=args.mode == 'load-data-deferred' )
+    elapsed = time.perf_counter() - start
+
+    db.close()
+    print( elapsed, peak_rss() )
+
+
+def benchmark_junction( args ):
+    """Compare full token relationship rebuilds by throughput and peak memory."""
+    if args.mode:
+        run_junction_mode( args )
+        return
+
+    rows = args.rows // args.per_prompt * args.per_prompt
+    print( f"Preparing {args.database} with {rows // args.per_prompt:,} prompts ({rows:,} relationship rows)..." )
+    setup_junction_database( args )
+
+    for mode in args.modes:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath( __file__ ), '--database', args.database, 'junction',
+             '--rows', str( args.rows ), '--per-prompt', str( args.per_prompt ),
+             '--chunk-rows', str( args.chunk_rows ), '--mode', mode],
+            cwd=os.path.dirname( os.path.abspath( __file__ ) ),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.split()
+        elapsed, rss = float( output[-2] ), int( output[-1] ) / 1024
+
+        print( f"{mode:>18}: {rows:,} rows in {elapsed:.1f}s "
+               f"({rows / elapsed:,.0f} rows/s), peak RSS {rss:,.0f} MB" )
+
+
+def make_style_prompts( styles, prompts_per_style, prompt_length, rng ):
+    """Build synthetic styles whose prompts share a style string at a random position."""
+    words = [f"word{n}" for n in range( 500 )]
+    fixture = {}
+
+    for n in range( styles ):
+        style_string = f"in the style of artist {n}, " + ', '.join( rng.choices( words, k=4 ) )
+        prompts = []
+        for _ in range( prompts_per_style ):
+            filler = ', '.join( rng.choices( words, k=prompt_length // 7 ) )
+            cut = rng.randrange( len( filler ) + 1 )
+            prompts.append( filler[:cut] + ' ' + style_string + ' ' + filler[cut:] )
+        fixture[f"style_{n}"] = prompts
+
+    return fixture
+
+
+def benchmark_styles( args ):
+    """Compare the brute-force style string search with the suffix automaton and check results match."""
+    from concurrent.futures import ProcessPoolExecutor
+    from common_substring import find_common_substring, find_common_substring_naive
+
+    fixture = make_style_prompts( args.styles, args.prompts, args.prompt_length, random.Random( args.seed ) )
+
+    start = time.perf_counter()
+    expected = {style: find_common_substring_naive( prompts ) for style, prompts in fixture.items()}
+    naive = time.perf_counter() - start
+    print( f"{'brute force':>16}: {naive:.2f}s" )
+
+    mismatches = 0
+    for label, sample_size in ( ( 'automaton', 0 ), ( 'automaton+sample', args.sample_size ) ):
+        start = time.perf_counter()
+        if args.workers > 1:
+            with ProcessPoolExecutor( max_workers=args.workers ) as pool:
+                found = dict( zip( fixture, pool.map( find_common_substring, fixture.values(), [sample_size] * len( fixture ) ) ) )
+        else:
+            found = {style: find_common_substring( prompts, sample_size ) for style, prompts in fixture.items()}
+        elapsed = time.perf_counter() - start
+
+        identical = found == expected
+        mismatches += not identical
+        print( f"{label:>16}: {elapsed:.2f}s ({naive / elapsed:.0f}x), results {'identical' if identical else 'DIFFER'}" )
+
+    if mismatches:
+        sys.exit( 1 )
+
+
+def make_group_entries( start, count, prompts, large_groups, large_share, rng ):
+    """Build result entries where large_share of images fall into a few very large groups."""
+    entries = []
+    for n in range( start, start + count ):
+        if rng.random() < large_share:
+            prompt = f"large group prompt {rng.randrange( large_groups )}"
+        else:
+            prompt = f"prompt {rng.randrange( prompts )}, " + "detail " * rng.randrange( 5 )
+        entries.append( {'filename': f"bench_{n:08d}.jpg", 'prompt': prompt, 'negative_prompt': rng.choice( ['', 'blurry'] )} )
+    return entries
+
+
+def merge_groups_list_scan( existing, new ):
+    """The original merge: list membership scans, quadratic in the group size."""
+    merged = dict( existing )
+    for key, filenames in new.items():
+        if key in merged:
+            merged[key].extend( f for f in filenames if f not in merged[key] )
+        else:
+            merged[key] = filenames
+    return merged
+
+
+def benchmark_groups( args ):
+    """Time a full grouping of the results log, then an incremental regroup after a scrape."""
+    from pathlib import Path
+    from group_prompts import group_entries, by_hash, iter_new_results, export_index
+    from group_store import GroupStore
+    from results_log import ResultsLog, iter_results
+
+    rng = random.Random( args.seed )
+
+    with tempfile.TemporaryDirectory() as folder:
+        results_path = os.path.join( folder, 'results.jsonl' )
+        store_path = os.path.join( folder, 'grouped.jsonl' )
+        log = ResultsLog( results_path )
+        for start in range( 0, args.entries, 100000 ):
+            log.append( make_group_entries( start, min( 100000, args.entries - start ), args.prompts, args.large_groups, args.large_share, rng ) )
+
+        def regroup():
+            store = GroupStore( store_path )
+            store.open()
+            groups, _ = group_entries( iter_new_results( results_path, store.position ) )
+            changed = store.update( by_hash( groups ) )
+            store.save()
+            return store, changed
+
+        start = time.perf_counter()
+        store, changed = regroup()
+        largest = max( entry[2] for entry in store.index.values() )
+        print( f"  full build: {args.entries:,} entries -> {len( store ):,} groups (largest {largest:,}) "
+               f"in {time.perf_counter() - start:.1f}s" )
+        store.close()
+
+        # Input for the original path: the groups it would have loaded from grouped.json
+        existing, _ = group_entries( iter_results( results_path ) )
+
+        # A scrape adds a batch of new entries, some of them to the largest groups
+        new_entries = make_group_entries( args.entries, args.new_entries, args.prompts, args.large_groups, args.large_share, rng )
+        log.append( new_entries )
+
+        size_before = os.path.getsize( store_path )
+        start = time.perf_counter()
+        store, changed = regroup()
+        incremental = time.perf_counter() - start
+        print( f" incremental: {args.new_entries:,} new entries -> {len( changed ):,} groups rewritten "
+               f"({( os.path.getsize( store_path ) - size_before ) / 1e6:,.1f} MB appended) in {incremental:.2f}s" )
+
+        # The original path: regroup everything in memory, list-scan merge, rewrite with indent=2
+        new_groups, _ = group_entries( new_entries )
+        start = time.perf_counter()
+        merged = merge_groups_list_scan( existing, new_groups )
+        scan = time.perf_counter() - start
+        start = time.perf_counter()
+        json.dumps( [{'prompt': key[0], 'negative_prompt': key[1], 'filenames': names} for key, names in merged.items()], indent=2 )
+        rewrite = time.perf_counter() - start
+        print( f"    original: list-scan merge {scan:.2f}s + indent=2 rewrite {rewrite:.2f}s (before reading any input)" )
+
+        # The store must hold exactly what a from-scratch grouping produces
+        expected = {group_hash: names for group_hash, ( _, _, names ) in by_hash( merged ).items()}
+        found = {group['hash']: group['filenames'] for group in store.iter_groups()}
+        identical = found == expected
+        print( f"  store matches a full regroup: {'yes' if identical else 'NO'}" )
+
+        start = time.perf_counter()
+        export_index( store, Path( folder ) / 'grouped.json', 1, 10, results_path )
+        print( f"      export: single-file index in {time.perf_counter() - start:.1f}s" )
+        store.close()
+
+        if not identical:
+            sys.exit( 1 )
+
+
+def benchmark_folders( args ):
+    """Time group folder materialization per link mode, and a re-run that finds everything in place."""
+    from pathlib import Path
+    from group_prompts import create_group_folders
+
+    rng = random.Random( args.seed )
+
+    with tempfile.TemporaryDirectory( dir=args.dir ) as folder:
+        images = Path( folder ) / 'images' / 'medium'
+        images.mkdir( parents=True )
+        payload = os.urandom( args.file_size )
+        for n in range( args.files ):
+            ( images / f"bench_{n:08d}.jpg" ).write_bytes( payload )
+
+        names = [f"bench_{n:08d}.jpg" for n in range( args.files )]
+        groups = [{'hash': f"group{n:05d}", 'filenames': []} for n in range( args.groups )]
+        for name in names:
+            rng.choice( groups )['filenames'].append( name )
+
+        for mode in args.modes:
+            for workers in args.workers:
+                shutil.rmtree( Path( folder ) / 'images' / 'groups', ignore_errors=True )
+                start = time.perf_counter()
+                counts = create_group_folders( images, groups, copy=True, mode=mode, workers=workers )
+                elapsed = time.perf_counter() - start
+
+                start = time.perf_counter()
+                create_group_folders( images, groups, copy=True, mode=mode, workers=workers )
+                rerun = time.perf_counter() - start
+
+                placed = ', '.join( f"{key} {value:,}" for key, value in sorted( counts.items() ) )
+                print( f"{mode:>9} x{workers:<2}: {elapsed:.2f}s ({placed}), re-run {rerun:.2f}s" )
+
+
+def time_lookups( layout, names ):
+    """Return the seconds taken to locate each name."""
+    start = time.perf_counter()
+    for name in names:
+        layout.locate( name )
+    return time.perf_counter() - start
+
+def time_scan( layout ):
+    """Return (files found, seconds) for a full listing of an image root."""
+    start = time.perf_counter()
+    found = sum( 1 for _ in layout.iter_files() )
+    return found, time.perf_counter() - start
+
+def benchmark_layout( args ):
+    """Time existence checks and full scans of an image root, flat vs sharded, and the migration between them."""
+    import image_layout
+    from image_layout import ImageLayout, flatten, migrate
+
+    image_layout.REFRESH_INTERVAL = 0 # nothing else uses the fixture, don't wait for other processes
+    rng = random.Random( args.seed )
+
+    with tempfile.TemporaryDirectory( dir=args.dir ) as folder:
+        root = os.path.join( folder, 'medium' )
+        os.makedirs( root )
+        start = time.perf_counter()
+        for n in range( args.files ):
+            open( os.path.join( root, f"bench_{n:08d}.jpg" ), 'wb' ).close()
+        print( f"Created {args.files:,} empty files in {time.perf_counter() - start:.1f}s" )
+
+        hits = [f"bench_{rng.randrange( args.files ):08d}.jpg" for _ in range( args.lookups )]
+        misses = [f"missing_{n:08d}.jpg" for n in range( args.lookups )]
+
+        def measure( label ):
+            layout = ImageLayout( root )
+            hit_time = time_lookups( layout, hits )
+            miss_time = time_lookups( layout, misses )
+            found, scan_time = time_scan( layout )
+            print( f"{label:>9}: {args.lookups:,} hits {hit_time / args.lookups * 1e6:.1f} us each, "
+                   f"misses {miss_time / args.lookups * 1e6:.1f} us each, full scan {scan_time:.2f}s ({found:,} files)" )
+            return found
+
+        measure( 'flat' )
+
+        start = time.perf_counter()
+        moved = migrate( root, args.workers )
+        print( f"  migrate: {moved:,} files in {time.perf_counter() - start:.1f}s with {args.workers} threads" )
+        found = measure( 'sharded' )
+
+        layout = ImageLayout( root )
+        with os.scandir( root ) as entries:
+            top_level = sum( 1 for _ in entries )
+        located = sum( layout.exists( name ) for name in hits )
+        print( f"  largest directory: {top_level:,} entries in the root, every hit located: {'yes' if located == len( hits ) else 'NO'}" )
+
+        start = time.perf_counter()
+        flatten( root, args.workers )
+        print( f"  flatten: {time.perf_counter() - start:.1f}s" )
+
+        if found != args.files or located != len( hits ) or sum( 1 for _ in ImageLayout( root ).iter_files() ) != args.files:
+            sys.exit( 1 )
+
+
+def make_test_image( rng, size=512 ):
+    """Random smooth test image: a few overlapping rectangles of random colours."""
+    from PIL import Image, ImageDraw
+
+    img = Image.new( 'RGB', ( size, size ), tuple( rng.randrange( 256 ) for _ in range( 3 ) ) )
+    draw = ImageDraw.Draw( img )
+    for _ in range( 12 ):
+        x, y = rng.randrange( size ), rng.randrange( size )
+        draw.rectangle( ( x, y, x + rng.randrange( 40, 200 ), y + rng.randrange( 40, 200 ) ),
+                        fill=tuple( rng.randrange( 256 ) for _ in range( 3 ) ) )
+    return img
+
+def benchmark_hashes( args ):
+    """Check dHash stability on edited copies, time file hashing, and time near-duplicate lookups."""
+    import io
+    from concurrent.futures import ProcessPoolExecutor
+    from imaging import compress_image, dhash, hash_file
+    from near_duplicates import HammingIndex, hamming
+
+    rng = random.Random( args.seed )
+
+    # Hash stability: re-encoded and resized copies should stay close, different images far apart
+    with tempfile.TemporaryDirectory( dir=args.dir ) as folder:
+        paths = []
+        copy_distances = []
+        for n in range( args.images ):
+            img = make_test_image( rng )
+            buffer = io.BytesIO()
+            img.save( buffer, 'PNG' )
+            path = os.path.join( folder, f"bench_{n:06d}.jpg" )
+            original = compress_image( buffer.getvalue(), path )['dhash']
+            paths.append( path )
+            copy_distances.append( hamming( original, hash_file( path ) ) )
+            copy_distances.append( hamming( original, dhash( img.resize( ( 300, 300 ) ) ) ) )
+
+        image_hashes = [hash_file( path ) for path in paths]
+        distinct = [hamming( a, b ) for a, b in zip( image_hashes, image_hashes[1:] )]
+        print( f"dHash: edited copies differ by at most {max( copy_distances )} bits, "
+               f"different images by at least {min( distinct )} bits" )
+
+        for workers in args.workers:
+            start = time.perf_counter()
+            with ProcessPoolExecutor( max_workers=workers ) as pool:
+                list( pool.map( hash_file, paths, chunksize=32 ) )
+            elapsed = time.perf_counter() - start
+            print( f"  hashing x{workers}: {len( paths ) / elapsed:,.0f} files/s" )
+
+    # Lookups: random hashes plus planted near duplicates
+    values = [rng.getrandbits( 64 ) for _ in range( args.hashes )]
+    queries = []
+    for _ in range( args.queries ):
+        value = rng.choice( values )
+        for bit in rng.sample( range( 64 ), rng.randrange( args.distance + 1 ) ):
+            value ^= 1 << bit
+        queries.append( value )
+
+    start = time.perf_counter()
+    index = HammingIndex( args.distance )
+    for key, value in enumerate( values ):
+        index.add( key, value )
+    print( f"Index of {args.hashes:,} hashes built in {time.perf_counter() - start:.1f}s" )
+
+    start = time.perf_counter()
+    found = [index.query( value ) for value in queries]
+    elapsed = time.perf_counter() - start
+    print( f"  multi-index: {elapsed / len( queries ) * 1000:.3f} ms per query" )
+
+    scan_queries = queries[:args.scan_queries]
+    start = time.perf_counter()
+    expected = [sorted( ( hamming( value, other ), key ) for key, other in enumerate( values ) if hamming( value, other ) <= args.distance )
+                for value in scan_queries]
+    elapsed = time.perf_counter() - start
+    print( f"  linear scan: {elapsed / len( scan_queries ) * 1000:.1f} ms per query" )
+
+    identical = found[:len( scan_queries )] == expected and all( found )
+    print( f"  results match the linear scan: {'yes' if identical else 'NO'}" )
+    if not identical:
+        sys.exit( 1 )
+
+
+JPEG_VARIANTS = {
+    'original': {'passthrough_quality': 0},     # always decode and re-encode, as before the settings existed
+    'no-optimize': {'optimize': False, 'passthrough_quality': 0},
+    'passthrough': {},
+    'max-size': {'max_size': 512},
+    'thumbnail': {'thumbnail_size': 256},
+}
+FIXTURE_KINDS = ( 'png', 'large jpeg', 'small jpeg' )
+
+def make_fixture_images( count, rng ):
+    """Encoded test images as (kind, bytes): large PNGs, large high-quality JPEGs and small low-quality JPEGs."""
+    import io
+    from PIL import Image
+
+    fixtures = []
+    for n in range( count ):
+        kind = FIXTURE_KINDS[n % len( FIXTURE_KINDS )]
+        size = 512 if kind == 'small jpeg' else 1024
+        img = make_test_image( rng, size )
+        noise = Image.effect_noise( ( size, size ), 40 ).convert( 'RGB' )
+        img = Image.blend( img, noise, 0.15 )   # texture, so files are not trivially small
+
+        buffer = io.BytesIO()
+        if kind == 'png':
+            img.save( buffer, 'PNG' )
+        else:
+            img.save( buffer, 'JPEG', quality=95 if kind == 'large jpeg' else 50 )
+        fixtures.append( ( kind, buffer.getvalue() ) )
+    return fixtures
+
+def benchmark_jpeg( args ):
+    """Time compress_image per settings variant and source kind, checking every output decodes at the reported size."""
+    from PIL import Image
+    from imaging import compress_image
+
+    rng = random.Random( args.seed )
+    fixtures = make_fixture_images( args.images, rng )
+    print( f"{len( fixtures )} fixture images ({', '.join( FIXTURE_KINDS )}), "
+           f"{sum( len( content ) for _, content in fixtures ) / 1e6:.1f} MB" )
+    print( f"{'':>12}  {'  '.join( f'{kind:>10}' for kind in FIXTURE_KINDS )}  {'all':>8}  stored   (ms CPU per image)" )
+
+    ok = True
+    with tempfile.TemporaryDirectory( dir=args.dir ) as folder:
+        for name in args.variants:
+            settings = JPEG_VARIANTS[name]
+            out_path = os.path.join( folder, 'out.jpg' )
+            thumbnail_path = os.path.join( folder, 'thumb.jpg' ) if settings.get( 'thumbnail_size' ) else None
+
+            cpu = {kind: [] for kind in FIXTURE_KINDS}
+            stored = 0
+            for kind, content in fixtures:
+                start = time.process_time()
+                info = compress_image( content, out_path, settings, thumbnail_path )
+                cpu[kind].append( time.process_time() - start )
+                stored += info['file_size']
+
+                with Image.open( out_path ) as img:
+                    ok &= img.size == ( info['width'], info['height'] ) and os.path.getsize( out_path ) == info['file_size']
+
+            per_kind = '  '.join( f"{sum( times ) / len( times ) * 1000:10.1f}" for times in cpu.values() )
+            overall = sum( sum( times ) for times in cpu.values() ) / len( fixtures ) * 1000
+            print( f"{name:>12}  {per_kind}  {overall:8.1f}  {stored / 1e6:.1f} MB" )
+
+    print( f"  outputs match the reported size: {'yes' if ok else 'NO'}" )
+    if not ok:
+        sys.exit( 1 )
+
+
+# tags and image_tags are created outside migrate_to_db.py (see DATABASE_SCHEMA.md)
+TAG_TABLES = (
+    """CREATE TABLE IF NOT EXISTS tags (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) UNIQUE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_name (name)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci""",
+    """CREATE TABLE IF NOT EXISTS image_tags (
+        image_id INT NOT NULL,
+        tag_id INT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (image_id, tag_id),
+        FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE,
+        FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE,
+        INDEX idx_tag_id (tag_id),
+        INDEX idx_image_id (image_id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci"""
+)
+FEED_VOCABULARY = 5000     # distinct prompt words, used with Zipf-like frequencies
+
+def make_prompt_text( rng, words, weights ):
+    """Synthetic prompt: comma-separated phrases of a few words each."""
+    return ', '.join(
+        ' '.join( rng.choices( words, cum_weights=weights, k=rng.randint( 1, 4 ) ) )
+        for _ in range( rng.randint( 3, 8 ) )
+    )
+
+def insert_rows( db, cursor, sql, rows, batch=10000 ):
+    """executemany a generator of rows in batches, committing after each."""
+    rows = iter( rows )
+    while True:
+        chunk = list( islice( rows, batch ) )
+        if not chunk: break
+        cursor.executemany( sql, chunk )
+        db.commit()
+
+def setup_feed_database( args, rng ):
+    """Fill the scratch schema with synthetic images, prompts, styles, titles and tags."""
+    create_scratch_database( args.database )
+    db = connect_benchmark_database( args.database )
+    cursor = db.cursor()
+    for statement in TAG_TABLES:
+        cursor.execute( statement )
+
+    prompts = max( 1, args.images // 5 )
+    negatives = max( 1, prompts // 20 )
+    words = list( dict.fromkeys( ''.join( rng.choices( 'abcdefghijklmnopqrstuvwxyz', k=rng.randint( 4, 10 ) ) ) for _ in range( FEED_VOCABULARY ) ) )
+    weights = list( accumulate( 1 / ( rank + 1 ) for rank in range( len( words ) ) ) )
+    text = lambda: make_prompt_text( rng, words, weights )
+    insert_rows( db, cursor, "INSERT INTO positive_prompts (id, hash, prompt_text) VALUES (%s, %s, %s)",
+                 ( ( n, f"p{n:063d}", f"{text()} {n}" ) for n in range( 1, prompts + 1 ) ) )
+    insert_rows( db, cursor, "INSERT INTO negative_prompts (id, hash, prompt_text) VALUES (%s, %s, %s)",
+                 ( ( n, f"n{n:063d}", f"{text()} {n}" ) for n in range( 1, negatives + 1 ) ) )
+    insert_rows( db, cursor, "INSERT INTO prompt_combinations (id, positive_prompt_id, negative_prompt_id, hash) VALUES (%s, %s, %s, %s)",
+                 ( ( n, n, rng.randint( 1, negatives ), f"c{n:063d}" ) for n in range( 1, prompts + 1 ) ) )
+    insert_rows( db, cursor, "INSERT INTO art_styles (id, name) VALUES (%s, %s)",
+                 ( ( n, f"style {n}" ) for n in range( 1, args.styles + 1 ) ) )
+    insert_rows( db, cursor, "INSERT INTO titles (id, hash, title_text) VALUES (%s, %s, %s)",
+                 ( ( n, f"t{n:063d}", f"title {n}" ) for n in range( 1, 1001 ) ) )
+    insert_rows( db, cursor, "INSERT INTO tags (id, name) VALUES (%s, %s)",
+                 ( ( n, f"tag{n}" ) for n in range( 1, args.tags + 1 ) ) )
+
+    insert_rows( db, cursor, """
+        INSERT INTO images (id, filename, prompt_combination_id, art_style_id, title_id, seed, date_downloaded, deleted)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, ( (
+        n, f"{n:010d}.jpeg", rng.randint( 1, prompts ),
+        rng.randint( 1, args.styles ) if rng.random() > 0.1 else None,  # 10% without a style
+        rng.randint( 1, 1000 ), str( rng.getrandbits( 32 ) ), '2025-01-01',
+        int( rng.random() < 0.02 )                                      # 2% deleted
+    ) for n in range( 1, args.images + 1 ) ) )
+
+    # Tags apply to every image of a prompt combination, so tag about 20% of the images
+    insert_rows( db, cursor, "INSERT IGNORE INTO image_tags (image_id, tag_id) VALUES (%s, %s)",
+                 ( ( n, rng.randint( 1, args.tags ) ) for n in range( 1, args.images + 1 ) for _ in range( 2 ) if rng.random() < 0.2 ) )
+    cursor.close()
+    return db
+
+def joined_page( cursor, mode, limit, offset ):
+    """One browse page with the joins data.php ran before the feed existed."""
+    from gallery_feed import FEED_SELECT
+
+    select = FEED_SELECT.format( condition="1" )
+    if mode == 'style':
+        cursor.execute( select + " GROUP BY i.id ORDER BY CASE WHEN a.name IS NULL THEN 1 ELSE 0 END, a.name ASC, i.id DESC LIMIT %s OFFSET %s", ( limit, offset ) )
+    elif mode == 'prompt':
+        cursor.execute( """
+            SELECT pp.hash FROM images i
+            JOIN prompt_combinations pc ON i.prompt_combination_id = pc.id
+            LEFT JOIN positive_prompts pp ON pc.positive_prompt_id = pp.id
+            WHERE i.deleted = 0
+            GROUP BY pp.hash ORDER BY MIN(pp.prompt_text) ASC LIMIT %s OFFSET %s
+        """, ( limit, offset ) )
+        hashes = [row[0] for row in cursor.fetchall()]
+        if not hashes: return []
+        cursor.execute( FEED_SELECT.format( condition=f"pp.hash IN ({','.join( ['%s'] * len( hashes ) )})" )
+                        + " GROUP BY i.id ORDER BY pp.prompt_text ASC, i.id DESC", hashes )
+    else:
+        cursor.execute( select + " GROUP BY i.id ORDER BY i.id DESC LIMIT %s OFFSET %s", ( limit, offset ) )
+    return [row[2] for row in cursor.fetchall()]
+
+FEED_QUERIES = {
+    'recent': "SELECT image_id, filename, tags FROM gallery_feed ORDER BY image_id DESC LIMIT %s OFFSET %s",
+    'style': "SELECT image_id, filename, tags FROM gallery_feed ORDER BY style_missing, art_style, newest_first LIMIT %s OFFSET %s",
+    'prompt-groups': """
+        SELECT prompt_hash FROM gallery_feed WHERE prompt_hash IS NOT NULL
+        GROUP BY prompt_key, prompt_hash ORDER BY prompt_key, prompt_hash LIMIT %s OFFSET %s
+    """,
+    'prompt': "SELECT image_id, filename, tags FROM gallery_feed WHERE prompt_hash IN ({hashes}) ORDER BY prompt_key, prompt_hash, newest_first",
+}
+
+def feed_page( cursor, mode, limit, offset ):
+    """One browse page from the gallery feed, as data.php reads it."""
+    if mode == 'prompt':
+        cursor.execute( FEED_QUERIES['prompt-groups'], ( limit, offset ) )
+        hashes = [row[0] for row in cursor.fetchall()]
+        if not hashes: return []
+        cursor.execute( FEED_QUERIES['prompt'].format( hashes=','.join( ['%s'] * len( hashes ) ) ), hashes )
+    else:
+        cursor.execute( FEED_QUERIES[mode], ( limit, offset ) )
+    return [row[1] for row in cursor.fetchall()]
+
+def time_page( page, cursor, mode, limit, offset, repeat ):
+    """Best of repeat runs of a page query in ms, with the page's filenames."""
+    best = None
+    for _ in range( repeat ):
+        start = time.perf_counter()
+        filenames = page( cursor, mode, limit, offset )
+        elapsed = ( time.perf_counter() - start ) * 1000
+        best = elapsed if best is None else min( best, elapsed )
+    return best, filenames
+
+def benchmark_feed( args ):
+    """Compare browse pages from the joined tables and the gallery feed, checking identical results."""
+    from gallery_feed import check, refresh_images, rebuild
+
+    rng = random.Random( args.seed )
+    print( f"Preparing {args.database} with {args.images:,} images..." )
+    start = time.perf_counter()
+    db = setup_feed_database( args, rng )
+    print( f"  done in {time.perf_counter() - start:.0f}s" )
+
+    start = time.perf_counter()
+    rows = rebuild( db )
+    print( f"Feed rebuilt: {rows:,} rows in {time.perf_counter() - start:.1f}s" )
+
+    cursor = db.cursor()
+    ok = True
+    print( f"{'':>8} {'offset':>8} {'joined':>10} {'feed':>10}   (ms per page of {args.limit})" )
+    for mode in ( 'recent', 'style', 'prompt' ):
+        for offset in args.offsets:
+            joined_ms, expected = time_page( joined_page, cursor, mode, args.limit, offset, args.repeat )
+            feed_ms, found = time_page( feed_page, cursor, mode, args.limit, offset, args.repeat )
+            ok &= found == expected
+            print( f"{mode:>8} {offset:>8,} {joined_ms:10.1f} {feed_ms:10.1f}{'' if found == expected else '   MISMATCH'}" )
+
+    # Each feed query should be a single-table read through an index, without a filesort
+    for name, query in FEED_QUERIES.items():
+        cursor.execute( "EXPLAIN " + query.format( hashes="'x'" ).replace( '%s', '1' ) )
+        plans = cursor.fetchall()
+        columns = [column[0] for column in cursor.description]
+        plan = dict( zip( columns, plans[0] ) )
+        print( f"  EXPLAIN {name}: {len( plans )} table(s), key {plan['key']}, {plan['Extra'] or '-'}" )
+
+    # Incremental maintenance: one scraped page and one tag edit
+    image_ids = list( range( args.images - args.limit + 1, args.images + 1 ) )
+    start = time.perf_counter()
+    refresh_images( cursor, image_ids )
+    db.commit()
+    print( f"  refresh of {len( image_ids )} images: {( time.perf_counter() - start ) * 1000:.1f} ms" )
+
+    cursor.execute( "INSERT IGNORE INTO image_tags (image_id, tag_id) VALUES (%s, 1)", ( image_ids[0], ) )
+    refresh_images( cursor, image_ids[:1] )
+    db.commit()
+    result = check( db )
+    print( f"  feed check: {result['missing']:,} missing, {result['stale']:,} stale, {result['extra']:,} extra" )
+    ok &= not any( result.values() )
+
+    cursor.close()
+    db.close()
+    print( f"  results match the joined queries: {'yes' if ok else 'NO'}" )
+    if not ok:
+        sys.exit( 1 )
+
+
+def search_queries( prompts, count, rng ):
+    """Search terms taken from sample prompts: {kind: [(term, whole_words)]}."""
+    queries = {'word': [], 'phrase': [], 'substring': [], 'span': []}
+    for _ in range( count ):
+        prompt = rng.choice( prompts )
+        words = prompt.replace( ',', '' ).split()
+        word = rng.choice( words )
+        queries['word'].append( ( word, True ) )
+        position = rng.randrange( len( words ) - 1 ) if len( words ) > 1 else 0
+        queries['phrase'].append( ( ' '.join( words[position:position + 2] ), True ) )
+        start = rng.randrange( max( 1, len( word ) - 3 ) )
+        queries['substring'].append( ( word[start:start + 4], False ) )
+        # Any slice of the text, so terms cut words and cross spaces and commas
+        start = rng.randrange( max( 1, len( prompt ) - 10 ) )
+        queries['span'].append( ( prompt[start:start + 10], False ) )
+    return queries
+
+def benchmark_search( args ):
+    """Time prompt searches: LIKE / REGEXP scans of the feed vs the word index, checking identical matches."""
+    from gallery_feed import rebuild
+    from search_index import search_condition, update_index
+
+    rng = random.Random( args.seed )
+    print( f"Preparing {args.database} with {args.images:,} images ({args.images // 5:,} prompts)..." )
+    db = setup_feed_database( args, rng )
+    cursor = db.cursor()
+
+    start = time.perf_counter()
+    stats = update_index( db, rebuild=True )
+    print( f"Word index: {stats['prompts']:,} prompts, {stats['words']:,} prompt words in {time.perf_counter() - start:.1f}s" )
+    rebuild( db )
+
+    cursor.execute( "SELECT prompt_text FROM positive_prompts ORDER BY RAND(%s) LIMIT 1000", ( args.seed, ) )
+    prompts = [row[0] for row in cursor.fetchall()]
+    queries = search_queries( prompts, args.queries, rng )
+
+    ok = True
+    print( f"{'':>10} {'scan':>10} {'index':>10}  matches   (median ms per query)" )
+    for kind, terms in queries.items():
+        scan_times, index_times, matches = [], [], []
+        for term, whole_words in terms:
+            if whole_words:
+                scan = ( "f.prompt REGEXP %s", [f"[[:<:]]{term}[[:>:]]"] )
+            else:
+                scan = ( "f.prompt LIKE %s", [f"%{term}%"] )
+
+            found = {}
+            for name, ( condition, params ), times in ( ( 'scan', scan, scan_times ), ( 'index', search_condition( term, whole_words ), index_times ) ):
+                start = time.perf_counter()
+                cursor.execute( f"SELECT f.image_id FROM gallery_feed f WHERE {condition}", params )
+                found[name] = sorted( row[0] for row in cursor.fetchall() )
+                times.append( ( time.perf_counter() - start ) * 1000 )
+
+            matches.append( len( found['scan'] ) )
+            if found['index'] != found['scan']:
+                ok = False
+                print( f"  MISMATCH for {term!r}: {len( found['scan'] )} scan vs {len( found['index'] )} index matches" )
+
+        median = lambda values: sorted( values )[len( values ) // 2]
+        print( f"{kind:>10} {median( scan_times ):10.1f} {median( index_times ):10.1f}  {median( matches ):7,}" )
+
+    cursor.close()
+    db.close()
+    print( f"  results match the scans: {'yes' if ok else 'NO'}" )
+    if not ok:
+        sys.exit( 1 )
+
+
+# Sort key and keyset query of each browse mode (prompt mode pages through prompt groups), as data.php reads them
+KEYSET_PAGES = {
+    'recent': (
+        [( 'image_id', 'DESC' )],
+        "SELECT image_id, filename FROM gallery_feed WHERE {condition} ORDER BY image_id DESC LIMIT %s"
+    ),
+    'style': (
+        [( 'style_missing', 'ASC' ), ( 'art_style', 'ASC' ), ( 'newest_first', 'ASC' )],
+        "SELECT image_id, filename FROM gallery_feed WHERE {condition} ORDER BY style_missing, art_style, newest_first LIMIT %s"
+    ),
+    'prompt': (
+        [( 'prompt_key', 'ASC' ), ( 'prompt_hash', 'ASC' )],
+        """
+        SELECT prompt_hash FROM gallery_feed WHERE prompt_hash IS NOT NULL AND {condition}
+        GROUP BY prompt_key, prompt_hash ORDER BY prompt_key, prompt_hash LIMIT %s
+        """
+    ),
+}
+
+def keyset_condition( columns, values ):
+    """Condition selecting the rows after a cursor, as keysetCondition() in web/api/utils/cursor.php.
+
+    Returns:
+        (sql, params) with %s placeholders
+    """
+    condition, params = None, []
+    for ( column, direction ), value in reversed( list( zip( columns, values ) ) ):
+        if value is None:
+            after, after_params = ( f"{column} IS NOT NULL" if direction == 'ASC' else "0 = 1" ), []
+            equal, equal_params = f"{column} IS NULL", []
+        else:
+            after = f"{column} > %s" if direction == 'ASC' else f"({column} < %s OR {column} IS NULL)"
+            after_params, equal, equal_params = [value], f"{column} = %s", [value]
+
+        if condition is None:
+            condition, params = after, after_params
+        else:
+            condition, params = f"({after} OR ({equal} AND {condition}))", after_params + equal_params + params
+    return condition, params
+
+def page_cursor( cursor, mode, limit, offset ):
+    """Sort key of the row (or prompt group) just before offset, as the previous page would return it."""
+    if offset == 0: return None
+    columns, _ = KEYSET_PAGES[mode]
+    names = ', '.join( column for column, _ in columns )
+    order = ', '.join( f"{column} {direction}" for column, direction in columns )
+    group = " WHERE prompt_hash IS NOT NULL GROUP BY prompt_key, prompt_hash" if mode == 'prompt' else ""
+    cursor.execute( f"SELECT {names} FROM gallery_feed{group} ORDER BY {order} LIMIT 1 OFFSET %s", ( offset - 1, ) )
+    return cursor.fetchone()
+
+def keyset_page( cursor, mode, limit, key ):
+    """One browse page continuing after key (None for the first page)."""
+    columns, query = KEYSET_PAGES[mode]
+    condition, params = keyset_condition( columns, key ) if key else ( "1 = 1", [] )
+    cursor.execute( query.format( condition=condition ), params + [limit] )
+    if mode == 'prompt':
+        hashes = [row[0] for row in cursor.fetchall()]
+        if not hashes: return []
+        cursor.execute( FEED_QUERIES['prompt'].format( hashes=','.join( ['%s'] * len( hashes ) ) ), hashes )
+    return [row[1] for row in cursor.fetchall()]
+
+def benchmark_pages( args ):
+    """Time browse pages by depth: OFFSET vs keyset cursor on the gallery feed, checking identical pages."""
+    from gallery_feed import rebuild
+
+    rng = random.Random( args.seed )
+    print( f"Preparing {args.database} with {args.images:,} images..." )
+    db = setup_feed_database( args, rng )
+    rebuild( db )
+
+    cursor = db.cursor()
+    ok = True
+    print( f"{'':>8} {'page':>8} {'offset':>10} {'cursor':>10}   (ms per page of {args.limit})" )
+    for mode in KEYSET_PAGES:
+        for page in args.depths:
+            offset = ( page - 1 ) * args.limit
+            key = page_cursor( cursor, mode, args.limit, offset )
+            offset_ms, expected = time_page( feed_page, cursor, mode, args.limit, offset, args.repeat )
+            cursor_ms, found = time_page( lambda c, m, l, _: keyset_page( c, m, l, key ), cursor, mode, args.limit, offset, args.repeat )
+            ok &= found == expected
+            print( f"{mode:>8} {page:>8,} {offset_ms:10.1f} {cursor_ms:10.1f}{'' if found == expected else '   MISMATCH'}" )
+
+    cursor.close()
+    db.close()
+    print( f"  cursor pages match the offset pages: {'yes' if ok else 'NO'}" )
+    if not ok:
+        sys.exit( 1 )
+
+
+# First page of each tables view sorted by count: the aggregation tables_data.php ran before the counters
+AGGREGATED_VIEWS = {
+    'art-styles': """
+        SELECT ast.id, COUNT(DISTINCT i.id) AS image_count FROM art_styles ast
+        LEFT JOIN images i ON i.art_style_id = ast.id AND i.deleted = 0
+        GROUP BY ast.id ORDER BY image_count DESC, ast.id DESC LIMIT %s
+    """,
+    'positive-prompts': """
+        SELECT pp.id, COUNT(DISTINCT i.id) AS image_count FROM positive_prompts pp
+        LEFT JOIN prompt_combinations pc ON pc.positive_prompt_id = pp.id
+        LEFT JOIN images i ON i.prompt_combination_id = pc.id AND i.deleted = 0
+        GROUP BY pp.id ORDER BY image_count DESC, pp.id DESC LIMIT %s
+    """,
+    'tags': """
+        SELECT t.id, COUNT(DISTINCT i.id) AS image_count FROM tags t
+        LEFT JOIN image_tags it ON it.tag_id = t.id
+        LEFT JOIN images i ON i.id = it.image_id AND i.deleted = 0
+        GROUP BY t.id ORDER BY image_count DESC, t.id DESC LIMIT %s
+    """,
+    'tokens': """
+        SELECT t.id, COUNT(DISTINCT ppt.positive_prompt_id) AS positive_count FROM tokens t
+        LEFT JOIN positive_prompt_tokens ppt ON ppt.token_id = t.id
+        GROUP BY t.id ORDER BY positive_count DESC, t.id DESC LIMIT %s
+    """,
+}
+
+# The same pages from the counter tables, as tables_data.php reads them
+COUNTER_VIEWS = {
+    'art-styles': "SELECT c.art_style_id, c.image_count FROM art_style_counts c JOIN art_styles ast ON ast.id = c.art_style_id ORDER BY c.image_count DESC, c.art_style_id DESC LIMIT %s",
+    'positive-prompts': "SELECT c.positive_prompt_id, c.image_count FROM positive_prompt_counts c JOIN positive_prompts pp ON pp.id = c.positive_prompt_id ORDER BY c.image_count DESC, c.positive_prompt_id DESC LIMIT %s",
+    'tags': "SELECT c.tag_id, c.image_count FROM tag_counts c JOIN tags t ON t.id = c.tag_id ORDER BY c.image_count DESC, c.tag_id DESC LIMIT %s",
+    'tokens': "SELECT c.token_id, c.positive_count FROM token_counts c JOIN tokens t ON t.id = c.token_id ORDER BY c.positive_count DESC, c.token_id DESC LIMIT %s",
+}
+
+def time_query( cursor, query, params, repeat ):
+    """Best of repeat runs of a query in ms, with its rows."""
+    best = None
+    for _ in range( repeat ):
+        start = time.perf_counter()
+        cursor.execute( query, params )
+        rows = cursor.fetchall()
+        elapsed = ( time.perf_counter() - start ) * 1000
+        best = elapsed if best is None else min( best, elapsed )
+    return best, rows
+
+def benchmark_counts( args ):
+    """Time the tables views and table counts from aggregations vs stored counters, and check the counters after incremental updates."""
+    from aggregate_counts import TABLE_COUNTS, add_images, add_tag_links, reconcile
+    from build_token_relationships import full_rebuild, update_images
+    from scraper import DatabaseManager
+
+    rng = random.Random( args.seed )
+    print( f"Preparing {args.database} with {args.images:,} images..." )
+    db = setup_feed_database( args, rng )
+    cursor = db.cursor()
+    full_rebuild( cursor, db )
+    start = time.perf_counter()
+    reconcile( db )
+    print( f"Counters filled in {time.perf_counter() - start:.1f}s" )
+
+    ok = True
+    print( f"{'':>18} {'aggregated':>11} {'counters':>10}   (ms for the first page of {args.limit} by count)" )
+    for view, query in AGGREGATED_VIEWS.items():
+        aggregated_ms, expected = time_query( cursor, query, ( args.limit, ), args.repeat )
+        counters_ms, found = time_query( cursor, COUNTER_VIEWS[view], ( args.limit, ), args.repeat )
+        same = [tuple( row ) for row in found] == [tuple( row ) for row in expected]
+        ok &= same
+        print( f"{view:>18} {aggregated_ms:11.1f} {counters_ms:10.1f}{'' if same else '   MISMATCH'}" )
+
+    for view, query in COUNTER_VIEWS.items():
+        cursor.execute( "EXPLAIN " + query.replace( '%s', '1' ) )
+        columns = [column[0] for column in cursor.description]
+        plan = dict( zip( columns, cursor.fetchone() ) )
+        print( f"  EXPLAIN {view}: key {plan['key']}, {plan['Extra'] or '-'}" )
+
+    # Table counts cache: the old MAX(id) shortcut vs COUNT(*) vs the stored row counts
+    shortcut_ms = exact_ms = 0
+    exact = {}
+    for name, ( table, condition ) in TABLE_COUNTS.items():
+        shortcut_ms += time_query( cursor, f"SELECT MAX(id) FROM {table}", (), args.repeat )[0]
+        elapsed, rows = time_query( cursor, f"SELECT COUNT(*) FROM {table} WHERE {condition}", (), args.repeat )
+        exact_ms += elapsed
+        exact[name] = rows[0][0]
+    stored_ms, rows = time_query( cursor, "SELECT name, row_count, generation FROM table_counts", (), args.repeat )
+    same = {name: row_count for name, row_count, _ in rows} == exact
+    ok &= same
+    print( f"  table counts: MAX(id) {shortcut_ms:.1f} ms, COUNT(*) {exact_ms:.1f} ms, table_counts {stored_ms:.1f} ms"
+           f"{'' if same else '   MISMATCH'}" )
+
+    # Incremental updates as the scraper, retention, update_tags.php and the token step apply them
+    scraper_db = DatabaseManager( database=args.database )
+    scraper_db.connect()
+    image_ids = scraper_db.insert_images( make_items( args.limit, rng, offset=args.images ) )
+    update_images( scraper_db.cursor, scraper_db.conn, image_ids )
+    scraper_db.close()
+
+    deleted = rng.sample( range( 1, args.images + 1 ), args.limit )
+    add_images( cursor, deleted, -1 )
+    cursor.execute( f"UPDATE images SET deleted = 1 WHERE id IN ({','.join( ['%s'] * len( deleted ) )})", deleted )
+    db.commit()
+
+    tagged = rng.sample( range( 1, args.images + 1 ), args.limit ) + image_ids[:10]
+    add_tag_links( cursor, tagged, -1 )
+    cursor.execute( f"DELETE FROM image_tags WHERE image_id IN ({','.join( ['%s'] * len( tagged ) )})", tagged )
+    cursor.executemany( "INSERT INTO image_tags (image_id, tag_id) VALUES (%s, %s)",
+                        [( image_id, rng.randint( 1, args.tags ) ) for image_id in tagged] )
+    add_tag_links( cursor, tagged, 1 )
+    db.commit()
+
+    results = reconcile( db, fix=False )
+    for table, result in results.items():
+        drift = any( result.values() )
+        ok &= not drift
+        print( f"  {table} after updates: {result['missing']:,} missing, {result['stale']:,} stale, {result['extra']:,} extra" )
+
+    cursor.close()
+    db.close()
+    print( f"  counters match the aggregations: {'yes' if ok else 'NO'}" )
+    if not ok:
+        sys.exit( 1 )
+
+
+def crawl_once( stub, work_dir, queue_size ):
+    """Run the crawler once against the stand-in with a fresh ScrapeRun, returning it."""
+    import asyncio
+    from crawler import crawl
+    from scraper import ScrapeRun
+
+    run = ScrapeRun( index_path=os.path.join( work_dir, 'known_files.idx' ),
+                     results_path=os.path.join( work_dir, 'results.jsonl' ) )
+    run.load_known_files()
+    try:
+        asyncio.run( crawl( run, stub.url, delay=0, queue_size=queue_size ) )
+    finally:
+        run.save_index()
+    return run
+
+def benchmark_crawl( args ):
+    """Crawl the canned pages of gallery_stub.py twice and check pagination, storage and the stop conditions."""
+    import scraper
+    from gallery_stub import GalleryStub, PAGE_SIZE
+    from results_log import iter_results
+    from scraper import parse_page
+
+    create_scratch_database( args.database )
+    scraper.db.database = args.database
+    scraper.db.connect()
+    for statement in TAG_TABLES:
+        scraper.db.cursor.execute( statement )
+
+    work_dir = tempfile.mkdtemp( dir=args.dir )
+    scraper.MEDIUM_DIR = os.path.join( work_dir, 'medium' )
+    os.makedirs( scraper.MEDIUM_DIR )
+    ok = True
+
+    def check( label, passed ):
+        nonlocal ok
+        ok &= passed
+        print( f"  {label}: {'yes' if passed else 'NO'}" )
+
+    try:
+        with GalleryStub() as stub:
+            expected = [stub.page( skip ) for skip in range( 0, PAGE_SIZE * 100, PAGE_SIZE )]
+            pages = len( [page for page in expected if parse_page( page )] )
+            filenames = [url.rsplit( '/', 1 )[1].replace( '.png', '.jpg' )
+                         for page in expected for _, url in parse_page( page )]
+
+            # First crawl: every canned page is stored, then the empty page ends the crawl
+            start = time.perf_counter()
+            run = crawl_once( stub, work_dir, args.queue_size )
+            print( f"First crawl: {len( run.new_results )} new items from {len( stub.requests )} page requests "
+                   f"in {time.perf_counter() - start:.2f}s" )
+            check( "pages requested in skip order", stub.requests[:pages + 1] == list( range( 0, ( pages + 1 ) * PAGE_SIZE, PAGE_SIZE ) ) )
+            check( f"stopped after the empty page (at most {args.queue_size + 1} extra requests)",
+                   len( stub.requests ) <= pages + 1 + args.queue_size + 1 )
+            scraper.db.cursor.execute( "SELECT filename FROM images WHERE deleted = 0 ORDER BY id" )
+            check( "every canned image stored once, in page order", [row[0] for row in scraper.db.cursor.fetchall()] == filenames )
+            check( "every image file written", all( scraper.locate_image( scraper.MEDIUM_DIR, name ) for name in filenames ) )
+            check( "backup log holds each new item once",
+                   [item['filename'] for item in iter_results( run.results_log.path )] == filenames )
+
+            # Second crawl: nothing is new, so it stops after the first page
+            stub.requests.clear()
+            run = crawl_once( stub, work_dir, args.queue_size )
+            print( f"Second crawl: {len( run.new_results )} new items from {len( stub.requests )} page requests" )
+            check( "nothing stored again", not run.new_results )
+            check( "stopped without storing anything", stub.requests[:1] == [0] and len( stub.requests ) <= pages + 1 + args.queue_size + 1 )
+    finally:
+        scraper.db.close()
+        shutil.rmtree( work_dir, ignore_errors=True )
+
+    print( f"  crawler matches the canned gallery: {'yes' if ok else 'NO'}" )
+    if not ok:
+        sys.exit( 1 )
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Benchmark pipeline components' )
+    parser.add_argument( '--database', default=BENCHMARK_DATABASE,
+                        help=f'Scratch database, dropped on every run (default: {BENCHMARK_DATABASE})' )
+    parser.add_argument( '--seed', type=int, default=1, help='Random seed for synthetic data' )
+    subparsers = parser.add_subparsers( dest='benchmark', required=True )
+
+    insert_parser = subparsers.add_parser( 'insert', help='Per-row vs batched image inserts' )
+    insert_parser.add_argument( '--pages', type=int, default=5 )
+    insert_parser.add_argument( '--page-size', type=int, default=200 )
+    insert_parser.set_defaults( func=benchmark_insert )
+
+    dedup_parser = subparsers.add_parser( 'dedup', help='Scraper startup time and RSS: JSON + set vs dedup index' )
+    dedup_parser.add_argument( '--sizes', type=int, nargs='+', default=[100000, 1000000] )
+    dedup_parser.set_defaults( func=benchmark_dedup )
+
+    tokenize_parser = subparsers.add_parser( 'tokenize', help='Serial vs parallel tokenization' )
+    tokenize_parser.add_argument( '--prompts', type=int, default=60000 )
+    tokenize_parser.add_argument( '--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1] )
+    tokenize_parser.add_argument( '--shard-size', type=int, default=5000 )
+    tokenize_parser.add_argument( '--fixture', help='JSON Lines corpus of prompt, negative_prompt, style_string (instead of --prompts)' )
+    tokenize_parser.set_defaults( func=benchmark_tokenize )
+
+    junction_parser = subparsers.add_parser( 'junction', help='Token relationship rebuild: in-memory executemany vs streamed LOAD DATA' )
+    junction_parser.add_argument( '--rows', type=int, default=10000000 )
+    junction_parser.add_argument( '--per-prompt', type=int, default=20, help='Tokens per prompt' )
+    junction_parser.add_argument( '--chunk-rows', type=int, default=1000000 )
+    junction_parser.add_argument( '--modes', nargs='+', choices=JUNCTION_MODES, default=list( JUNCTION_MODES ) )
+    junction_parser.add_argument( '--mode', choices=JUNCTION_MODES, help=argparse.SUPPRESS ) # single run in a child process
+    junction_parser.set_defaults( func=benchmark_junction )
+
+    styles_parser = subparsers.add_parser( 'styles', help='Style string search: brute force vs suffix automaton' )
+    styles_parser.add_argument( '--styles', type=int, default=20 )
+    styles_parser.add_argument( '--prompts', type=int, default=200, help='Prompts per style' )
+    styles_parser.add_argument( '--prompt-length', type=int, default=300 )
+    styles_parser.add_argument( '--sample-size', type=int, default=50 )
+    styles_parser.add_argument( '--workers', type=int, default=1 )
+    styles_parser.set_defaults( func=benchmark_styles )
+
+    groups_parser = subparsers.add_parser( 'groups', help='Prompt grouping: full rebuild vs incremental store' )
+    groups_parser.add_argument( '--entries', type=int, default=1000000 )
+    groups_parser.add_argument( '--new-entries', type=int, default=2000, help='Entries added by the simulated scrape' )
+    groups_parser.add_argument( '--prompts', type=int, default=200000, help='Distinct prompts outside the large groups' )
+    groups_parser.add_argument( '--large-groups', type=int, default=3 )
+    groups_parser.add_argument( '--large-share', type=float, default=0.3, help='Share of entries in the large groups' )
+    groups_parser.set_defaults( func=benchmark_groups )
+
+    folders_parser = subparsers.add_parser( 'folders', help='Group folder materialization per link mode' )
+    folders_parser.add_argument( '--files', type=int, default=20000 )
+    folders_parser.add_argument( '--file-size', type=int, default=150000, help='Bytes per image' )
+    folders_parser.add_argument( '--groups', type=int, default=2000 )
+    folders_parser.add_argument( '--modes', nargs='+', default=['copy', 'hardlink', 'reflink', 'symlink'] )
+    folders_parser.add_argument( '--workers', type=int, nargs='+', default=[1, 8] )
+    folders_parser.add_argument( '--dir', help='Where to create the fixture (default: system temp dir)' )
+    folders_parser.set_defaults( func=benchmark_folders )
+
+    layout_parser = subparsers.add_parser( 'layout', help='Image existence checks and scans: flat vs sharded' )
+    layout_parser.add_argument( '--files', type=int, default=1000000 )
+    layout_parser.add_argument( '--lookups', type=int, default=100000, help='Existence checks per kind (hits and misses)' )
+    layout_parser.add_argument( '--workers', type=int, default=8, help='Threads moving files during the migration' )
+    layout_parser.add_argument( '--dir', help='Where to create the fixture (default: system temp dir)' )
+    layout_parser.set_defaults( func=benchmark_layout )
+
+    hashes_parser = subparsers.add_parser( 'hashes', help='Near-duplicate lookups: linear scan vs multi-index' )
+    hashes_parser.add_argument( '--hashes', type=int, default=1000000, help='Hashes in the index' )
+    hashes_parser.add_argument( '--queries', type=int, default=10000 )
+    hashes_parser.add_argument( '--scan-queries', type=int, default=20, help='Queries also answered by a linear scan' )
+    hashes_parser.add_argument( '--distance', type=int, default=4 )
+    hashes_parser.add_argument( '--images', type=int, default=200, help='Test images for the hash stability and hashing rate checks' )
+    hashes_parser.add_argument( '--workers', type=int, nargs='+', default=sorted( {1, os.cpu_count() or 1} ) )
+    hashes_parser.add_argument( '--dir', help='Where to create the test images (default: system temp dir)' )
+    hashes_parser.set_defaults( func=benchmark_hashes )
+
+    jpeg_parser = subparsers.add_parser( 'jpeg', help='Per-image CPU time of the JPEG stage per setting' )
+    jpeg_parser.add_argument( '--images', type=int, default=150 )
+    jpeg_parser.add_argument( '--variants', nargs='+', choices=JPEG_VARIANTS, default=list( JPEG_VARIANTS ) )
+    jpeg_parser.add_argument( '--dir', help='Where to write the outputs (default: system temp dir)' )
+    jpeg_parser.set_defaults( func=benchmark_jpeg )
+
+    feed_parser = subparsers.add_parser( 'feed', help='Gallery browse pages: joined tables vs gallery feed' )
+    feed_parser.add_argument( '--images', type=int, default=1000000 )
+    feed_parser.add_argument( '--styles', type=int, default=500 )
+    feed_parser.add_argument( '--tags', type=int, default=2000 )
+    feed_parser.add_argument( '--limit', type=int, default=200, help='Images (or prompt groups) per page' )
+    feed_parser.add_argument( '--offsets', type=int, nargs='+', default=[0, 10000, 100000] )
+    feed_parser.add_argument( '--repeat', type=int, default=3, help='Runs per page; the best is reported' )
+    feed_parser.set_defaults( func=benchmark_feed )
+
+    search_parser = subparsers.add_parser( 'search', help='Prompt search: LIKE / REGEXP scan vs word index' )
+    search_parser.add_argument( '--images', type=int, default=300000, help='Images (one prompt per 5 images)' )
+    search_parser.add_argument( '--styles', type=int, default=500 )
+    search_parser.add_argument( '--tags', type=int, default=2000 )
+    search_parser.add_argument( '--queries', type=int, default=50, help='Queries per kind (word, phrase, substring, span)' )
+    search_parser.set_defaults( func=benchmark_search )
+
+    pages_parser = subparsers.add_parser( 'pages', help='Browse latency vs page depth: OFFSET vs keyset cursor' )
+    pages_parser.add_argument( '--images', type=int, default=1000000 )
+    pages_parser.add_argument( '--styles', type=int, default=500 )
+    pages_parser.add_argument( '--tags', type=int, default=2000 )
+    pages_parser.add_argument( '--limit', type=int, default=200, help='Images (or prompt groups) per page' )
+    pages_parser.add_argument( '--depths', type=int, nargs='+', default=[1, 10, 100, 1000, 4000], help='Page numbers to time' )
+    pages_parser.add_argument( '--repeat', type=int, default=3, help='Runs per page; the best is reported' )
+    pages_parser.set_defaults( func=benchmark_pages )
+
+    counts_parser = subparsers.add_parser( 'counts', help='Tables view: aggregated counts vs stored counters' )
+    counts_parser.add_argument( '--images', type=int, default=300000, help='Images (one prompt per 5 images)' )
+    counts_parser.add_argument( '--styles', type=int, default=500 )
+    counts_parser.add_argument( '--tags', type=int, default=2000 )
+    counts_parser.add_argument( '--limit', type=int, default=200, help='Rows per page, and rows changed by each update' )
+    counts_parser.add_argument( '--repeat', type=int, default=3, help='Runs per query; the best is reported' )
+    counts_parser.set_defaults( func=benchmark_counts )
+
+    crawl_parser = subparsers.add_parser( 'crawl', help='Crawler against the local gallery stand-in' )
+    crawl_parser.add_argument( '--queue-size', type=int, default=2, help='Pages buffered between crawler stages' )
+    crawl_parser.add_argument( '--dir', help='Where to store the images and index (default: system temp dir)' )
+    crawl_parser.set_defaults( func=benchmark_crawl )
+
+    args = parser.parse_args()
+    args.func( args )
+
+
+if __name__ == '__main__':
+    main()
@@ -5,69 +5,181 @@ This script creates the tokens table and junction tables linking tokens to promp
 Usage:
     python build_token_relationships.py          # Full rebuild (drops and recreates tables)
     python build_token_relationships.py --update # Incremental update (only new prompts)
+    python build_token_relationships.py --image-ids 101,102  # Only the prompts of these images
+    python build_token_relationships.py --workers 8  # Tokenize across 8 processes
+    python build_token_relationships.py --defer-indexes  # Rebuild junction indexes after the bulk load
 """
 
-import re
-import mysql.connector
-from collections import defaultdict
 import argparse
 import hashlib
+import time
 
-def get_db_connection():
-    """Create database connection."""
-    return mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='',
-        database='perchance_gallery'
-    )
+from aggregate_counts import add_prompt_tokens, add_rows, ensure_tables as ensure_count_tables, reconcile
+from bulk_loader import JunctionLoader, deferred_indexes, loader_connection
+from database import FETCH_CHUNK_SIZE, INSERT_BATCH_SIZE, LOAD_CHUNK_ROWS
+from tokenizer import tokenize_prompts, map_shards
+
+def token_hash( token_text ):
+    """Return the hash used to look up a token (token is TEXT, so it can't be indexed directly)."""
+    return hashlib.sha256( token_text.encode( 'utf-8' ) ).hexdigest()
 
-def extract_tokens( text ):
-    """Extract tokens from text using delimiters: comma, period, line breaks."""
-    if not text:
-        return []
+def iter_prompts( db, table, batch_size=FETCH_CHUNK_SIZE ):
+    """Stream (id, prompt_text) rows of a prompt table in id order, one keyset page per query.
     
-    # Split by comma, period, or common line break indicators
-    delimiters = r'[,.\n]|\\n'
-    tokens = re.split( delimiters, text )
+    Unlike iter_rows(), each page is read completely before its rows are yielded,
+    so the connection can insert tokens and load junction rows between pages.
+    """
+    cursor = db.cursor()
+    last_id = 0
+    try:
+        while True:
+            cursor.execute( f"SELECT id, prompt_text FROM {table} WHERE id > %s ORDER BY id LIMIT %s", ( last_id, batch_size ) )
+            rows = cursor.fetchall()
+            if not rows: break
+            last_id = rows[-1][0]
+            yield from rows
+    finally:
+        cursor.close()
+
+def distinct_tokens( *tokenized ):
+    """Return every distinct token in tokenized prompts, in order of first appearance."""
+    return list( dict.fromkeys( token for pairs in tokenized for _, tokens in pairs for token in tokens ) )
+
+def select_token_ids( cursor, hashes ):
+    """Look up token IDs by hash in batched IN (...) queries on the unique hash index."""
+    ids = {}
+    for start in range( 0, len( hashes ), INSERT_BATCH_SIZE ):
+        batch = hashes[start:start + INSERT_BATCH_SIZE]
+        placeholders = ','.join( ['%s'] * len( batch ) )
+        cursor.execute( f"SELECT id, hash FROM tokens WHERE hash IN ({placeholders})", batch )
+        ids.update( ( token_hash, token_id ) for token_id, token_hash in cursor.fetchall() )
+    return ids
+
+def resolve_token_ids( cursor, db, tokens, fresh=False, commit=True ):
+    """Map token texts to IDs, creating missing tokens in bulk.
+    
+    Existing IDs are read in batched lookups, missing tokens are inserted with
+    multi-row INSERT IGNORE (in first-appearance order, so IDs match the old
+    one-token-at-a-time behaviour), and their IDs are read back the same way.
+    
+    Args:
+        tokens: Distinct token texts
+        fresh: The tokens table was just created and none of these tokens are in
+               it yet, so skip the lookup of existing tokens (and the table_counts
+               update, which the rebuild recounts)
+        commit: Commit the new tokens (False leaves them in the caller's transaction)
+    
+    Returns:
+        (ids, created): dict of token text -> ID, and number of tokens inserted
+    """
+    hashes = {token: token_hash( token ) for token in tokens}
+    ids_by_hash = {} if fresh else select_token_ids( cursor, list( hashes.values() ) )
+    
+    missing = [( token, h ) for token, h in hashes.items() if h not in ids_by_hash]
+    for start in range( 0, len( missing ), INSERT_BATCH_SIZE ):
+        cursor.executemany(
+            "INSERT IGNORE INTO tokens (token, hash) VALUES (%s, %s)",
+            missing[start:start + INSERT_BATCH_SIZE]
+        )
+        if not fresh:
+            add_rows( cursor, 'tokens', cursor.rowcount )
+    if commit:
+        db.commit()
     
-    # Clean up tokens: strip whitespace, filter empty strings, lowercase for consistency
-    tokens = [token.strip().lower() for token in tokens if token.strip()]
+    if missing:
+        # INSERT IGNORE also covers tokens another process created in the meantime
+        ids_by_hash.update( select_token_ids( cursor, [h for _, h in missing] ) )
     
-    return tokens
+    return {token: ids_by_hash[h] for token, h in hashes.items()}, len( missing )
 
-def get_or_create_token( cursor, token_text, token_cache ):
-    """Get or create a token, return its ID."""
-    # Use hash for lookup (since token is TEXT)
-    token_hash = hashlib.sha256( token_text.encode( 'utf-8' ) ).hexdigest()
-    
-    if token_hash in token_cache:
-        return token_cache[token_hash]
+def junction_rows( tokenized, token_ids ):
+    """Yield (prompt_id, token_id) junction rows for tokenized prompts."""
+    for prompt_id, tokens in tokenized:
+        for token in tokens:
+            yield ( prompt_id, token_ids[token] )
+
+def relationship_rows( cursor, db, prompts, token_ids, stats, workers=1, fresh=False, commit=True ):
+    """Tokenize prompts shard by shard and yield their (prompt_id, token_id) junction rows.
+    
+    Each shard's new tokens are resolved to IDs before its rows are yielded, so
+    only the shards being tokenized are held in memory, never every prompt's
+    tokens. token_ids grows with the number of distinct tokens, not with the
+    number of relationships.
+    
+    Args:
+        prompts: (prompt_id, prompt_text) rows ordered by id, consumed once (a list
+                 or iter_prompts(); the connection must be free between rows)
+        token_ids: Dict of token text -> ID resolved so far, updated in place
+        stats: Dict whose 'prompts' and 'tokens_created' counts are incremented
+        workers: Tokenize shards of prompts in this many processes (1 = in this process)
+        fresh, commit: See resolve_token_ids
+    """
+    for shard in map_shards( tokenize_prompts, prompts, workers ):
+        new_tokens = [token for token in distinct_tokens( shard ) if token not in token_ids]
+        if new_tokens:
+            ids, created = resolve_token_ids( cursor, db, new_tokens, fresh, commit )
+            token_ids.update( ids )
+            stats['tokens_created'] += created
+        stats['prompts'] += len( shard )
+        yield from junction_rows( shard, token_ids )
+
+def insert_relationships( cursor, db, positive_prompts, negative_prompts, workers=1, fresh=False, chunk_rows=LOAD_CHUNK_ROWS, commit=True ):
+    """Tokenize prompts and stream their junction rows into positive_prompt_tokens and negative_prompt_tokens.
+    
+    Tokenization, token ID resolution and loading run shard by shard (see
+    relationship_rows), and rows are bulk loaded chunk_rows at a time, so memory
+    is bounded by the shard and chunk sizes plus the distinct tokens. With
+    commit=False everything is written in the caller's transaction instead
+    (see JunctionLoader).
+    
+    Args:
+        positive_prompts, negative_prompts: (prompt_id, prompt_text) rows ordered by id (see relationship_rows)
+        fresh: The tokens table was just created (see resolve_token_ids)
+    
+    Returns:
+        Dict with the number of positive and negative prompts, distinct tokens,
+        tokens created and relationships loaded
+    """
+    loader = JunctionLoader( db, chunk_rows, commit=commit )
+    token_ids = {}
+    positive = {'prompts': 0, 'tokens_created': 0}
+    negative = {'prompts': 0, 'tokens_created': 0}
+    start = time.perf_counter()
+    
+    print( "Loading positive prompt-token relationships..." )
+    positive_count = loader.load(
+        'positive_prompt_tokens', ( 'positive_prompt_id', 'token_id' ),
+        relationship_rows( cursor, db, positive_prompts, token_ids, positive, workers, fresh, commit )
+    )
     
-    # Try to find existing token
-    cursor.execute( "SELECT id FROM tokens WHERE hash = %s", (token_hash,) )
-    result = cursor.fetchone()
+    print( "Loading negative prompt-token relationships..." )
+    negative_count = loader.load(
+        'negative_prompt_tokens', ( 'negative_prompt_id', 'token_id' ),
+        relationship_rows( cursor, db, negative_prompts, token_ids, negative, workers, fresh, commit )
+    )
     
-    if result:
-        token_id = result[0]
-    else:
-        # Insert new token
-        try:
-            cursor.execute(
-                "INSERT INTO tokens (token, hash) VALUES (%s, %s)",
-                (token_text, token_hash)
-            )
-            token_id = cursor.lastrowid
-        except mysql.connector.IntegrityError:
-            # Handle race condition - token was inserted by another process
-            cursor.execute( "SELECT id FROM tokens WHERE hash = %s", (token_hash,) )
-            token_id = cursor.fetchone()[0]
-    
-    token_cache[token_hash] = token_id
-    return token_id
-
-def full_rebuild( cursor, db ):
-    """Completely rebuild the token relationship tables from scratch."""
+    elapsed = time.perf_counter() - start
+    total = positive_count + negative_count
+    print( f"  Loaded relationships of {positive['prompts']} positive and {negative['prompts']} negative prompts, "
+           f"{len( token_ids )} distinct tokens ({elapsed:.1f}s, {total / elapsed if elapsed else 0:,.0f} rows/s)" )
+    return {
+        'positive_prompts': positive['prompts'],
+        'negative_prompts': negative['prompts'],
+        'tokens': len( token_ids ),
+        'tokens_created': positive['tokens_created'] + negative['tokens_created'],
+        'positive_relationships': positive_count,
+        'negative_relationships': negative_count
+    }
+
+def full_rebuild( cursor, db, workers=1, chunk_rows=LOAD_CHUNK_ROWS, defer_indexes=False ):
+    """Completely rebuild the token relationship tables from scratch.
+    
+    Args:
+        workers: Processes used for tokenization
+        chunk_rows: Junction rows per bulk load statement
+        defer_indexes: Drop the junction tables' secondary indexes and foreign keys
+                       during the load and rebuild them afterwards
+    """
     print( "=== FULL REBUILD MODE ===" )
     
     # Read and execute the schema file
@@ -83,70 +195,70 @@ def full_rebuild( cursor, db ):
     
     print( "Tables recreated successfully" )
     
-    # Get all prompts
-    print( "Loading prompts..." )
-    cursor.execute( """
-        SELECT id, prompt_text
-        FROM positive_prompts
-    """ )
-    positive_prompts = cursor.fetchall()
+    # Stream all prompts, a page at a time; each shard is loaded before the next is read
+    positive_prompts = iter_prompts( db, 'positive_prompts' )
+    negative_prompts = iter_prompts( db, 'negative_prompts' )
     
-    cursor.execute( """
-        SELECT id, prompt_text
-        FROM negative_prompts
-    """ )
-    negative_prompts = cursor.fetchall()
+    print( "Extracting tokens and building relationships..." )
+    if defer_indexes:
+        with deferred_indexes( db, ['positive_prompt_tokens', 'negative_prompt_tokens'] ):
+            stats = insert_relationships( cursor, db, positive_prompts, negative_prompts, workers, True, chunk_rows )
+    else:
+        stats = insert_relationships( cursor, db, positive_prompts, negative_prompts, workers, True, chunk_rows )
     
-    print( f"Loaded {len( positive_prompts )} positive prompts and {len( negative_prompts )} negative prompts" )
+    # Token IDs were reassigned, so recount the token counters
+    print( "Recounting token counters..." )
+    reconcile( db, ['token_counts', 'table_counts'] )
     
-    # Process prompts and build relationships
-    print( "Extracting tokens and building relationships..." )
-    token_cache = {}
-    
-    # Process positive prompts
-    positive_relationships = []
-    for prompt_id, prompt_text in positive_prompts:
-        tokens = extract_tokens( prompt_text )
-        for token_text in tokens:
-            token_id = get_or_create_token( cursor, token_text, token_cache )
-            positive_relationships.append( (prompt_id, token_id) )
-    
-    # Process negative prompts
-    negative_relationships = []
-    for prompt_id, prompt_text in negative_prompts:
-        tokens = extract_tokens( prompt_text )
-        for token_text in tokens:
-            token_id = get_or_create_token( cursor, token_text, token_cache )
-            negative_relationships.append( (prompt_id, token_id) )
-    
-    print( f"Created {len( token_cache )} unique tokens" )
-    print( f"Building {len( positive_relationships )} positive prompt-token relationships..." )
-    
-    # Bulk insert positive relationships
-    if positive_relationships:
-        cursor.executemany(
-            "INSERT IGNORE INTO positive_prompt_tokens (positive_prompt_id, token_id) VALUES (%s, %s)",
-            positive_relationships
-        )
+    print( "\n=== REBUILD COMPLETE ===" )
+    print( f"  Total unique tokens: {stats['tokens']}" )
+    print( f"  Positive prompt relationships: {stats['positive_relationships']}" )
+    print( f"  Negative prompt relationships: {stats['negative_relationships']}" )
+    return stats
+
+def process_new_prompts( cursor, db, new_positive_prompts, new_negative_prompts, workers=1, chunk_rows=LOAD_CHUNK_ROWS, commit=True ):
+    """Tokenize prompts that have no relationships yet and load their junction rows.
     
-    print( f"Building {len( negative_relationships )} negative prompt-token relationships..." )
+    With commit=False nothing is committed: the tokens, junction rows and token
+    counters all stay in the caller's transaction, so a rollback undoes them together.
     
-    # Bulk insert negative relationships
-    if negative_relationships:
-        cursor.executemany(
-            "INSERT IGNORE INTO negative_prompt_tokens (negative_prompt_id, token_id) VALUES (%s, %s)",
-            negative_relationships
-        )
+    Returns:
+        Dict with the number of prompts, tokens created and relationships loaded
+    """
+    print( f"Found {len( new_positive_prompts )} new positive prompts and {len( new_negative_prompts )} new negative prompts" )
     
-    db.commit()
+    if len( new_positive_prompts ) == 0 and len( new_negative_prompts ) == 0:
+        print( "No new prompts to process" )
+        return {
+            'positive_prompts': 0,
+            'negative_prompts': 0,
+            'tokens': 0,
+            'tokens_created': 0,
+            'positive_relationships': 0,
+            'negative_relationships': 0
+        }
+    
+    # Process new prompts (new tokens are added to table_counts as they are created)
+    ensure_count_tables( cursor )
+    print( "Extracting tokens and building relationships..." )
+    stats = insert_relationships( cursor, db, new_positive_prompts, new_negative_prompts, workers, chunk_rows=chunk_rows, commit=commit )
     
-    print( "\n=== REBUILD COMPLETE ===" )
-    print( f"  Total unique tokens: {len( token_cache )}" )
-    print( f"  Positive prompt relationships: {len( positive_relationships )}" )
-    print( f"  Negative prompt relationships: {len( negative_relationships )}" )
+    # The prompts had no junction rows before, so their rows are all new to the token counters
+    add_prompt_tokens( cursor, [row[0] for row in new_positive_prompts], [row[0] for row in new_negative_prompts] )
+    if commit:
+        db.commit()
+    
+    print( "\n=== UPDATE COMPLETE ===" )
+    print( f"  New tokens created: {stats['tokens_created']}" )
+    print( f"  New positive relationships: {stats['positive_relationships']}" )
+    print( f"  New negative relationships: {stats['negative_relationships']}" )
+    return stats
 
-def incremental_update( cursor, db ):
-    """Update token relationships for prompts that don't have tokens yet."""
+def incremental_update( cursor, db, workers=1, chunk_rows=LOAD_CHUNK_ROWS ):
+    """Update token relationships for every prompt that doesn't have tokens yet.
+    
+    Scans the full prompt tables; when the changed prompts are known, use update_prompts() instead.
+    """
     print( "=== INCREMENTAL UPDATE MODE ===" )
     
     # Find positive prompts without tokens
@@ -156,6 +268,7 @@ def incremental_update( cursor, db ):
         FROM positive_prompts pp
         LEFT JOIN positive_prompt_tokens ppt ON pp.id = ppt.positive_prompt_id
         WHERE ppt.positive_prompt_id IS NULL
+        ORDER BY pp.id
     """ )
     new_positive_prompts = cursor.fetchall()
     
@@ -164,72 +277,109 @@ def incremental_update( cursor, db ):
         FROM negative_prompts np
         LEFT JOIN negative_prompt_tokens npt ON np.id = npt.negative_prompt_id
         WHERE npt.negative_prompt_id IS NULL
+        ORDER BY np.id
     """ )
     new_negative_prompts = cursor.fetchall()
     
-    print( f"Found {len( new_positive_prompts )} new positive prompts and {len( new_negative_prompts )} new negative prompts" )
-    
-    if len( new_positive_prompts ) == 0 and len( new_negative_prompts ) == 0:
-        print( "No new prompts to process" )
-        return
-    
-    # Process new prompts
-    print( "Extracting tokens and building relationships..." )
-    token_cache = {}
-    
-    # Process positive prompts
-    positive_relationships = []
-    for prompt_id, prompt_text in new_positive_prompts:
-        tokens = extract_tokens( prompt_text )
-        for token_text in tokens:
-            token_id = get_or_create_token( cursor, token_text, token_cache )
-            positive_relationships.append( (prompt_id, token_id) )
-    
-    # Process negative prompts
-    negative_relationships = []
-    for prompt_id, prompt_text in new_negative_prompts:
-        tokens = extract_tokens( prompt_text )
-        for token_text in tokens:
-            token_id = get_or_create_token( cursor, token_text, token_cache )
-            negative_relationships.append( (prompt_id, token_id) )
-    
-    # Insert relationships
-    if positive_relationships:
-        print( f"Inserting {len( positive_relationships )} positive relationships..." )
-        cursor.executemany(
-            "INSERT IGNORE INTO positive_prompt_tokens (positive_prompt_id, token_id) VALUES (%s, %s)",
-            positive_relationships
-        )
-    
-    if negative_relationships:
-        print( f"Inserting {len( negative_relationships )} negative relationships..." )
-        cursor.executemany(
-            "INSERT IGNORE INTO negative_prompt_tokens (negative_prompt_id, token_id) VALUES (%s, %s)",
-            negative_relationships
-        )
-    
-    db.commit()
-    
-    print( "\n=== UPDATE COMPLETE ===" )
-    print( f"  New tokens created: {len( token_cache )}" )
-    print( f"  New positive relationships: {len( positive_relationships )}" )
-    print( f"  New negative relationships: {len( negative_relationships )}" )
+    return process_new_prompts( cursor, db, new_positive_prompts, new_negative_prompts, workers, chunk_rows )
+
+def prompt_ids_for_images( cursor, image_ids ):
+    """Return the (positive_prompt_ids, negative_prompt_ids) referenced by the given images."""
+    positive_prompt_ids = set()
+    negative_prompt_ids = set()
+    image_ids = list( image_ids )
+    
+    for start in range( 0, len( image_ids ), INSERT_BATCH_SIZE ):
+        batch = image_ids[start:start + INSERT_BATCH_SIZE]
+        placeholders = ','.join( ['%s'] * len( batch ) )
+        cursor.execute( f"""
+            SELECT pc.positive_prompt_id, pc.negative_prompt_id
+            FROM images i
+            JOIN prompt_combinations pc ON i.prompt_combination_id = pc.id
+            WHERE i.id IN ({placeholders})
+        """, batch )
+        for positive_prompt_id, negative_prompt_id in cursor.fetchall():
+            if positive_prompt_id: positive_prompt_ids.add( positive_prompt_id )
+            if negative_prompt_id: negative_prompt_ids.add( negative_prompt_id )
+    
+    return positive_prompt_ids, negative_prompt_ids
+
+def select_untokenized_prompts( cursor, prompt_table, junction_table, junction_column, prompt_ids ):
+    """Fetch (id, prompt_text) for those of prompt_ids that have no junction rows yet, ordered by id.
+    
+    Uses primary-key lookups for the given IDs only, so the cost follows the number
+    of IDs rather than the size of the prompt tables.
+    """
+    prompt_ids = sorted( set( prompt_ids ) )
+    prompts = []
+    
+    for start in range( 0, len( prompt_ids ), INSERT_BATCH_SIZE ):
+        batch = prompt_ids[start:start + INSERT_BATCH_SIZE]
+        placeholders = ','.join( ['%s'] * len( batch ) )
+        cursor.execute( f"""
+            SELECT p.id, p.prompt_text
+            FROM {prompt_table} p
+            WHERE p.id IN ({placeholders})
+              AND NOT EXISTS (SELECT 1 FROM {junction_table} j WHERE j.{junction_column} = p.id)
+            ORDER BY p.id
+        """, batch )
+        prompts.extend( cursor.fetchall() )
+    
+    return prompts
+
+def update_prompts( cursor, db, positive_prompt_ids=(), negative_prompt_ids=(), workers=1, chunk_rows=LOAD_CHUNK_ROWS, commit=True ):
+    """Build token relationships for specific prompts, e.g. the ones a scrape just inserted.
+    
+    Prompts that already have relationships are skipped, so passing every prompt ID
+    touched by new images is safe. The token counters are updated along with them.
+    With commit=False the caller commits (see process_new_prompts).
+    
+    Returns:
+        Dict with the number of prompts, tokens created and relationships loaded
+    """
+    print( "=== PROMPT UPDATE MODE ===" )
+    new_positive_prompts = select_untokenized_prompts(
+        cursor, 'positive_prompts', 'positive_prompt_tokens', 'positive_prompt_id', positive_prompt_ids
+    )
+    new_negative_prompts = select_untokenized_prompts(
+        cursor, 'negative_prompts', 'negative_prompt_tokens', 'negative_prompt_id', negative_prompt_ids
+    )
+    return process_new_prompts( cursor, db, new_positive_prompts, new_negative_prompts, workers, chunk_rows, commit )
+
+def update_images( cursor, db, image_ids, workers=1, chunk_rows=LOAD_CHUNK_ROWS, commit=True ):
+    """Build token relationships for the prompts of newly inserted images (commit: see update_prompts)."""
+    positive_prompt_ids, negative_prompt_ids = prompt_ids_for_images( cursor, image_ids )
+    return update_prompts( cursor, db, positive_prompt_ids, negative_prompt_ids, workers, chunk_rows, commit )
+
+def parse_ids( text ):
+    """Parse a comma-separated list of integer IDs from the command line."""
+    return [int( value ) for value in text.split( ',' ) if value.strip()]
 
 def main():
     parser = argparse.ArgumentParser( description='Build token relationship tables from prompts' )
     parser.add_argument( '--update', action='store_true',
                         help='Incremental update (only new prompts) instead of full rebuild' )
+    parser.add_argument( '--image-ids', type=parse_ids,
+                        help='Only process the prompts of these images (comma-separated IDs)' )
+    parser.add_argument( '--workers', type=int, default=1,
+                        help='Tokenize prompts in N processes (default: 1)' )
+    parser.add_argument( '--chunk-rows', type=int, default=LOAD_CHUNK_ROWS,
+                        help=f'Junction rows per bulk load (default: {LOAD_CHUNK_ROWS})' )
+    parser.add_argument( '--defer-indexes', action='store_true',
+                        help='Full rebuild only: drop junction secondary indexes during the load and rebuild them after' )
     args = parser.parse_args()
     
     print( "Connecting to database..." )
-    db = get_db_connection()
+    db = loader_connection()
     cursor = db.cursor()
     
     try:
-        if args.update:
-            incremental_update( cursor, db )
+        if args.image_ids:
+            update_images( cursor, db, args.image_ids, args.workers, args.chunk_rows )
+        elif args.update:
+            incremental_update( cursor, db, args.workers, args.chunk_rows )
         else:
-            full_rebuild( cursor, db )
+            full_rebuild( cursor, db, args.workers, args.chunk_rows, args.defer_indexes )
     finally:
         cursor.close()
         db.close()
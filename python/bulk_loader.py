@@ -0,0 +1,180 @@
+"""
+Chunked bulk loader for the prompt-token junction tables.
+
+Rows are streamed to a temporary tab-separated file and loaded with
+LOAD DATA LOCAL INFILE one chunk at a time, so only the current chunk is ever
+written out and nothing but the caller's row generator is held in memory. If the
+server refuses LOCAL INFILE (local_infile=OFF), each chunk falls back to
+multi-row INSERT IGNORE statements. LOCAL INFILE is only enabled on connections
+opened with loader_connection(), not on the shared pool.
+
+For full rebuilds, deferred_indexes() drops a table's foreign keys and
+secondary indexes before the load and rebuilds them in a single ALTER TABLE
+afterwards, which is much cheaper than maintaining them row by row.
+"""
+
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+import mysql.connector
+
+from database import INSERT_BATCH_SIZE, LOAD_CHUNK_ROWS, get_connection
+
+
+def loader_connection( database=None ):
+    """Open a dedicated (unpooled) connection with LOCAL INFILE enabled, for JunctionLoader."""
+    return get_connection( database, allow_local_infile=True )
+
+
+class JunctionLoader:
+    """Loads (prompt_id, token_id) style integer rows into a table in chunks."""
+
+    def __init__( self, db, chunk_rows=LOAD_CHUNK_ROWS, temp_dir=None, commit=True ):
+        """
+        Args:
+            commit: Commit after each chunk. With False the rows are inserted with
+                    INSERT IGNORE in the caller's transaction; LOAD DATA is not tried,
+                    since falling back from it needs a rollback.
+        """
+        self.db = db
+        self.chunk_rows = chunk_rows
+        self.temp_dir = temp_dir
+        self.commit = commit
+        self.use_load_data = commit
+
+    def load( self, table, columns, rows ):
+        """Load an iterable of row tuples into table, committing after each chunk (unless commit is off).
+
+        Duplicate keys are ignored, as with INSERT IGNORE.
+
+        Returns:
+            Number of rows sent to the server
+        """
+        cursor = self.db.cursor()
+        rows = iter( rows )
+        total = 0
+        start = time.perf_counter()
+
+        try:
+            while True:
+                chunk = list( islice( rows, self.chunk_rows ) )
+                if not chunk: break
+
+                if self.use_load_data:
+                    try:
+                        self._load_data( cursor, table, columns, chunk )
+                    except mysql.connector.Error as e:
+                        print( f"LOAD DATA LOCAL INFILE unavailable ({e}), falling back to batched INSERT IGNORE" )
+                        self.db.rollback()
+                        self.use_load_data = False
+
+                if not self.use_load_data:
+                    self._insert( cursor, table, columns, chunk )
+
+                if self.commit:
+                    self.db.commit()
+                total += len( chunk )
+
+                elapsed = time.perf_counter() - start
+                print( f"  {table}: {total:,} rows ({total / elapsed if elapsed else 0:,.0f} rows/s)" )
+        finally:
+            cursor.close()
+
+        return total
+
+    def _load_data( self, cursor, table, columns, chunk ):
+        """Write a chunk to a temporary TSV file and LOAD DATA it."""
+        fd, path = tempfile.mkstemp( suffix='.tsv', dir=self.temp_dir )
+        try:
+            with os.fdopen( fd, 'w', encoding='utf-8', newline='\n' ) as f:
+                f.writelines( '\t'.join( map( str, row ) ) + '\n' for row in chunk )
+
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE {table} "
+                f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({', '.join( columns )})",
+                ( path.replace( '\\', '/' ), )
+            )
+        finally:
+            os.remove( path )
+
+    def _insert( self, cursor, table, columns, chunk ):
+        """Insert a chunk with multi-row INSERT IGNORE statements."""
+        query = f"INSERT IGNORE INTO {table} ({', '.join( columns )}) VALUES ({', '.join( ['%s'] * len( columns ) )})"
+        for start in range( 0, len( chunk ), INSERT_BATCH_SIZE ):
+            cursor.executemany( query, chunk[start:start + INSERT_BATCH_SIZE] )
+
+
+def drop_secondary_indexes( cursor, table ):
+    """Drop a table's foreign keys and non-primary indexes.
+
+    Returns:
+        ALTER TABLE statement that recreates them
+    """
+    cursor.execute( """
+        SELECT kcu.CONSTRAINT_NAME, kcu.COLUMN_NAME, kcu.REFERENCED_TABLE_NAME,
+               kcu.REFERENCED_COLUMN_NAME, rc.DELETE_RULE
+        FROM information_schema.KEY_COLUMN_USAGE kcu
+        JOIN information_schema.REFERENTIAL_CONSTRAINTS rc
+            ON rc.CONSTRAINT_SCHEMA = kcu.CONSTRAINT_SCHEMA AND rc.CONSTRAINT_NAME = kcu.CONSTRAINT_NAME
+        WHERE kcu.TABLE_SCHEMA = DATABASE() AND kcu.TABLE_NAME = %s
+        ORDER BY kcu.CONSTRAINT_NAME
+    """, ( table, ) )
+    foreign_keys = cursor.fetchall()
+
+    cursor.execute( """
+        SELECT INDEX_NAME, NON_UNIQUE, GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX)
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME <> 'PRIMARY'
+        GROUP BY INDEX_NAME, NON_UNIQUE
+        ORDER BY INDEX_NAME
+    """, ( table, ) )
+    indexes = cursor.fetchall()
+
+    if not foreign_keys and not indexes: return None
+
+    # Foreign keys go first: MySQL won't drop an index a foreign key depends on
+    for name, *_ in foreign_keys:
+        cursor.execute( f"ALTER TABLE {table} DROP FOREIGN KEY {name}" )
+    for name, *_ in indexes:
+        cursor.execute( f"ALTER TABLE {table} DROP INDEX {name}" )
+
+    clauses = [
+        f"ADD {'INDEX' if non_unique else 'UNIQUE INDEX'} {name} ({columns})"
+        for name, non_unique, columns in indexes
+    ] + [
+        f"ADD CONSTRAINT {name} FOREIGN KEY ({column}) REFERENCES {ref_table}({ref_column}) ON DELETE {delete_rule}"
+        for name, column, ref_table, ref_column, delete_rule in foreign_keys
+    ]
+    return f"ALTER TABLE {table} " + ', '.join( clauses )
+
+
+@contextmanager
+def deferred_indexes( db, tables ):
+    """Drop secondary indexes and foreign keys of tables for the duration of a bulk load.
+
+    Everything is recreated in one ALTER TABLE per table when the block exits,
+    including when it raises. Foreign keys are re-added without re-validating
+    existing rows, so only use this when the loaded IDs are known to be valid.
+    """
+    cursor = db.cursor()
+    restore = []
+
+    try:
+        for table in tables:
+            statement = drop_secondary_indexes( cursor, table )
+            if statement: restore.append( ( table, statement ) )
+        db.commit()
+
+        yield
+    finally:
+        cursor.execute( "SET FOREIGN_KEY_CHECKS = 0" )
+        for table, statement in restore:
+            start = time.perf_counter()
+            cursor.execute( statement )
+            print( f"  Rebuilt indexes on {table} ({time.perf_counter() - start:.1f}s)" )
+        cursor.execute( "SET FOREIGN_KEY_CHECKS = 1" )
+        db.commit()
+        cursor.close()
@@ -0,0 +1,180 @@
+"""
+Longest common substring of many strings, used to infer art style strings.
+
+A suffix automaton is built once over the first string, and every other string is
+streamed through it, recording for each state the longest match ending there. The
+per-state minimum over all strings gives the longest substring common to all of
+them in time linear in the total input length.
+
+Results match the original brute-force search exactly: the longest common
+substring that occurs first in strings[0], with surrounding whitespace stripped.
+"""
+
+import random
+
+SAMPLE_SIZE = 500   # styles with more distinct prompts than this are solved on a sample first
+
+
+class SuffixAutomaton:
+    """Suffix automaton of a single string."""
+
+    def __init__( self, text ):
+        self.next = [{}]        # transitions per state
+        self.link = [-1]        # suffix links
+        self.length = [0]       # length of the longest string in each state
+        self.firstpos = [-1]    # end index of the first occurrence of each state's strings
+        last = 0
+
+        for index, char in enumerate( text ):
+            cur = len( self.length )
+            self.next.append( {} )
+            self.link.append( 0 )
+            self.length.append( self.length[last] + 1 )
+            self.firstpos.append( index )
+
+            p = last
+            while p != -1 and char not in self.next[p]:
+                self.next[p][char] = cur
+                p = self.link[p]
+
+            if p != -1:
+                q = self.next[p][char]
+                if self.length[p] + 1 == self.length[q]:
+                    self.link[cur] = q
+                else:
+                    clone = len( self.length )
+                    self.next.append( dict( self.next[q] ) )
+                    self.link.append( self.link[q] )
+                    self.length.append( self.length[p] + 1 )
+                    self.firstpos.append( self.firstpos[q] )
+
+                    while p != -1 and self.next[p].get( char ) == q:
+                        self.next[p][char] = clone
+                        p = self.link[p]
+                    self.link[q] = self.link[cur] = clone
+
+            last = cur
+
+        # States ordered longest first, so matches can be pushed down suffix links
+        self.order = sorted( range( len( self.length ) ), key=self.length.__getitem__, reverse=True )
+
+    def match_lengths( self, text ):
+        """For every state, the longest of its strings that also occurs in text."""
+        next_, link, length = self.next, self.link, self.length
+        best = [0] * len( length )
+        state = matched = 0
+
+        for char in text:
+            while state and char not in next_[state]:
+                state = link[state]
+                matched = length[state]
+
+            if char in next_[state]:
+                state = next_[state][char]
+                matched += 1
+            else:
+                state = matched = 0
+
+            if matched > best[state]: best[state] = matched
+
+        # A match in a state implies its whole suffix-link parent matched too
+        for state in self.order:
+            parent = link[state]
+            if best[state] and parent > 0 and best[parent] < length[parent]:
+                best[parent] = length[parent]
+
+        return best
+
+
+def longest_common_span( base, others ):
+    """Find the longest substring of base common to every string in others.
+
+    Returns:
+        (start, length) of its first occurrence in base; length 0 if none
+    """
+    automaton = SuffixAutomaton( base )
+    common = list( automaton.length )
+
+    for text in others:
+        common = [min( a, b ) for a, b in zip( common, automaton.match_lengths( text ) )]
+        if not any( common ): return 0, 0
+
+    best = max( common )
+    if best == 0: return 0, 0
+
+    start = min( automaton.firstpos[state] for state, value in enumerate( common ) if value >= best ) - best + 1
+    return start, best
+
+
+def find_common_substring( strings, sample_size=SAMPLE_SIZE, rng=None ):
+    """Find the longest substring common to all strings in the list, stripped of surrounding whitespace.
+
+    See find_common_span for the arguments.
+    """
+    if len( strings ) == 1:
+        return strings[0]
+    return find_common_span( strings, sample_size, rng ).strip()
+
+def find_common_span( strings, sample_size=SAMPLE_SIZE, rng=None ):
+    """Find the longest substring common to all strings in the list, as it occurs (not stripped).
+
+    Args:
+        strings: Strings to compare; ties are broken by first occurrence in strings[0]
+        sample_size: When there are more distinct strings than this, solve a random
+                     sample (always including strings[0]) and verify the result against
+                     every string, adding any counterexamples and repeating. The answer
+                     is exact either way. 0 or None disables sampling.
+        rng: Random source for the sample
+    """
+    if not strings:
+        return ""
+    if len( strings ) == 1:
+        return strings[0]
+
+    base = strings[0]
+    others = [s for s in dict.fromkeys( strings[1:] ) if s != base]
+
+    if not sample_size or len( others ) < sample_size:
+        start, length = longest_common_span( base, others )
+        return base[start:start + length]
+
+    rng = rng or random.Random( 0 )
+    sample = rng.sample( others, sample_size - 1 )
+
+    while True:
+        start, length = longest_common_span( base, sample )
+        candidate = base[start:start + length]
+        if not candidate: return ""
+
+        # Anything common to every string is common to the sample, so a candidate that
+        # holds everywhere is both the longest and the first in base
+        counterexamples = [s for s in others if candidate not in s]
+        if not counterexamples:
+            return candidate
+        sample.extend( counterexamples[:sample_size] )
+
+
+def find_common_substring_naive( strings ):
+    """Reference brute-force search (the original style_prompt implementation)."""
+    if not strings:
+        return ""
+    if len( strings ) == 1:
+        return strings[0]
+
+    # Start with the first string and find substrings
+    base = strings[0]
+    best_match = ""
+
+    # Try all possible substrings of the first string
+    for length in range( len( base ), 0, -1 ):
+        for start in range( len( base ) - length + 1 ):
+            substring = base[start:start + length]
+            # Check if this substring exists in all other strings
+            if all( substring in s for s in strings[1:] ):
+                if len( substring ) > len( best_match ):
+                    best_match = substring
+        # If we found a match at this length, no need to check shorter ones
+        if best_match:
+            break
+
+    return best_match.strip()
@@ -1,22 +1,20 @@
 #!/usr/bin/env python3
 """
 Compress tag IDs to remove gaps, renumbering sequentially from 1.
-Updates all foreign key references in image_tags table.
+Updates all foreign key references in image_tags table, then recounts
+tag_counts (see aggregate_counts.py), which is keyed by tag ID.
 """
 
-import mysql.connector
 from mysql.connector import Error
 
+from aggregate_counts import reconcile
+from database import get_connection
+
 def compress_tag_ids():
     """Renumber tags sequentially starting from 1."""
     try:
         # Connect to database
-        db = mysql.connector.connect(
-            host='localhost',
-            user='root',
-            password='',
-            database='perchance_gallery'
-        )
+        db = get_connection()
         cursor = db.cursor(dictionary=True)
         
         print("Fetching all tags ordered by ID...")
@@ -129,6 +127,10 @@ def compress_tag_ids():
             print("Transaction rolled back - no changes made.")
             raise
         
+        # Tag counters are keyed by the old IDs
+        reconcile(db, ['tag_counts'])
+        print("  Tag counters recounted")
+        
         cursor.close()
         db.close()
         
@@ -0,0 +1,198 @@
+"""
+Pipelined gallery crawler built on asyncio.
+
+Page fetching, HTML parsing, image downloads and database inserts run as separate
+stages joined by bounded queues, so page N+1 is fetched while page N is still being
+downloaded or inserted. The blocking work (CloudScraper requests, BeautifulSoup,
+Pillow, MySQL) runs in worker threads; the event loop only coordinates the stages.
+
+Usage:
+    python crawler.py                              # Crawl the live gallery
+    python crawler.py --download-workers 8         # Pooled image downloads per page
+    python crawler.py --base-url http://localhost:8000/gallery --delay 0
+
+The --base-url option points the crawler at a local stand-in: gallery_stub.py
+serves canned `.imageCtn` pages per skip, ending with an empty page, and
+`python benchmark.py crawl` runs the crawler against it.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import scraper
+from scraper import DownloadPool, ScrapeRun, db, fetch_page, parse_page, resolve_images, run_post_scrape
+from near_duplicates import DEFAULT_DISTANCE
+
+PAGE_SIZE = 200
+
+
+class RateLimiter:
+    """Spaces requests at least min_interval seconds apart, measured from each request's start.
+
+    Only gallery page requests go through it, like the scraper's delay between
+    pages; image downloads are not rate limited.
+    """
+
+    def __init__( self, min_interval ):
+        self.min_interval = min_interval
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait( self ):
+        """Wait until the next request slot is free and claim it."""
+        async with self.lock:
+            delay = self.next_slot - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep( delay )
+            self.next_slot = time.monotonic() + self.min_interval
+
+
+async def fetch_stage( base_url, limiter, page_queue, stop, exhausted, max_pages ):
+    """Fetch gallery pages in order and hand their HTML to the parse stage."""
+    skip = 0
+    pages = 0
+
+    while not stop.is_set() and not exhausted.is_set():
+        if max_pages is not None and pages >= max_pages:
+            break
+
+        await limiter.wait() # polite delay per request
+        html = await asyncio.to_thread( fetch_page, skip, base_url )
+        if html is None: break
+
+        await page_queue.put( ( skip, html ) )
+        skip += PAGE_SIZE
+        pages += 1
+
+    await page_queue.put( None ) # signal end of pages
+
+
+async def parse_stage( page_queue, parse_queue, stop, exhausted ):
+    """Parse fetched pages into (item, url) entries, flagging the end of the gallery."""
+    while True:
+        page = await page_queue.get()
+        if page is None: break
+        if stop.is_set() or exhausted.is_set(): continue # drain pages fetched past the end
+
+        skip, html = page
+        entries = await asyncio.to_thread( parse_page, html )
+        if not entries:
+            print( f"No items on page skip={skip}, stopping." )
+            exhausted.set() # earlier pages still flow through the remaining stages
+            continue
+
+        await parse_queue.put( ( skip, entries ) )
+
+    await parse_queue.put( None )
+
+
+async def download_stage( parse_queue, insert_queue, pool, stop ):
+    """Download and compress the images of each parsed page."""
+    while True:
+        page = await parse_queue.get()
+        if page is None: break
+        if stop.is_set(): continue # don't download pages that will never be inserted
+
+        skip, entries = page
+        start = time.perf_counter()
+        downloaded = await asyncio.to_thread( resolve_images, entries, pool )
+        print( f"Page skip={skip}: {len( entries )} items, {downloaded} downloaded in {time.perf_counter() - start:.1f}s" )
+
+        await insert_queue.put( ( skip, [item for item, url in entries] ) )
+
+    await insert_queue.put( None )
+
+
+async def insert_stage( insert_queue, run, stop, continue_on_empty ):
+    """Insert new items into the database and write the JSON backup."""
+    while True:
+        page = await insert_queue.get()
+        if page is None: break
+
+        # Keep draining after a stop so upstream stages are never left blocked on a full queue
+        if stop.is_set(): continue
+
+        skip, items = page
+        batch_new_count = await asyncio.to_thread( run.store_items, items )
+        await asyncio.to_thread( run.save_backup )
+        print( f"Saved {run.total_known()} items in database (skip={skip}, {batch_new_count} new this batch)" )
+
+        # Stop if no new items found in this batch (unless --continue-on-empty is set)
+        if batch_new_count == 0 and not continue_on_empty:
+            print( "No new items, stopping." )
+            stop.set()
+
+
+async def crawl( run, base_url=scraper.BASE_URL, delay=2.0, queue_size=2, pool=None, continue_on_empty=False, max_pages=None ):
+    """Run the fetch, parse, download and insert stages concurrently until the gallery is exhausted.
+
+    Args:
+        run: ScrapeRun with known files already loaded
+        base_url: Gallery URL (a local stand-in may be used for testing)
+        delay: Minimum seconds between gallery page requests
+        queue_size: Maximum pages buffered between consecutive stages
+        pool: Optional DownloadPool for concurrent image downloads
+        continue_on_empty: Keep crawling when a page has no new items
+        max_pages: Optional cap on pages fetched
+    """
+    stop = asyncio.Event()          # set by the insert stage; later pages are discarded
+    exhausted = asyncio.Event()     # set by the parse stage when a page comes back empty
+    page_queue = asyncio.Queue( maxsize=queue_size )
+    parse_queue = asyncio.Queue( maxsize=queue_size )
+    insert_queue = asyncio.Queue( maxsize=queue_size )
+
+    await asyncio.gather(
+        fetch_stage( base_url, RateLimiter( delay ), page_queue, stop, exhausted, max_pages ),
+        parse_stage( page_queue, parse_queue, stop, exhausted ),
+        download_stage( parse_queue, insert_queue, pool, stop ),
+        insert_stage( insert_queue, run, stop, continue_on_empty )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Crawl the Perchance gallery with pipelined stages' )
+    parser.add_argument( '--base-url', default=scraper.BASE_URL,
+                        help='Gallery URL to crawl (default: live Perchance gallery)' )
+    parser.add_argument( '--delay', type=float, default=2.0,
+                        help='Minimum seconds between gallery page requests (default: 2.0)' )
+    parser.add_argument( '--queue-size', type=int, default=2,
+                        help='Pages buffered between stages (default: 2)' )
+    parser.add_argument( '--download-workers', type=int, default=0,
+                        help='Download images with N concurrent workers (default: 0, sequential)' )
+    parser.add_argument( '--max-pages', type=int,
+                        help='Stop after fetching N pages' )
+    parser.add_argument( '--continue-on-empty', action='store_true',
+                        help='Continue crawling even when no new items found in a batch' )
+    parser.add_argument( '--skip-near-duplicates', type=int, nargs='?', const=DEFAULT_DISTANCE, metavar='BITS',
+                        help=f'Don\'t keep images within BITS (default: {DEFAULT_DISTANCE}) of an image already shown' )
+    scraper.add_encode_arguments( parser )
+    args = parser.parse_args()
+
+    # Ensure folder structure exists
+    os.makedirs( scraper.MEDIUM_DIR, exist_ok=True )
+    scraper.apply_encode_arguments( args )
+    os.makedirs( "../data", exist_ok=True )
+
+    db.connect()
+
+    run = ScrapeRun( args.skip_near_duplicates )
+    run.load_known_files()
+    pool = DownloadPool( args.download_workers ) if args.download_workers > 0 else None
+
+    try:
+        asyncio.run( crawl( run, args.base_url, args.delay, args.queue_size, pool, args.continue_on_empty, args.max_pages ) )
+    finally:
+        if pool: pool.close()
+        run.save_index()
+        db.close()
+
+    print( f"Added {len( run.new_results )} new items. Total now {run.total_known()}." )
+    if run.near_duplicates:
+        print( f"Skipped {run.near_duplicates} near-duplicate images (rows kept as deleted)." )
+    run_post_scrape( run.new_image_ids )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+
 -- Drop old tokens table
 DROP TABLE IF EXISTS tokens;
 
@@ -0,0 +1,149 @@
+"""
+Shared database access for the python/ scripts.
+
+Connection settings live in DB_CONFIG (each can be overridden with a PERCHANCE_DB_*
+environment variable) and connections are handed out from a bounded pool per
+database, so long-running jobs and concurrent workers reuse connections instead of
+reconnecting. close() on a pooled connection returns it to the pool.
+
+Also provides unbuffered streaming cursors for large scans, server-side prepared
+cursors for hot single-row lookups, and the batch sizes used by bulk operations
+(overridable the same way, e.g. PERCHANCE_DB_LOOKUP_BATCH_SIZE=500).
+"""
+
+import os
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import pooling
+
+
+def _env_int( name, default ):
+    """Read an integer setting from the environment."""
+    return int( os.environ.get( name, default ) )
+
+
+DB_CONFIG = {
+    'host': os.environ.get( 'PERCHANCE_DB_HOST', 'localhost' ),
+    'user': os.environ.get( 'PERCHANCE_DB_USER', 'root' ),
+    'password': os.environ.get( 'PERCHANCE_DB_PASSWORD', '' ),
+    'database': os.environ.get( 'PERCHANCE_DB_NAME', 'perchance_gallery' ),
+    'charset': 'utf8mb4',
+    'use_unicode': True
+}
+
+POOL_SIZE = _env_int( 'PERCHANCE_DB_POOL_SIZE', 4 )                 # connections per database
+POOL_TIMEOUT = _env_int( 'PERCHANCE_DB_POOL_TIMEOUT', 30 )          # seconds to wait for a free connection
+
+LOOKUP_BATCH_SIZE = _env_int( 'PERCHANCE_DB_LOOKUP_BATCH_SIZE', 1000 )  # keys per WHERE ... IN / multi-row INSERT
+FETCH_CHUNK_SIZE = _env_int( 'PERCHANCE_DB_FETCH_CHUNK_SIZE', 5000 )    # rows per fetchmany on streaming cursors
+INSERT_BATCH_SIZE = _env_int( 'PERCHANCE_DB_INSERT_BATCH_SIZE', 10000 ) # rows per executemany
+LOAD_CHUNK_ROWS = _env_int( 'PERCHANCE_DB_LOAD_CHUNK_ROWS', 1000000 )   # rows per LOAD DATA statement
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool( database=None ):
+    """Return the connection pool for a database, creating it on first use."""
+    database = database or DB_CONFIG['database']
+
+    with _pools_lock:
+        if database not in _pools:
+            _pools[database] = pooling.MySQLConnectionPool(
+                pool_name=f"perchance_{database}"[:64],
+                pool_size=POOL_SIZE,
+                pool_reset_session=True,
+                **dict( DB_CONFIG, database=database )
+            )
+        return _pools[database]
+
+
+def get_connection( database=None, pooled=True, **overrides ):
+    """Get a connection to a database.
+
+    Args:
+        database: Database name (default: DB_CONFIG['database'])
+        pooled: Take the connection from the shared pool, waiting up to POOL_TIMEOUT
+                seconds when every pooled connection is in use
+        overrides: Extra mysql.connector settings; these always open a dedicated,
+                   unpooled connection
+
+    Returns:
+        Connection; close() returns pooled connections to the pool
+    """
+    if not pooled or overrides:
+        config = dict( DB_CONFIG, **overrides )
+        if database: config['database'] = database
+        return mysql.connector.connect( **config )
+
+    pool = get_pool( database )
+    deadline = time.monotonic() + POOL_TIMEOUT
+    while True:
+        try:
+            return pool.get_connection()
+        except pooling.PoolError:
+            if time.monotonic() >= deadline: raise
+            time.sleep( 0.1 )
+
+
+def get_server_connection( **overrides ):
+    """Open an unpooled connection without selecting a database (for CREATE/DROP DATABASE)."""
+    config = dict( DB_CONFIG, **overrides )
+    config.pop( 'database', None )
+    return mysql.connector.connect( **config )
+
+
+def streaming_cursor( conn, dictionary=False ):
+    """Return an unbuffered cursor whose rows stay on the server until fetched.
+
+    The connection can't run other statements until the result is fully read.
+    """
+    return conn.cursor( buffered=False, dictionary=dictionary )
+
+
+def iter_rows( conn, query, params=(), dictionary=False, chunk_size=FETCH_CHUNK_SIZE ):
+    """Stream a large result set chunk_size rows at a time through an unbuffered cursor."""
+    cursor = streaming_cursor( conn, dictionary )
+    try:
+        cursor.execute( query, params )
+        while True:
+            rows = cursor.fetchmany( chunk_size )
+            if not rows: break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def prepared_cursor( conn ):
+    """Return a cursor that uses server-side prepared statements.
+
+    The cursor keeps its last statement prepared, so give each hot statement its
+    own cursor (see PreparedStatements).
+    """
+    return conn.cursor( prepared=True )
+
+
+class PreparedStatements:
+    """One prepared cursor per statement, so repeated lookups skip the parse step."""
+
+    def __init__( self, conn ):
+        self.conn = conn
+        self.cursors = {}
+
+    def fetchone( self, query, params ):
+        """Run a prepared lookup and return its first row (or None)."""
+        cursor = self.cursors.get( query )
+        if cursor is None:
+            cursor = self.cursors[query] = prepared_cursor( self.conn )
+
+        cursor.execute( query, params )
+        rows = cursor.fetchall() # read the whole result so the connection is free for the next statement
+        return rows[0] if rows else None
+
+    def close( self ):
+        """Close every prepared cursor (deallocating its statement)."""
+        for cursor in self.cursors.values():
+            cursor.close()
+        self.cursors = {}
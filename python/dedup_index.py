@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+On-disk dedup index of known image filenames.
+
+The index is a sorted array of 64-bit filename hashes, memory-mapped at startup so
+opening it costs the same at 100K or 1M images. A hit only means "probably known"
+(hashes can collide), so callers confirm hits against the database; a miss is
+definitive. The index records the highest image ID it has seen, and sync_from_db()
+catches up on rows inserted since then by any other tool with one primary-key range scan.
+
+Filenames that are only in the results backup (downloads that never reached the
+database) cannot be confirmed that way. build() keeps them, as exact names, in
+the index metadata, and is_backup_only() treats them as known without a query.
+
+Usage:
+    python dedup_index.py --rebuild   # Rebuild the index from the database and results backup
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+
+from results_log import RESULTS_LOG, iter_results
+
+INDEX_PATH = "../data/known_files.idx"
+
+
+def filename_hash( filename ):
+    """Return the 64-bit hash stored in the index for a filename."""
+    return int.from_bytes( hashlib.blake2b( filename.encode( 'utf-8' ), digest_size=8 ).digest(), 'little' )
+
+
+class DedupIndex:
+    """Memory-mapped sorted array of filename hashes plus an in-memory set of additions."""
+
+    def __init__( self, path=INDEX_PATH ):
+        self.path = path
+        self.meta_path = path + '.json'
+        self.max_image_id = 0
+        self.pending = set()    # hashes added since the array was last written
+        self.backup_only = set()    # known filenames found only in the results backup
+        self._file = None
+        self._mmap = None
+        self._hashes = ()       # memoryview over the mapped array
+
+    def open( self ):
+        """Map the index file if it exists. Returns False when the index still needs building."""
+        if not os.path.exists( self.path ) or not os.path.exists( self.meta_path ):
+            return False
+
+        with open( self.meta_path, 'r', encoding='utf-8' ) as f:
+            meta = json.load( f )
+        self.max_image_id = meta.get( 'max_image_id', 0 )
+        self.backup_only = set( meta.get( 'backup_only', [] ) )
+
+        if os.path.getsize( self.path ) > 0:
+            self._file = open( self.path, 'rb' )
+            self._mmap = mmap.mmap( self._file.fileno(), 0, access=mmap.ACCESS_READ )
+            self._hashes = memoryview( self._mmap ).cast( 'Q' )
+
+        return True
+
+    def close( self ):
+        """Release the memory map."""
+        if self._mmap:
+            self._hashes.release()
+            self._mmap.close()
+            self._file.close()
+        self._hashes, self._mmap, self._file = (), None, None
+
+    def __len__( self ):
+        return len( self._hashes ) + len( self.pending )
+
+    def _contains_hash( self, value ):
+        """Check the pending set and binary-search the mapped array for a hash."""
+        if value in self.pending: return True
+
+        pos = bisect_left( self._hashes, value )
+        return pos < len( self._hashes ) and self._hashes[pos] == value
+
+    def might_contain( self, filename ):
+        """Return True if the filename is probably known (confirm against the database), False if definitely new."""
+        return self._contains_hash( filename_hash( filename ) )
+
+    def is_backup_only( self, filename ):
+        """Return True if the filename is a known download that is only in the results backup."""
+        return filename in self.backup_only
+
+    def add( self, filenames ):
+        """Record newly stored filenames; they are written out on the next save()."""
+        for filename in filenames:
+            value = filename_hash( filename )
+            if not self._contains_hash( value ):
+                self.pending.add( value )
+
+    def sync_from_db( self, cursor ):
+        """Add filenames of images inserted since the index was last saved. Returns how many were added."""
+        cursor.execute( 'SELECT id, filename FROM images WHERE id > %s AND filename IS NOT NULL', ( self.max_image_id, ) )
+        rows = cursor.fetchall()
+
+        self.add( filename for _, filename in rows )
+        if rows:
+            self.max_image_id = max( row_id for row_id, _ in rows )
+        return len( rows )
+
+    def save( self, max_image_id=None ):
+        """Merge pending hashes into the sorted array and atomically replace the index file."""
+        if max_image_id is not None:
+            self.max_image_id = max( self.max_image_id, max_image_id )
+
+        hashes = array( 'Q' )
+        if self._mmap:
+            hashes.frombytes( self._mmap[:] )
+        hashes.extend( sorted( self.pending ) )
+        merged = array( 'Q', sorted( hashes ) ) # timsort merges the two sorted runs in linear time
+
+        # The map must be released before the file is replaced (required on Windows)
+        self.close()
+        write_atomic( self.path, merged.tobytes() )
+        meta = {'max_image_id': self.max_image_id, 'count': len( merged ), 'backup_only': sorted( self.backup_only )}
+        write_atomic( self.meta_path, json.dumps( meta ).encode( 'utf-8' ) )
+
+        self.pending = set()
+        self.open()
+
+    def build( self, cursor, results_path=RESULTS_LOG ):
+        """Rebuild the index from every filename in the database and the results backup."""
+        self.close()
+        self.pending = set()
+        self.backup_only = set()
+        self.max_image_id = 0
+        self.sync_from_db( cursor )
+
+        # Backup entries that never reached the database are still known downloads,
+        # but a database query can't confirm them, so they are also kept by name
+        for item in iter_results( results_path ):
+            filename = item.get( 'filename' )
+            if filename and not self._contains_hash( filename_hash( filename ) ):
+                self.backup_only.add( filename )
+                self.add( [filename] )
+        self.save()
+
+
+def write_atomic( path, data ):
+    """Write bytes to a temp file, fsync it and swap it into place."""
+    temp_path = path + '.tmp'
+    with open( temp_path, 'wb' ) as f:
+        f.write( data )
+        f.flush()
+        os.fsync( f.fileno() )
+    os.replace( temp_path, path )
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Maintain the known-filename dedup index' )
+    parser.add_argument( '--path', default=INDEX_PATH, help=f'Index file (default: {INDEX_PATH})' )
+    parser.add_argument( '--rebuild', action='store_true', help='Rebuild from the database and results backup' )
+    args = parser.parse_args()
+
+    from scraper import db
+
+    db.connect()
+    try:
+        index = DedupIndex( args.path )
+        if args.rebuild or not index.open():
+            index.build( db.cursor )
+            print( f"Built {args.path}: {len( index ):,} filenames" )
+        else:
+            added = index.sync_from_db( db.cursor )
+            index.save()
+            print( f"Synced {args.path}: {added:,} new filenames, {len( index ):,} total" )
+        index.close()
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
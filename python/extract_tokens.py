@@ -3,42 +3,40 @@ Extract tokens from prompts and negative prompts, storing results in the databas
 This should be run periodically to keep the tokens table up-to-date with current data.
 
 Usage:
-    python extract_tokens.py          # Full rebuild (clears and rebuilds entire table)
+    python extract_tokens.py          # Full rebuild (streams images, clears and bulk-loads the table)
     python extract_tokens.py --update # Incremental update (updates counts, adds new tokens)
+    python extract_tokens.py --update --image-ids 101,102  # Add counts for these new images only
+    python extract_tokens.py --workers 8  # Tokenize across 8 processes
 """
 
-import re
 import mysql.connector
-from collections import defaultdict
+from collections import Counter
 from pathlib import Path
 import sys
+import time
 import argparse
 
 # Add parent directory to path for imports
 sys.path.insert( 0, str( Path( __file__ ).parent ) )
 
-def get_db_connection():
-    """Create database connection."""
-    return mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='',
-        database='perchance_gallery'
-    )
+from aggregate_counts import reconcile
+from database import FETCH_CHUNK_SIZE, INSERT_BATCH_SIZE, get_connection, iter_rows
+from tokenizer import count_tokens, merge_counts, map_shards, tree_reduce
 
-def extract_tokens( text ):
-    """Extract tokens from text using delimiters: comma, period, line breaks."""
-    if not text:
-        return []
-    
-    # Split by comma, period, or common line break indicators
-    delimiters = r'[,.\n]|\\n'
-    tokens = re.split( delimiters, text )
-    
-    # Clean up tokens: strip whitespace, filter empty strings, lowercase for consistency
-    tokens = [token.strip().lower() for token in tokens if token.strip()]
-    
-    return tokens
+IMAGE_DATA_QUERY = """
+    SELECT 
+        i.id,
+        pp.prompt_text AS prompt,
+        np.prompt_text AS negative_prompt,
+        i.art_style_id,
+        ast.style_string
+    FROM images i
+    LEFT JOIN prompt_combinations pc ON i.prompt_combination_id = pc.id
+    LEFT JOIN positive_prompts pp ON pc.positive_prompt_id = pp.id
+    LEFT JOIN negative_prompts np ON pc.negative_prompt_id = np.id
+    LEFT JOIN art_styles ast ON i.art_style_id = ast.id
+    WHERE i.deleted = 0
+"""
 
 def get_image_data( cursor, image_ids=None ):
     """Retrieve images with their prompts from the database.
@@ -49,175 +47,156 @@ def get_image_data( cursor, image_ids=None ):
     """
     if image_ids:
         placeholders = ','.join(['%s'] * len(image_ids))
-        query = f"""
-            SELECT 
-                i.id,
-                pp.prompt_text AS prompt,
-                np.prompt_text AS negative_prompt,
-                i.art_style_id,
-                ast.style_string
-            FROM images i
-            LEFT JOIN prompt_combinations pc ON i.prompt_combination_id = pc.id
-            LEFT JOIN positive_prompts pp ON pc.positive_prompt_id = pp.id
-            LEFT JOIN negative_prompts np ON pc.negative_prompt_id = np.id
-            LEFT JOIN art_styles ast ON i.art_style_id = ast.id
-            WHERE i.deleted = 0 AND i.id IN ({placeholders})
-        """
-        cursor.execute( query, image_ids )
+        cursor.execute( IMAGE_DATA_QUERY + f" AND i.id IN ({placeholders})", image_ids )
     else:
-        cursor.execute( """
-            SELECT 
-                i.id,
-                pp.prompt_text AS prompt,
-                np.prompt_text AS negative_prompt,
-                i.art_style_id,
-                ast.style_string
-            FROM images i
-            LEFT JOIN prompt_combinations pc ON i.prompt_combination_id = pc.id
-            LEFT JOIN positive_prompts pp ON pc.positive_prompt_id = pp.id
-            LEFT JOIN negative_prompts np ON pc.negative_prompt_id = np.id
-            LEFT JOIN art_styles ast ON i.art_style_id = ast.id
-            WHERE i.deleted = 0
-        """ )
+        cursor.execute( IMAGE_DATA_QUERY )
     return cursor.fetchall()
 
-def extract_all_tokens( images ):
-    """Extract and count all tokens from images."""
-    prompt_tokens = defaultdict( int )
-    negative_prompt_tokens = defaultdict( int )
+def iter_image_data( db, chunk_size=FETCH_CHUNK_SIZE ):
+    """Stream all non-deleted images with their prompts through an unbuffered cursor.
     
+    Rows are pulled from the server chunk_size at a time, so memory use does not grow
+    with the number of images. The connection can't run other queries until the
+    generator is exhausted.
+    """
+    return iter_rows( db, IMAGE_DATA_QUERY, dictionary=True, chunk_size=chunk_size )
+
+def image_rows( images ):
+    """Reduce image rows to the (prompt, negative_prompt, style_string) tuples the tokenizer needs."""
     for item in images:
-        prompt = item.get( 'prompt' ) or ''
-        negative_prompt = item.get( 'negative_prompt' ) or ''
-        style_string = item.get( 'style_string' ) or ''
-        
-        # Remove style string from prompt if it exists
-        if style_string:
-            prompt = prompt.replace( style_string, '' )
-        
-        # Extract and count tokens from prompt
-        for token in extract_tokens( prompt ):
-            prompt_tokens[token] += 1
-        
-        # Extract and count tokens from negative_prompt
-        for token in extract_tokens( negative_prompt ):
-            negative_prompt_tokens[token] += 1
-    
-    return prompt_tokens, negative_prompt_tokens
+        yield ( item.get( 'prompt' ), item.get( 'negative_prompt' ), item.get( 'style_string' ) )
 
-def full_rebuild( cursor, db ):
-    """Completely rebuild the tokens table from scratch."""
-    print( "=== FULL REBUILD MODE ===" )
-    print( "Loading images and prompts..." )
+def extract_all_tokens( images, workers=1 ):
+    """Extract and count all tokens from images.
     
-    images = get_image_data( cursor )
-    print( f"Loaded {len( images )} images" )
-    
-    print( "Extracting tokens..." )
-    prompt_tokens, negative_prompt_tokens = extract_all_tokens( images )
-    
-    # Sort by frequency (most common first)
-    sorted_prompt_tokens = sorted( prompt_tokens.items(), key=lambda x: x[1], reverse=True )
-    sorted_negative_tokens = sorted( negative_prompt_tokens.items(), key=lambda x: x[1], reverse=True )
-    
-    # Clear existing tokens
-    print( "Clearing old tokens..." )
-    cursor.execute( "SET FOREIGN_KEY_CHECKS = 0" )
-    cursor.execute( "TRUNCATE TABLE tokens" )
-    cursor.execute( "SET FOREIGN_KEY_CHECKS = 1" )
-    db.commit()
-    
-    # Close and reconnect to ensure we see fresh data
-    cursor.close()
-    db.close()
-    db = get_db_connection()
-    cursor = db.cursor( dictionary=True )
-    
-    # Verify table is empty
-    cursor.execute( "SELECT COUNT(*) as cnt FROM tokens" )
-    result = cursor.fetchone()
-    count = result['cnt']
-    print( f"Table now has {count} rows (after reconnect)" )
-    
-    if count > 0:
-        print( "ERROR: Table still has rows after TRUNCATE!" )
-        cursor.execute( "SELECT token FROM tokens LIMIT 10" )
-        print( "Sample rows:", cursor.fetchall() )
-        return None
+    Args:
+        images: Any iterable of image rows, consumed once (e.g. iter_image_data)
+        workers: Tokenize shards of images in this many processes (1 = in this process)
+    """
+    rows = image_rows( images )
+    if workers <= 1:
+        return count_tokens( rows )
     
-    # Combine all tokens and their counts
-    all_tokens = {}
+    merged = tree_reduce( map_shards( count_tokens, rows, workers ), merge_counts )
+    return merged or ( Counter(), Counter() )
+
+def iter_token_rows( prompt_tokens, negative_prompt_tokens ):
+    """Yield (token, positive_count, negative_count) for every token seen in either counter."""
     for token, count in prompt_tokens.items():
-        if token not in all_tokens:
-            all_tokens[token] = {'positive': 0, 'negative': 0}
-        all_tokens[token]['positive'] = count
+        yield ( token, count, negative_prompt_tokens.get( token, 0 ) )
     
     for token, count in negative_prompt_tokens.items():
-        if token not in all_tokens:
-            all_tokens[token] = {'positive': 0, 'negative': 0}
-        all_tokens[token]['negative'] = count
-    
-    print( f"Combined into {len( all_tokens )} unique tokens" )
-    
-    # Debug: Check for 'P' specifically
-    if 'P' in all_tokens:
-        print( f"Token 'P' found with counts: {all_tokens['P']}" )
+        if token not in prompt_tokens:
+            yield ( token, 0, count )
+
+def insert_token_batch( cursor, rows ):
+    """Insert a batch of token rows as one multi-row INSERT.
     
-    # Convert to list to check for duplicates
-    token_list = list(all_tokens.keys())
-    print( f"Token list length: {len(token_list)}" )
-    print( f"Unique tokens in list: {len(set(token_list))}" )
+    Tokens the table's collation treats as equal are merged by summing their counts.
+    If the batch fails, it is retried row by row so one problematic token (unicode
+    issues, etc) doesn't lose the rest of the batch.
     
-    # Count 'P' occurrences
-    p_count = token_list.count('P')
-    print( f"'P' appears {p_count} times in token list" )
+    Returns:
+        (inserted, skipped) row counts
+    """
+    query = """
+        INSERT INTO tokens (token, positive_prompt_count, negative_prompt_count)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE 
+            positive_prompt_count = positive_prompt_count + VALUES(positive_prompt_count),
+            negative_prompt_count = negative_prompt_count + VALUES(negative_prompt_count)
+    """
+    try:
+        cursor.executemany( query, rows )
+        return len( rows ), 0
+    except mysql.connector.Error:
+        pass
     
-    # Insert all tokens
-    print( f"Inserting tokens..." )
     inserted = 0
     skipped = 0
-    seen = set()
-    for token, counts in all_tokens.items():
-        if token in seen:
-            print( f"WARNING: Token '{token}' already seen! Skipping..." )
-            skipped += 1
-            continue
-        seen.add(token)
-        
+    for row in rows:
         try:
-            cursor.execute( """
-                INSERT INTO tokens (token, positive_prompt_count, negative_prompt_count)
-                VALUES (%s, %s, %s)
-            """, (token, counts['positive'], counts['negative']) )
+            cursor.execute( query, row )
             inserted += 1
-            if inserted % 10000 == 0:
-                print( f"  Inserted {inserted}/{len(all_tokens)}..." )
-                db.commit()
-        except Exception as e:
-            # Skip tokens that cause errors (unicode issues, etc)
+        except mysql.connector.Error as e:
             skipped += 1
-            if skipped <= 10:  # Only show first 10 errors
-                print( f"Skipping problematic token: {repr(token)[:50]} - {e}" )
+            print( f"Skipping problematic token: {repr(row[0])[:50]} - {e}" )
+    return inserted, skipped
+
+def full_rebuild( cursor, db, workers=1 ):
+    """Completely rebuild the tokens table from scratch.
     
+    Images are streamed from an unbuffered cursor and only the token counters are held
+    in memory, so peak memory depends on the number of distinct tokens rather than the
+    number of images. Tokens are then loaded with multi-row INSERTs.
+    
+    Args:
+        workers: Processes used for tokenization (see extract_all_tokens)
+    """
+    print( "=== FULL REBUILD MODE ===" )
+    print( "Streaming images and extracting tokens..." )
+    
+    start = time.perf_counter()
+    prompt_tokens, negative_prompt_tokens = extract_all_tokens( iter_image_data( db ), workers )
+    print( f"Extracted {len( prompt_tokens )} prompt and {len( negative_prompt_tokens )} negative prompt tokens "
+           f"in {time.perf_counter() - start:.1f}s" )
+    
+    # Clear existing tokens
+    print( "Clearing old tokens..." )
+    cursor.execute( "SET FOREIGN_KEY_CHECKS = 0" )
+    cursor.execute( "TRUNCATE TABLE tokens" )
+    cursor.execute( "SET FOREIGN_KEY_CHECKS = 1" )
     db.commit()
-    print( f"Successfully inserted {inserted} tokens (skipped {skipped} problematic tokens)" )
+    
+    # Insert all tokens in batches
+    total = len( prompt_tokens.keys() | negative_prompt_tokens.keys() )
+    print( f"Inserting {total} unique tokens..." )
+    inserted = 0
+    skipped = 0
+    batch = []
+    start = time.perf_counter()
+    
+    for row in iter_token_rows( prompt_tokens, negative_prompt_tokens ):
+        batch.append( row )
+        if len( batch ) >= INSERT_BATCH_SIZE:
+            batch_inserted, batch_skipped = insert_token_batch( cursor, batch )
+            inserted += batch_inserted
+            skipped += batch_skipped
+            db.commit()
+            batch = []
+            print( f"  Inserted {inserted}/{total}..." )
+    
+    if batch:
+        batch_inserted, batch_skipped = insert_token_batch( cursor, batch )
+        inserted += batch_inserted
+        skipped += batch_skipped
+    db.commit()
+    
+    elapsed = time.perf_counter() - start
+    print( f"Successfully inserted {inserted} tokens (skipped {skipped} problematic tokens) "
+           f"in {elapsed:.1f}s ({inserted / elapsed if elapsed else 0:,.0f} rows/s)" )
+    
+    # The tokens were reloaded with new IDs, so recount the token counters and the 'tokens' row count
+    print( "Recounting token counters..." )
+    reconcile( db, ['token_counts', 'table_counts'] )
     
     return {
-        'prompt_tokens': len( sorted_prompt_tokens ),
-        'negative_tokens': len( sorted_negative_tokens ),
+        'prompt_tokens': len( prompt_tokens ),
+        'negative_tokens': len( negative_prompt_tokens ),
         'prompt_occurrences': sum( prompt_tokens.values() ),
         'negative_occurrences': sum( negative_prompt_tokens.values() ),
-        'top_prompt': sorted_prompt_tokens[:10] if sorted_prompt_tokens else [],
-        'top_negative': sorted_negative_tokens[:10] if sorted_negative_tokens else []
+        'top_prompt': prompt_tokens.most_common( 10 ),
+        'top_negative': negative_prompt_tokens.most_common( 10 )
     }
 
-def incremental_update( cursor, db, image_ids=None ):
+def incremental_update( cursor, db, image_ids=None, workers=1 ):
     """Update token counts incrementally without clearing the table.
     
     Args:
         cursor: Database cursor (must be dictionary cursor)
         db: Database connection
         image_ids: Optional list of specific image IDs to process. If None, processes all images.
+        workers: Processes used for tokenization (see extract_all_tokens)
     """
     print( "=== INCREMENTAL UPDATE MODE ===" )
     
@@ -234,7 +213,7 @@ def incremental_update( cursor, db, image_ids=None ):
         return
     
     print( "Extracting tokens..." )
-    prompt_tokens, negative_prompt_tokens = extract_all_tokens( images )
+    prompt_tokens, negative_prompt_tokens = extract_all_tokens( images, workers )
     
     # Combine all tokens
     all_tokens = {}
@@ -312,19 +291,25 @@ def main():
     parser = argparse.ArgumentParser( description='Extract tokens from prompts and update database' )
     parser.add_argument( '--update', action='store_true', 
                         help='Incremental update mode (default: full rebuild)' )
+    parser.add_argument( '--image-ids', type=lambda text: [int( v ) for v in text.split( ',' ) if v.strip()],
+                        help='With --update, only count tokens of these images (comma-separated IDs)' )
+    parser.add_argument( '--workers', type=int, default=1,
+                        help='Tokenize prompts in N processes (default: 1)' )
     args = parser.parse_args()
     
     print( "Connecting to database..." )
-    db = get_db_connection()
+    db = get_connection()
     cursor = db.cursor( dictionary=True )
     
     try:
         if args.update:
-            stats = incremental_update( cursor, db )
+            stats = incremental_update( cursor, db, args.image_ids, args.workers )
         else:
-            stats = full_rebuild( cursor, db )
+            stats = full_rebuild( cursor, db, args.workers )
         
-        print_stats( stats )
+        # incremental_update returns None when there were no images to process
+        if stats:
+            print_stats( stats )
     
     finally:
         cursor.close()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Denormalized gallery feed: one row per image shown in the gallery.
+
+web/api/data.php used to join images with prompt_combinations, both prompt
+tables, art_styles and titles and concatenate each image's tags on every
+request. The gallery_feed table holds the result of that join, so browsing
+reads a single table through one of its indexes:
+
+- recent: the primary key, read backwards (newest first)
+- style:  idx_style (style_missing, art_style, newest_first)
+- prompt: idx_prompt (prompt_key, prompt_hash, newest_first) to page through
+          prompt groups, idx_prompt_hash to fetch the images of a page
+
+newest_first is -image_id, so "style ascending, newest first" is a plain
+ascending index scan (MariaDB before 10.8 ignores DESC in index definitions).
+prompt_key is the first PROMPT_KEY_LENGTH characters of the prompt; prompts
+sharing that prefix are ordered by their hash. Prompt searches find their
+prompts through the word index (search_index.py) and match them on prompt_id.
+
+The feed is kept in sync incrementally: the scraper refreshes the rows of the
+images it stores (and the maintenance step repeats this if it failed),
+retention removes the rows of expired images, and the web API updates the tags
+and removes deleted images. --rebuild recreates the whole table.
+
+Usage:
+    python gallery_feed.py --rebuild                 # Rebuild the feed from the normalized tables
+    python gallery_feed.py --image-ids 101,102       # Refresh the rows of these images
+    python gallery_feed.py --check                   # Compare the feed with the normalized tables
+"""
+
+import argparse
+import time
+
+from database import LOOKUP_BATCH_SIZE, get_connection
+
+FEED_BATCH_SIZE = 20000     # image ID range copied per statement during a rebuild
+PROMPT_KEY_LENGTH = 191     # longest indexable utf8mb4 prefix on older row formats
+
+FEED_TABLE = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        image_id INT PRIMARY KEY,
+        newest_first INT NOT NULL,
+        filename VARCHAR(255) NOT NULL,
+        prompt TEXT NULL,
+        prompt_id INT NULL,
+        prompt_hash VARCHAR(64) NULL,
+        prompt_key VARCHAR(191) NULL,
+        negative_prompt TEXT NULL,
+        art_style VARCHAR(100) NULL,
+        style_missing TINYINT(1) NOT NULL,
+        title TEXT NULL,
+        seed VARCHAR(50) NULL,
+        date_downloaded DATE NULL,
+        tags TEXT NULL,
+        INDEX idx_style (style_missing, art_style, newest_first),
+        INDEX idx_prompt (prompt_key, prompt_hash, newest_first),
+        INDEX idx_prompt_hash (prompt_hash, newest_first),
+        INDEX idx_prompt_id (prompt_id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+FEED_COLUMNS = ( "image_id, newest_first, filename, prompt, prompt_id, prompt_hash, prompt_key, negative_prompt, "
+                 "art_style, style_missing, title, seed, date_downloaded, tags" )
+
+# Feed rows of the live images matching {condition}
+FEED_SELECT = f"""
+    SELECT
+        i.id AS image_id,
+        -i.id AS newest_first,
+        i.filename,
+        pp.prompt_text AS prompt,
+        pp.id AS prompt_id,
+        pp.hash AS prompt_hash,
+        LEFT(pp.prompt_text, {PROMPT_KEY_LENGTH}) AS prompt_key,
+        np.prompt_text AS negative_prompt,
+        a.name AS art_style,
+        a.name IS NULL AS style_missing,
+        t.title_text AS title,
+        i.seed,
+        i.date_downloaded,
+        (SELECT GROUP_CONCAT(DISTINCT t2.name ORDER BY t2.name ASC SEPARATOR ',')
+         FROM image_tags it2
+         JOIN tags t2 ON it2.tag_id = t2.id
+         WHERE it2.image_id = i.id) AS tags
+    FROM images i
+    LEFT JOIN prompt_combinations pc ON i.prompt_combination_id = pc.id
+    LEFT JOIN positive_prompts pp ON pc.positive_prompt_id = pp.id
+    LEFT JOIN negative_prompts np ON pc.negative_prompt_id = np.id
+    LEFT JOIN art_styles a ON i.art_style_id = a.id
+    LEFT JOIN titles t ON i.title_id = t.id
+    WHERE i.deleted = 0 AND {{condition}}
+"""
+
+
+def ensure_table( cursor, table='gallery_feed' ):
+    """Create the feed table if it doesn't exist yet."""
+    cursor.execute( FEED_TABLE.format( table=table ) )
+
+def remove_images( cursor, image_ids ):
+    """Remove images from the feed (deleted or expired images)."""
+    image_ids = list( image_ids )
+    for start in range( 0, len( image_ids ), LOOKUP_BATCH_SIZE ):
+        batch = image_ids[start:start + LOOKUP_BATCH_SIZE]
+        placeholders = ','.join( ['%s'] * len( batch ) )
+        cursor.execute( f"DELETE FROM gallery_feed WHERE image_id IN ({placeholders})", batch )
+
+def refresh_images( cursor, image_ids ):
+    """Rewrite the feed rows of images from the normalized tables.
+
+    Rows of images that are deleted (or no longer exist) are removed. The caller commits.
+    """
+    image_ids = sorted( set( image_ids ) )
+    for start in range( 0, len( image_ids ), LOOKUP_BATCH_SIZE ):
+        batch = image_ids[start:start + LOOKUP_BATCH_SIZE]
+        placeholders = ','.join( ['%s'] * len( batch ) )
+        cursor.execute( f"DELETE FROM gallery_feed WHERE image_id IN ({placeholders})", batch )
+        cursor.execute(
+            f"INSERT INTO gallery_feed ({FEED_COLUMNS}) " + FEED_SELECT.format( condition=f"i.id IN ({placeholders})" ),
+            batch
+        )
+
+def rebuild( db, batch_size=FEED_BATCH_SIZE ):
+    """Recreate the feed from the normalized tables.
+
+    The new feed is filled in a separate table, one image ID range per commit,
+    and swapped in with a single RENAME TABLE, so the gallery keeps reading the
+    old feed until the new one is complete. Images added while the rebuild ran
+    are refreshed after the swap.
+
+    Returns:
+        Number of rows in the new feed
+    """
+    cursor = db.cursor()
+    rows = 0
+    start = time.perf_counter()
+
+    try:
+        ensure_table( cursor )
+        cursor.execute( "DROP TABLE IF EXISTS gallery_feed_new" )
+        ensure_table( cursor, 'gallery_feed_new' )
+
+        cursor.execute( "SELECT COALESCE(MAX(id), 0) FROM images" )
+        max_id = cursor.fetchone()[0]
+        for low in range( 0, max_id, batch_size ):
+            cursor.execute(
+                f"INSERT INTO gallery_feed_new ({FEED_COLUMNS}) " + FEED_SELECT.format( condition="i.id > %s AND i.id <= %s" ),
+                ( low, low + batch_size )
+            )
+            rows += cursor.rowcount
+            db.commit()
+            elapsed = time.perf_counter() - start
+            print( f"  {rows:,} feed rows ({min( low + batch_size, max_id ):,} of {max_id:,} image IDs, {rows / elapsed:,.0f} rows/s)" )
+
+        cursor.execute( "DROP TABLE IF EXISTS gallery_feed_old" )
+        cursor.execute( "RENAME TABLE gallery_feed TO gallery_feed_old, gallery_feed_new TO gallery_feed" )
+        cursor.execute( "DROP TABLE gallery_feed_old" )
+
+        cursor.execute( "SELECT id FROM images WHERE id > %s", ( max_id, ) )
+        added = [row[0] for row in cursor.fetchall()]
+        if added:
+            refresh_images( cursor, added )
+        db.commit()
+
+        cursor.execute( "SELECT COUNT(*) FROM gallery_feed" )
+        rows = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+    return rows
+
+def check( db ):
+    """Compare the feed with a fresh join of the normalized tables.
+
+    Returns:
+        Dict with counts of 'missing', 'stale' and 'extra' feed rows
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute( f"""
+            SELECT
+                SUM(f.image_id IS NULL),
+                SUM(f.image_id IS NOT NULL AND NOT (
+                    f.filename <=> live.filename AND f.prompt <=> live.prompt AND f.negative_prompt <=> live.negative_prompt
+                    AND f.art_style <=> live.art_style AND f.title <=> live.title AND f.seed <=> live.seed
+                    AND f.date_downloaded <=> live.date_downloaded AND f.tags <=> live.tags))
+            FROM ({FEED_SELECT.format( condition="1" )}) AS live
+            LEFT JOIN gallery_feed f ON f.image_id = live.image_id
+        """ )
+        missing, stale = cursor.fetchone()
+        cursor.execute( """
+            SELECT COUNT(*) FROM gallery_feed f
+            LEFT JOIN images i ON i.id = f.image_id
+            WHERE i.id IS NULL OR i.deleted = 1
+        """ )
+        extra = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+    return {'missing': int( missing or 0 ), 'stale': int( stale or 0 ), 'extra': extra}
+
+def main():
+    parser = argparse.ArgumentParser( description='Maintain the denormalized gallery feed table' )
+    parser.add_argument( '--rebuild', action='store_true', help='Rebuild the whole feed from the normalized tables' )
+    parser.add_argument( '--image-ids', type=lambda text: [int( v ) for v in text.split( ',' ) if v.strip()], default=[],
+                        help='Refresh the feed rows of these images (comma-separated)' )
+    parser.add_argument( '--check', action='store_true', help='Count feed rows that are missing, stale or extra' )
+    args = parser.parse_args()
+
+    db = get_connection()
+    try:
+        if args.rebuild:
+            start = time.perf_counter()
+            rows = rebuild( db )
+            print( f"Feed rebuilt: {rows:,} rows in {time.perf_counter() - start:.1f}s" )
+
+        if args.image_ids:
+            cursor = db.cursor()
+            try:
+                ensure_table( cursor )
+                refresh_images( cursor, args.image_ids )
+                db.commit()
+            finally:
+                cursor.close()
+            print( f"Refreshed {len( args.image_ids ):,} images" )
+
+        if args.check:
+            result = check( db )
+            print( f"Feed check: {result['missing']:,} missing, {result['stale']:,} stale, {result['extra']:,} extra rows" )
+            if any( result.values() ):
+                exit( 1 )
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Perchance gallery, for running the crawler offline.
+
+Serves the canned `.imageCtn` pages in fixtures/gallery: a request with
+skip=N gets page_{N // PAGE_SIZE}.html, and any skip past the last page gets
+an empty page, so the crawler's pagination and its stop on an exhausted
+gallery can be exercised. Image URLs in the pages point back at the stand-in,
+which renders a small PNG per image name (the same bytes every time). The skip
+of every page request is recorded in order.
+
+`python benchmark.py crawl` runs the crawler against it with a scratch
+database and checks what was stored.
+
+Usage:
+    python gallery_stub.py                           # Serve on http://localhost:8000/gallery
+    python gallery_stub.py --port 8080
+    python crawler.py --base-url http://localhost:8000/gallery --delay 0
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURE_DIR = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'fixtures', 'gallery' )
+PAGE_SIZE = 200     # skip step of the crawler (crawler.PAGE_SIZE)
+EMPTY_PAGE = "<html><body><p>No more images.</p></body></html>"
+
+
+def render_image( name, size=64 ):
+    """PNG bytes of a test image derived from its name: a few coloured bands, distinct per name."""
+    from PIL import Image, ImageDraw
+
+    digest = hashlib.sha256( name.encode( 'utf-8' ) ).digest()
+    img = Image.new( 'RGB', ( size, size ), tuple( digest[:3] ) )
+    draw = ImageDraw.Draw( img )
+    for band in range( 4 ):
+        offset = 3 + band * 6
+        top = digest[offset] % size
+        draw.rectangle( ( 0, top, size, top + size // 6 ), fill=tuple( digest[offset + 1:offset + 4] ) )
+
+    out = io.BytesIO()
+    img.save( out, 'PNG' )
+    return out.getvalue()
+
+
+class GalleryStub:
+    """Threaded HTTP server serving the canned gallery pages; use as a context manager."""
+
+    def __init__( self, fixture_dir=FIXTURE_DIR, port=0 ):
+        self.fixture_dir = fixture_dir
+        self.requests = []      # skip of each page request, in arrival order
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer( ( '127.0.0.1', port ), self.handler_class() )
+        self.thread = None
+
+    @property
+    def origin( self ):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @property
+    def url( self ):
+        """Gallery URL to pass to the crawler as its base URL."""
+        return self.origin + "/gallery"
+
+    def page( self, skip ):
+        """HTML of the page at skip (empty past the last canned page)."""
+        path = os.path.join( self.fixture_dir, f"page_{skip // PAGE_SIZE}.html" )
+        if skip % PAGE_SIZE or not os.path.exists( path ):
+            return EMPTY_PAGE
+
+        with open( path, 'r', encoding='utf-8' ) as f:
+            return f.read().replace( '{origin}', self.origin )
+
+    def handler_class( self ):
+        stub = self
+
+        class Handler( BaseHTTPRequestHandler ):
+            def do_GET( self ):
+                url = urlparse( self.path )
+                if url.path == '/gallery':
+                    try:
+                        skip = int( parse_qs( url.query ).get( 'skip', ['0'] )[0] )
+                    except ValueError:
+                        self.send_error( 400, 'Invalid skip' )
+                        return
+                    with stub.lock:
+                        stub.requests.append( skip )
+                    self.send_body( stub.page( skip ).encode( 'utf-8' ), 'text/html; charset=utf-8' )
+                elif url.path.startswith( '/images/' ) and url.path.endswith( '.png' ):
+                    self.send_body( render_image( os.path.basename( url.path ) ), 'image/png' )
+                else:
+                    self.send_error( 404 )
+
+            def send_body( self, body, content_type ):
+                self.send_response( 200 )
+                self.send_header( 'Content-Type', content_type )
+                self.send_header( 'Content-Length', str( len( body ) ) )
+                self.end_headers()
+                self.wfile.write( body )
+
+            def log_message( self, format, *args ):
+                pass # keep crawler output readable
+
+        return Handler
+
+    def start( self ):
+        self.thread = threading.Thread( target=self.server.serve_forever, daemon=True )
+        self.thread.start()
+        return self
+
+    def close( self ):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__( self ):
+        return self.start()
+
+    def __exit__( self, *exc ):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Serve canned gallery pages for the crawler' )
+    parser.add_argument( '--port', type=int, default=8000 )
+    parser.add_argument( '--fixtures', default=FIXTURE_DIR, help='Directory of page_N.html files' )
+    args = parser.parse_args()
+
+    stub = GalleryStub( args.fixtures, args.port )
+    print( f"Serving {args.fixtures} at {stub.url} (Ctrl+C to stop)" )
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -2,22 +2,34 @@
 """
 Group images by identical (prompt, negative_prompt) pairs.
 
+Groups are kept in an incrementally updated store (../data/grouped.jsonl, see
+group_store.py) that remembers how far the results backup has been read. Each
+run streams only the results added since the last run and rewrites only the
+groups that gained images.
+
 Usage:
-  python group_prompts.py --results ../data/results.json --images-dir ../images/medium --output ../data/grouped.json
+  python group_prompts.py --results ../data/results.jsonl --store ../data/grouped.jsonl
+  python group_prompts.py --output ../data/grouped.json     # Also export the single-file index
   python group_prompts.py --make-folders --copy --limit 10
 
 Options:
-  --results PATH        Path to results.json (default: ../data/results.json)
+  --results PATH        Path to results.jsonl or a legacy results.json (default: ../data/results.jsonl)
   --images-dir PATH     Directory containing image files (default: ../images/medium)
-  --output PATH         Output JSON file for group index (default: ../data/grouped.json)
-  --make-folders        Create per-group folders under ../images/groups/<hash>
-  --copy                Copy image files into group folders (implies --make-folders)
-  --limit N             Only process first N entries (debugging)
-  --min-count N         Only include groups with at least N images (default: 2)
+  --store PATH          Incremental group store (default: ../data/grouped.jsonl)
+  --output PATH         Export the full group index to this JSON file
+  --rebuild             Discard the store and regroup the whole results backup
+  --make-folders        Create per-group folders under ../images/groups/<hash> for changed groups
+  --copy                Place image files into group folders (implies --make-folders)
+  --link-mode MODE      How --copy places files: hardlink (default), reflink, symlink or copy.
+                        Unsupported modes fall back to reflink, then to a plain copy
+  --workers N           Threads placing files (default: 8)
+  --all-folders         Materialize every group, not only those changed by this run
+  --limit N             Only process first N new entries (debugging)
+  --min-count N         Only include groups with at least N images (default: 1)
   --slug-length N       Length of hash slug for folder naming (default: 10)
-  --dry-run             Do everything except writing output JSON / creating folders
+  --dry-run             Report changed groups without writing the store, export or folders
 
-Output JSON structure:
+Exported JSON structure (one group per line):
 {
   "generated_at": ISO timestamp,
   "source_file": path,
@@ -31,8 +43,7 @@ Output JSON structure:
        "count": 5,
        "filenames": ["a.jpg", ...]
      }, ...
-  ],
-  "orphans": ["filename_without_prompt.jpg", ...]
+  ]
 }
 """
 from __future__ import annotations
@@ -40,10 +51,23 @@ import argparse
 import json
 import hashlib
 import datetime as dt
+import errno
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Tuple
+import itertools
 import shutil
 import sys
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+from image_layout import locate_image
+from group_store import STORE_PATH, GroupStore
+from results_log import iter_json_array, iter_json_lines_from, legacy_path_for, results_exist
 
 def normalize( text: str ) -> str:
     """Collapse whitespace and strip."""
@@ -53,14 +77,41 @@ def hash_pair( prompt: str, negative: str ) -> str:
     h = hashlib.sha1( ( prompt + "\u241f" + negative ).encode( "utf-8" ) ).hexdigest()
     return h
 
-def load_results( path: Path, limit: int | None ) -> List[dict]:
-    data = json.loads( path.read_text( encoding="utf-8" ) )
-    if limit is not None:
-        data = data[:limit]
-    return data
+def file_signature( path: str ) -> List[int]:
+    """Size and modification time, to tell whether a JSON array file changed since it was grouped."""
+    st = os.stat( path )
+    return [st.st_size, st.st_mtime_ns]
+
+def iter_new_results( path: Path, position: dict ) -> Iterator[dict]:
+    """Stream result entries added since position was recorded, advancing position as they are read.
+
+    A legacy JSON array (results.json, or the sibling of a .jsonl log) is read again
+    in full only if it changed. The JSON Lines log resumes from the byte offset it
+    was last read to, or from the start if it was rewritten (e.g. by results_log.py --compact).
+    """
+    path = str( path )
+    arrays = [path] if not path.endswith( ".jsonl" ) else [legacy_path_for( path )]
+    for array_path in arrays:
+        if not os.path.exists( array_path ): continue
+        signature = file_signature( array_path )
+        if position.get( "arrays", {} ).get( array_path ) == signature: continue
+        yield from iter_json_array( array_path )
+        position.setdefault( "arrays", {} )[array_path] = signature
+
+    if not path.endswith( ".jsonl" ) or not os.path.exists( path ): return
+
+    st = os.stat( path )
+    log = position.get( "log", {} )
+    offset = log.get( "offset", 0 ) if log.get( "path" ) == path and log.get( "inode" ) == st.st_ino else 0
+    if offset > st.st_size: offset = 0
+    position["log"] = {"path": path, "inode": st.st_ino, "offset": offset}
+
+    for item, end in iter_json_lines_from( path, offset ):
+        position["log"]["offset"] = end
+        yield item
 
 def load_existing_groups( path: Path ) -> Tuple[Dict[Tuple[str,str], List[str]], List[str]]:
-    """Load existing grouped.json and return groups dict and orphans."""
+    """Load a legacy grouped.json and return groups dict and orphans."""
     if not path.exists():
         return {}, []
     data = json.loads( path.read_text( encoding="utf-8" ) )
@@ -71,8 +122,10 @@ def load_existing_groups( path: Path ) -> Tuple[Dict[Tuple[str,str], List[str]],
     orphans = data.get( "orphans", [] )
     return groups, orphans
 
-def group_entries( entries: List[dict] ) -> Tuple[Dict[Tuple[str,str], List[dict]], List[str]]:
-    groups: Dict[Tuple[str,str], List[dict]] = {}
+def group_entries( entries: Iterable[dict] ) -> Tuple[Dict[Tuple[str,str], List[str]], List[str]]:
+    """Group a stream of result entries into filename lists (in first-seen order, without duplicates)."""
+    groups: Dict[Tuple[str,str], List[str]] = {}
+    seen: Dict[Tuple[str,str], set] = {}
     orphans: List[str] = []
     for item in entries:
         prompt = item.get( "prompt" )
@@ -82,92 +135,201 @@ def group_entries( entries: List[dict] ) -> Tuple[Dict[Tuple[str,str], List[dict
             if filename:
                 orphans.append( filename )
             continue
+        if not filename:
+            continue
         n_prompt = normalize( prompt )
         n_neg = normalize( neg )
         key = ( n_prompt, n_neg )
-        groups.setdefault( key, [] ).append( item )
+        if key not in groups:
+            groups[key] = []
+            seen[key] = set()
+        if filename not in seen[key]:
+            seen[key].add( filename )
+            groups[key].append( filename )
     return groups, orphans
 
-def merge_groups( existing: Dict[Tuple[str,str], List[str]], new: Dict[Tuple[str,str], List[dict]] ) -> Dict[Tuple[str,str], List[str]]:
-    """Merge new items into existing groups, returning combined groups."""
+def merge_groups( existing: Dict[Tuple[str,str], List[str]], new: Dict[Tuple[str,str], List[str]] ) -> Dict[Tuple[str,str], List[str]]:
+    """Merge new filenames into existing groups, returning combined groups."""
     merged = dict( existing )
-    for key, items in new.items():
-        filenames = [i.get( "filename" ) for i in items if i.get( "filename" )]
+    for key, filenames in new.items():
         if key in merged:
-            # Add only new filenames
-            merged[key].extend( f for f in filenames if f not in merged[key] )
+            # Add only new filenames (set lookup, so linear in the group size)
+            known = set( merged[key] )
+            merged[key] = merged[key] + [f for f in dict.fromkeys( filenames ) if f not in known]
         else:
-            merged[key] = filenames
+            merged[key] = list( dict.fromkeys( filenames ) )
     return merged
 
-def build_index( groups: Dict[Tuple[str,str], List[str]], orphans: List[str], min_count: int, slug_length: int, source_file: Path ) -> dict:
-    # Separate groups with multiple entries from single entries
-    multi_groups = []
-    single_groups = []
-    
-    for key, filenames in groups.items():
-        if len( filenames ) < min_count:
+def by_hash( groups: Dict[Tuple[str,str], List[str]] ) -> Dict[str, Tuple[str, str, List[str]]]:
+    """Key groups by their full hash, as the store expects."""
+    return {hash_pair( prompt, negative ): ( prompt, negative, filenames ) for ( prompt, negative ), filenames in groups.items()}
+
+def order_groups( store: GroupStore, min_count: int ) -> List[Tuple[str, int]]:
+    """Return (hash, count) of groups with at least min_count images in index order.
+
+    Multi-image groups come first by count (descending) then prompt, followed by
+    single-image groups by prompt; ties keep the order in which groups were created.
+    """
+    keys = []
+    for group in store.iter_groups():
+        count = len( group["filenames"] )
+        if count < min_count:
             continue
-        prompt, negative = key
-        full_hash = hash_pair( prompt, negative )
-        slug = full_hash[:slug_length]
-        group_data = {
-            "id": "",  # Will be assigned later
-            "hash": slug,
-            "prompt": prompt,
-            "negative_prompt": negative,
-            "count": len( filenames ),
-            "filenames": filenames,
-        }
-        
-        if len( filenames ) > 1:
-            multi_groups.append( group_data )
-        else:
-            single_groups.append( group_data )
-    
-    # Sort multi-groups by count (descending) then prompt
-    multi_groups.sort( key=lambda g: ( -g["count"], g["prompt"][:80] ) )
-    
-    # Sort single-groups by prompt
-    single_groups.sort( key=lambda g: g["prompt"][:80] )
-    
-    # Combine: multi-groups first, then single-groups
-    out_groups = multi_groups + single_groups
-    
-    # Assign IDs
-    for idx, group in enumerate( out_groups, start=1 ):
-        group["id"] = f"group_{idx:04d}"
-    
-    return {
+        keys.append( ( count == 1, -count, group["prompt"][:80], store.index[group["hash"]][3], group["hash"] ) )
+    keys.sort()
+    return [( group_hash, -negative_count ) for _, negative_count, _, _, group_hash in keys]
+
+def export_index( store: GroupStore, output_path: Path, min_count: int, slug_length: int, source_file: Path ) -> int:
+    """Stream the full group index to a JSON file, one group per line. Returns the group count."""
+    ordered = order_groups( store, min_count )
+    header = {
         "generated_at": dt.datetime.utcnow().isoformat( timespec="seconds" ) + "Z",
         "source_file": str( source_file ),
-        "group_count": len( out_groups ),
-        "groups": out_groups,
+        "group_count": len( ordered ),
     }
 
-def create_group_folders( base_images: Path, groups: List[dict], copy: bool ) -> None:
+    output_path.parent.mkdir( parents=True, exist_ok=True )
+    temp_path = output_path.with_name( output_path.name + ".tmp" )
+    with open( temp_path, "w", encoding="utf-8" ) as f:
+        f.write( json.dumps( header )[:-1] + ', "groups": [' )
+        for idx, ( group_hash, count ) in enumerate( ordered, start=1 ):
+            group = store.get( group_hash )
+            f.write( ( ",\n" if idx > 1 else "\n" ) + json.dumps( {
+                "id": f"group_{idx:04d}",
+                "hash": group_hash[:slug_length],
+                "prompt": group["prompt"],
+                "negative_prompt": group["negative_prompt"],
+                "count": count,
+                "filenames": group["filenames"],
+            } ) )
+        f.write( "\n]}\n" )
+    os.replace( temp_path, output_path )
+    return len( ordered )
+
+FICLONE = 0x40049409    # Linux ioctl that clones a file's extents (Btrfs, XFS, ...)
+
+LINK_MODES = {
+    # mode: methods to try, in order; a method that fails is dropped for the rest of the run
+    "hardlink": ( "hardlink", "reflink", "copy" ),
+    "reflink": ( "reflink", "copy" ),
+    "symlink": ( "symlink", "copy" ),
+    "copy": ( "copy", ),
+}
+
+def reflink( src: Path, dst: Path ) -> None:
+    """Create dst as a copy-on-write clone of src."""
+    if fcntl is None:
+        raise OSError( errno.EOPNOTSUPP, "reflinks are not supported on this platform" )
+    with open( src, "rb" ) as source, open( dst, "wb" ) as target:
+        try:
+            fcntl.ioctl( target.fileno(), FICLONE, source.fileno() )
+        except OSError:
+            target.close()
+            os.remove( dst )
+            raise
+    shutil.copystat( src, dst )
+
+def symlink( src: Path, dst: Path ) -> None:
+    """Create dst as a relative symlink to src."""
+    if not src.exists():
+        raise FileNotFoundError( errno.ENOENT, "source image not found", str( src ) )
+    os.symlink( os.path.relpath( src, dst.parent ), dst )
+
+PLACE_METHODS = {
+    "hardlink": os.link,
+    "reflink": reflink,
+    "symlink": symlink,
+    "copy": shutil.copy2,
+}
+
+class Materializer:
+    """Places files with the cheapest method that works, falling back when one is unsupported."""
+
+    def __init__( self, mode: str ):
+        self.methods = list( LINK_MODES[mode] )
+        self.counts: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def place( self, src: Path, dst: Path ) -> None:
+        for method in list( self.methods ):
+            try:
+                PLACE_METHODS[method]( src, dst )
+            except FileNotFoundError:
+                self._count( "missing" )
+                return
+            except FileExistsError:
+                self._count( "present" )
+                return
+            except OSError as e:
+                if method == "copy":
+                    raise
+                # Cross-device link, no reflink support, no symlink privilege, ...
+                with self.lock:
+                    if method in self.methods:
+                        self.methods.remove( method )
+                        print( f"  {method} unavailable ({e}), falling back to {self.methods[0]}" )
+                continue
+            self._count( method )
+            return
+
+    def _count( self, key: str ) -> None:
+        with self.lock:
+            self.counts[key] += 1
+
+def create_group_folders( base_images: Path, groups: List[dict], copy: bool, mode: str = "copy", workers: int = 8 ) -> Counter:
+    """Create a folder per group and, with copy, place each group's images in it.
+
+    Only files missing from a folder are placed, so re-runs only stat the folders.
+
+    Returns:
+        Counter of files placed per method, plus 'present' and 'missing' (no source image)
+    """
     target_root = base_images.parent / "groups"
     target_root.mkdir( parents=True, exist_ok=True )
+    materializer = Materializer( mode )
+    tasks = []
     for g in groups:
         slug = g["hash"]
         folder = target_root / slug
         folder.mkdir( exist_ok=True )
         if copy:
+            present = {entry.name for entry in os.scandir( folder )}
             for fname in g["filenames"]:
-                src = base_images / fname
-                if not src.exists():
-                    continue
-                dst = folder / fname
-                if not dst.exists():
-                    shutil.copy2( src, dst )
+                if fname in present:
+                    materializer.counts["present"] += 1
+                else:
+                    tasks.append( ( fname, folder / fname ) )
+
+    def place( task ) -> None:
+        fname, dst = task
+        src = locate_image( str( base_images ), fname ) # flat or sharded, see image_layout.py
+        if src is None:
+            materializer._count( "missing" )
+        else:
+            materializer.place( Path( src ), dst )
+
+    if workers > 1 and len( tasks ) > 1:
+        with ThreadPoolExecutor( max_workers=workers ) as pool:
+            for _ in pool.map( place, tasks ):
+                pass
+    else:
+        for task in tasks:
+            place( task )
+    return materializer.counts
 
 def parse_args( argv: List[str] ) -> argparse.Namespace:
     p = argparse.ArgumentParser( description="Group images by identical prompt + negative_prompt" )
-    p.add_argument( "--results", default="../data/results.json" )
+    p.add_argument( "--results", default="../data/results.jsonl" )
     p.add_argument( "--images-dir", default="../images/medium" )
-    p.add_argument( "--output", default="../data/grouped.json" )
+    p.add_argument( "--store", default=STORE_PATH, help=f"Incremental group store (default: {STORE_PATH})" )
+    p.add_argument( "--output", help="Export the full group index to this JSON file" )
+    p.add_argument( "--rebuild", action="store_true", help="Discard the store and regroup everything" )
     p.add_argument( "--make-folders", action="store_true" )
-    p.add_argument( "--copy", action="store_true", help="Copy images into folders (implies --make-folders)" )
+    p.add_argument( "--copy", action="store_true", help="Place images into folders (implies --make-folders)" )
+    p.add_argument( "--link-mode", choices=list( LINK_MODES ), default="hardlink",
+                    help="How --copy places files; unsupported modes fall back to reflink, then copy (default: hardlink)" )
+    p.add_argument( "--workers", type=int, default=8, help="Threads placing files (default: 8)" )
+    p.add_argument( "--all-folders", action="store_true", help="Materialize every group, not only changed ones" )
     p.add_argument( "--limit", type=int )
     p.add_argument( "--min-count", type=int, default=1 )
     p.add_argument( "--slug-length", type=int, default=10 )
@@ -178,34 +340,57 @@ def main( argv: List[str] ) -> int:
     args = parse_args( argv )
     results_path = Path( args.results )
     images_dir = Path( args.images_dir )
-    output_path = Path( args.output )
-    if not results_path.exists():
+    store_path = Path( args.store )
+    if not results_exist( str( results_path ) ):
         print( f"ERROR: results file not found: {results_path}", file=sys.stderr )
         return 2
-    
-    # Load existing groups (incremental mode)
-    existing_groups, existing_orphans = load_existing_groups( output_path )
-    
-    # Load and group new entries
-    entries = load_results( results_path, args.limit )
-    new_groups, new_orphans = group_entries( entries )
-    
-    # Merge
-    merged_groups = merge_groups( existing_groups, new_groups )
-    all_orphans = list( set( existing_orphans + new_orphans ) )
-    
-    # Build final index
-    index = build_index( merged_groups, all_orphans, args.min_count, args.slug_length, results_path )
-    
-    # If folder creation requested, ensure we keep only groups with >= min_count
-    if args.make_folders or args.copy:
-        create_group_folders( images_dir, index["groups"], copy=args.copy )
+
+    store = GroupStore( str( store_path ) )
+    if args.rebuild and not args.dry_run:
+        store.reset()
+
+    seeded = {}
+    if not store.open() and not args.rebuild:
+        # First run: carry over groups from a legacy grouped.json
+        legacy_groups, _ = load_existing_groups( store_path.with_suffix( ".json" ) )
+        seeded = by_hash( legacy_groups )
+
+    # Stream and group only the entries added since the last run
+    entries = iter_new_results( results_path, store.position )
+    new_groups, new_orphans = group_entries( itertools.islice( entries, args.limit ) )
+    updates = by_hash( new_groups )
+    for group_hash, ( prompt, negative, filenames ) in seeded.items():
+        if group_hash in updates:
+            filenames = filenames + updates[group_hash][2]
+        updates[group_hash] = ( prompt, negative, filenames )
+
+    changed = store.update( updates, write=not args.dry_run )
+    print( f"{len( changed )} of {len( store )} groups changed ({len( new_orphans )} new entries without a prompt)" )
+
     if args.dry_run:
-        print( json.dumps( index, indent=2 )[:5000] )
-    else:
-        output_path.parent.mkdir( parents=True, exist_ok=True )
-        output_path.write_text( json.dumps( index, indent=2 ), encoding="utf-8" )
-        print( f"Wrote {index['group_count']} groups to {output_path}" )
+        for group in changed[:20]:
+            print( f"  {group['hash'][:args.slug_length]}: {len( group['filenames'] )} images  {group['prompt'][:80]}" )
+        store.close()
+        return 0
+
+    store.save()
+
+    # Only changed groups can have new files to place, unless every folder is requested
+    if args.make_folders or args.copy:
+        folders = [
+            {"hash": group["hash"][:args.slug_length], "filenames": group["filenames"]}
+            for group in ( store.iter_groups() if args.all_folders else changed )
+            if len( group["filenames"] ) >= args.min_count
+        ]
+        counts = create_group_folders( images_dir, folders, copy=args.copy, mode=args.link_mode, workers=args.workers )
+        if args.copy:
+            print( f"Group folders: {', '.join( f'{key} {value}' for key, value in sorted( counts.items() ) ) or 'nothing to place'}" )
+
+    if args.output:
+        count = export_index( store, Path( args.output ), args.min_count, args.slug_length, results_path )
+        print( f"Wrote {count} groups to {args.output}" )
+
+    store.close()
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Incrementally updated on-disk store of prompt groups.
+
+Groups live in ../data/grouped.jsonl, one JSON object per line:
+    {"hash": "<sha1 of prompt + negative prompt>", "prompt": ..., "negative_prompt": ..., "filenames": [...]}
+
+Each group's current line is located through an append-only index log
+(grouped.jsonl.idx) of fixed-size records: group hash, byte offset, length,
+image count and creation order, where the last record for a hash wins. A small
+metadata file (grouped.jsonl.json) records how much of both files is valid and
+the position up to which the results backup has been grouped.
+
+Updating a group appends a new line and a new index record, so a regroup only
+reads and writes the groups that changed. Superseded lines and records are dead
+space until they are compacted away, which happens once they outweigh live data.
+
+Both files are written before the metadata. On open, anything written after the
+last metadata save is truncated away (those results are simply regrouped), and
+if the files no longer match the metadata at all (a crash mid-compaction) the
+index is rebuilt by scanning the data file, where the last line for a hash wins.
+
+Usage:
+    python group_store.py              # Print store statistics
+    python group_store.py --compact    # Drop superseded lines
+    python group_store.py --reindex    # Rebuild the index from the data file
+"""
+
+import argparse
+import json
+import os
+import struct
+
+STORE_PATH = "../data/grouped.jsonl"
+RECORD = struct.Struct( '<20sQIII' )   # sha1 digest, offset, length, image count, creation order
+
+
+class GroupStore:
+    """Append-only JSON Lines file of groups plus an append-only offset index."""
+
+    def __init__( self, path=STORE_PATH ):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.meta_path = path + '.json'
+        self.index = {}         # group hash -> [offset, length, count, creation order]
+        self.size = 0           # bytes of the data file covered by the metadata
+        self.dead_bytes = 0     # bytes of superseded lines
+        self.records = 0        # index records covered by the metadata
+        self.position = {}      # how far the results backup has been grouped
+        self._reader = None
+
+    def open( self ):
+        """Load the index. Returns False when no store exists yet."""
+        if not os.path.exists( self.meta_path ):
+            if os.path.exists( self.path ) and os.path.getsize( self.path ) > 0:
+                self.reindex()
+                return True
+            return False
+
+        with open( self.meta_path, 'r', encoding='utf-8' ) as f:
+            meta = json.load( f )
+        self.size = meta['size']
+        self.dead_bytes = meta['dead_bytes']
+        self.records = meta['records']
+        self.position = meta.get( 'position', {} )
+
+        data_size = os.path.getsize( self.path ) if os.path.exists( self.path ) else 0
+        index_size = os.path.getsize( self.index_path ) if os.path.exists( self.index_path ) else 0
+        if data_size < self.size or index_size < self.records * RECORD.size:
+            print( f"Warning: {self.path} does not match its metadata, rebuilding the index" )
+            self.reindex()
+            return True
+
+        # Drop lines and records appended after the metadata was last saved
+        if data_size > self.size:
+            with open( self.path, 'r+b' ) as f:
+                f.truncate( self.size )
+        if index_size > self.records * RECORD.size:
+            with open( self.index_path, 'r+b' ) as f:
+                f.truncate( self.records * RECORD.size )
+
+        with open( self.index_path, 'rb' ) as f:
+            for digest, offset, length, count, order in RECORD.iter_unpack( f.read() ):
+                self.index[digest.hex()] = [offset, length, count, order]
+
+        return True
+
+    def reset( self ):
+        """Delete the store's files and forget every group, leaving an empty store.
+
+        The metadata goes first, so an interrupted reset leaves files that open()
+        rebuilds from the data file rather than an index that outlives its data.
+        """
+        self.close()
+        for path in ( self.meta_path, self.path, self.index_path ):
+            if os.path.exists( path ):
+                os.remove( path )
+
+        self.index = {}
+        self.size = 0
+        self.dead_bytes = 0
+        self.records = 0
+        self.position = {}
+
+    def close( self ):
+        """Close the data file reader."""
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+
+    def get( self, group_hash ):
+        """Return a stored group as a dict, or None."""
+        entry = self.index.get( group_hash )
+        if entry is None: return None
+
+        if self._reader is None:
+            self._reader = open( self.path, 'rb' )
+        self._reader.seek( entry[0] )
+        return json.loads( self._reader.read( entry[1] ) )
+
+    def __len__( self ):
+        return len( self.index )
+
+    def iter_groups( self ):
+        """Stream every live group in file order."""
+        live = sorted( ( offset, length ) for offset, length, *_ in self.index.values() )
+        if not live: return
+
+        with open( self.path, 'rb' ) as f:
+            for offset, length in live:
+                f.seek( offset )
+                yield json.loads( f.read( length ) )
+
+    def update( self, groups, write=True ):
+        """Merge new filenames into groups, appending a line for each group that changed.
+
+        Args:
+            groups: {group hash: (prompt, negative_prompt, filenames)}
+            write: Append the changed groups to the store (False computes the changes only)
+
+        Returns:
+            List of changed groups as dicts, with their full filename lists
+        """
+        changed = []
+        lines = []
+        offset = self.size
+
+        # Read existing groups in file order
+        for group_hash in sorted( groups, key=lambda h: self.index[h][0] if h in self.index else -1 ):
+            prompt, negative, filenames = groups[group_hash]
+            group = self.get( group_hash ) or {
+                'hash': group_hash,
+                'prompt': prompt,
+                'negative_prompt': negative,
+                'filenames': []
+            }
+
+            known = set( group['filenames'] )
+            added = [name for name in dict.fromkeys( filenames ) if name not in known]
+            if not added: continue
+
+            group['filenames'].extend( added )
+            line = ( json.dumps( group, ensure_ascii=False ) + '\n' ).encode( 'utf-8' )
+            if group_hash in self.index:
+                self.dead_bytes += self.index[group_hash][1]
+                order = self.index[group_hash][3]
+            else:
+                order = len( self.index )
+            self.index[group_hash] = [offset, len( line ), len( group['filenames'] ), order]
+            offset += len( line )
+
+            lines.append( line )
+            changed.append( group )
+
+        if write and lines:
+            self.close()
+            self._append( self.path, lines )
+            self._append( self.index_path, [self._record( group['hash'] ) for group in changed] )
+            self.records += len( changed )
+        self.size = offset
+
+        return changed
+
+    def save( self ):
+        """Write the metadata atomically, compacting first if the store is mostly dead space."""
+        if self.dead_bytes > self.size - self.dead_bytes:
+            self.compact()
+        elif self.records > 2 * len( self.index ):
+            self.rewrite_index()
+
+        os.makedirs( os.path.dirname( self.meta_path ) or '.', exist_ok=True )
+        temp_path = self.meta_path + '.tmp'
+        with open( temp_path, 'w', encoding='utf-8' ) as f:
+            f.write( json.dumps( {
+                'size': self.size,
+                'dead_bytes': self.dead_bytes,
+                'records': self.records,
+                'position': self.position
+            } ) )
+        os.replace( temp_path, self.meta_path )
+
+    def compact( self ):
+        """Rewrite the data file with only the live line of each group, in creation order."""
+        self.close()
+        temp_path = self.path + '.tmp'
+        index = {}
+        offset = 0
+
+        with open( self.path, 'rb' ) as source, open( temp_path, 'wb' ) as target:
+            for group_hash, ( old_offset, length, count, order ) in sorted( self.index.items(), key=lambda item: item[1][3] ):
+                source.seek( old_offset )
+                target.write( source.read( length ) )
+                index[group_hash] = [offset, length, count, order]
+                offset += length
+            target.flush()
+            os.fsync( target.fileno() )
+
+        os.replace( temp_path, self.path )
+        self.index = index
+        self.size = offset
+        self.dead_bytes = 0
+        self.rewrite_index()
+
+    def rewrite_index( self ):
+        """Rewrite the index log with one record per group."""
+        temp_path = self.index_path + '.tmp'
+        with open( temp_path, 'wb' ) as f:
+            f.write( b''.join( self._record( group_hash ) for group_hash in self.index ) )
+            f.flush()
+            os.fsync( f.fileno() )
+        os.replace( temp_path, self.index_path )
+        self.records = len( self.index )
+
+    def reindex( self ):
+        """Rebuild the index by scanning the data file; the last line for each hash wins.
+
+        Creation order is the order in which hashes first appear, which is preserved
+        by both appends and compaction.
+
+        The results position is reset, so the next update regroups the whole backup
+        (which is idempotent) to pick up anything the lost metadata had recorded.
+        """
+        self.close()
+        self.index = {}
+        self.size = 0
+        self.dead_bytes = 0
+        self.position = {}
+
+        with open( self.path, 'rb' ) as f:
+            for line in f:
+                if not line.endswith( b'\n' ): break # torn final line
+
+                try:
+                    group = json.loads( line )
+                except json.JSONDecodeError:
+                    self.dead_bytes += len( line )
+                else:
+                    previous = self.index.get( group['hash'] )
+                    if previous:
+                        self.dead_bytes += previous[1]
+                    order = previous[3] if previous else len( self.index )
+                    self.index[group['hash']] = [self.size, len( line ), len( group['filenames'] ), order]
+                self.size += len( line )
+
+        with open( self.path, 'r+b' ) as f:
+            f.truncate( self.size )
+        self.rewrite_index()
+
+    def _record( self, group_hash ):
+        """Pack a group's index entry."""
+        return RECORD.pack( bytes.fromhex( group_hash ), *self.index[group_hash] )
+
+    @staticmethod
+    def _append( path, chunks ):
+        """Append byte chunks to a file and fsync."""
+        with open( path, 'ab' ) as f:
+            f.writelines( chunks )
+            f.flush()
+            os.fsync( f.fileno() )
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Maintain the incremental prompt group store' )
+    parser.add_argument( '--path', default=STORE_PATH, help=f'Group store (default: {STORE_PATH})' )
+    parser.add_argument( '--compact', action='store_true', help='Drop superseded lines' )
+    parser.add_argument( '--reindex', action='store_true', help='Rebuild the index from the data file' )
+    args = parser.parse_args()
+
+    store = GroupStore( args.path )
+    if args.reindex and os.path.exists( args.path ):
+        store.reindex()
+    elif not store.open():
+        print( f"{args.path}: no group store" )
+        return
+
+    if args.compact:
+        store.compact()
+    if args.compact or args.reindex:
+        store.save()
+
+    images = sum( entry[2] for entry in store.index.values() )
+    print( f"{args.path}: {len( store ):,} groups, {images:,} images, "
+           f"{store.size:,} bytes ({store.dead_bytes:,} superseded), {store.records:,} index records" )
+
+
+if __name__ == '__main__':
+    main()
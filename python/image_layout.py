@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Storage layout of the image directories.
+
+Images are either stored flat (images/medium/<name>.jpg) or sharded by the MD5
+of their filename (images/medium/ab/cd/<name>.jpg), so no directory holds more
+than a few dozen files at a million images. Each image root records its layout
+in a layout.json file, which web/api/utils/image_paths.php reads as well, so the
+Python and PHP sides always resolve the same path:
+
+    {"mode": "sharded", "depth": 2, "width": 2}
+
+mode is "flat", "sharded" or "migrating". While a migration runs, new images are
+written to their sharded path and lookups check the sharded path first and then
+the flat one, so the scraper and the gallery keep working during the move.
+Long-running processes notice a layout change within REFRESH_INTERVAL seconds.
+
+Usage:
+    python image_layout.py --status                      # Show the layout of each image root
+    python image_layout.py --migrate --workers 16        # Move flat images into shards
+    python image_layout.py --migrate --root ../images/full
+    python image_layout.py --flatten                     # Move images back into a flat layout
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+IMAGE_ROOTS = ( "../images/medium", "../images/full", "../images/thumbs" )
+LAYOUT_FILE = "layout.json"
+DEFAULT_LAYOUT = {'mode': 'flat', 'depth': 2, 'width': 2}
+MOVE_BATCH = 10000      # files listed and moved per batch during a migration
+REFRESH_INTERVAL = 5    # seconds between checks of layout.json for changes
+
+
+def shard_path( filename, depth=2, width=2 ):
+    """Return the path of a file relative to its image root in the sharded layout."""
+    digest = hashlib.md5( filename.encode( 'utf-8' ) ).hexdigest()
+    return '/'.join( [digest[level * width:( level + 1 ) * width] for level in range( depth )] + [filename] )
+
+
+class ImageLayout:
+    """Resolves image filenames to paths under one image root."""
+
+    def __init__( self, root ):
+        self.root = root
+        self.layout_path = os.path.join( root, LAYOUT_FILE )
+        self.reload()
+
+    def reload( self ):
+        """Re-read layout.json."""
+        self.layout = dict( DEFAULT_LAYOUT )
+        self._mtime = self._layout_mtime()
+        self._checked = time.monotonic()
+        if self._mtime is not None:
+            with open( self.layout_path, 'r', encoding='utf-8' ) as f:
+                self.layout.update( json.load( f ) )
+
+    def _layout_mtime( self ):
+        try:
+            return os.stat( self.layout_path ).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _refresh( self ):
+        """Reload the layout if another process changed it (checked every REFRESH_INTERVAL seconds)."""
+        if time.monotonic() - self._checked < REFRESH_INTERVAL: return
+        self._checked = time.monotonic()
+        if self._layout_mtime() != self._mtime:
+            self.reload()
+
+    @property
+    def mode( self ):
+        return self.layout['mode']
+
+    def set_mode( self, mode ):
+        """Switch the layout mode, writing layout.json atomically."""
+        self.layout['mode'] = mode
+        os.makedirs( self.root, exist_ok=True )
+        temp_path = self.layout_path + '.tmp'
+        with open( temp_path, 'w', encoding='utf-8' ) as f:
+            json.dump( self.layout, f )
+        os.replace( temp_path, self.layout_path )
+
+    def relative_path( self, filename ):
+        """Return where a file belongs relative to the root (the sharded path unless the layout is flat)."""
+        self._refresh()
+        if self.mode == 'flat':
+            return filename
+        return shard_path( filename, self.layout['depth'], self.layout['width'] )
+
+    def path( self, filename ):
+        """Return the path a new file should be written to, creating its shard directory."""
+        path = os.path.join( self.root, self.relative_path( filename ) )
+        if self.mode != 'flat':
+            os.makedirs( os.path.dirname( path ), exist_ok=True )
+        return path
+
+    def locate( self, filename ):
+        """Return the path of an existing file, or None if it isn't stored."""
+        path = os.path.join( self.root, self.relative_path( filename ) )
+        if os.path.exists( path ):
+            return path
+
+        if self.mode == 'migrating':
+            flat_path = os.path.join( self.root, filename )
+            if os.path.exists( flat_path ):
+                return flat_path
+        return None
+
+    def exists( self, filename ):
+        return self.locate( filename ) is not None
+
+    def iter_files( self ):
+        """Yield (filename, path) for every stored image, in either layout."""
+        for directory, _, files in os.walk( self.root ):
+            for name in files:
+                if directory == self.root and name == LAYOUT_FILE: continue
+                yield name, os.path.join( directory, name )
+
+
+_layouts = {}
+
+def get_layout( root ):
+    """Return the (cached) layout of an image root."""
+    key = os.path.abspath( root )
+    if key not in _layouts:
+        _layouts[key] = ImageLayout( root )
+    return _layouts[key]
+
+def image_path( root, filename ):
+    """Path to write an image to under root."""
+    return get_layout( root ).path( filename )
+
+def locate_image( root, filename ):
+    """Path of an existing image under root, or None."""
+    return get_layout( root ).locate( filename )
+
+
+def flat_files( root ):
+    """Yield the names of the image files directly in root."""
+    with os.scandir( root ) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name != LAYOUT_FILE and not entry.name.endswith( '.tmp' ):
+                yield entry.name
+
+def migrate( root, workers=8 ):
+    """Move the flat files of an image root into shards while the root stays in use.
+
+    The root is switched to 'migrating' first, so writers already use shard paths
+    and readers fall back to the flat path for files not moved yet. Files are moved
+    with os.replace (a rename within the same filesystem) by a thread pool, and the
+    root is switched to 'sharded' once no flat files are left. Safe to rerun after
+    an interruption.
+
+    Returns:
+        Number of files moved
+    """
+    layout = ImageLayout( root )
+    if layout.mode == 'sharded':
+        return 0
+    if layout.mode == 'flat':
+        layout.set_mode( 'migrating' )
+        time.sleep( REFRESH_INTERVAL ) # let running processes switch to shard paths before listing
+
+    created = set()
+    def move( filename ):
+        relative = layout.relative_path( filename )
+        directory = os.path.dirname( relative )
+        if directory not in created:
+            os.makedirs( os.path.join( root, directory ), exist_ok=True )
+            created.add( directory )
+        os.replace( os.path.join( root, filename ), os.path.join( root, relative ) )
+
+    moved = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor( max_workers=workers ) as pool:
+        # Repeat the listing until a pass finds nothing, to catch files written meanwhile
+        while True:
+            files = flat_files( root )
+            moved_in_pass = 0
+            while True:
+                batch = list( islice( files, MOVE_BATCH ) )
+                if not batch: break
+
+                for _ in pool.map( move, batch ):
+                    pass
+                moved_in_pass += len( batch )
+                elapsed = time.perf_counter() - start
+                print( f"  {root}: {moved + moved_in_pass:,} files moved ({( moved + moved_in_pass ) / elapsed if elapsed else 0:,.0f} files/s)" )
+
+            moved += moved_in_pass
+            if not moved_in_pass: break
+
+    layout.set_mode( 'sharded' )
+    return moved
+
+def sharded_files( root ):
+    """Yield the paths of the image files in the shard directories below root."""
+    for directory, _, files in os.walk( root ):
+        if directory == root: continue
+        for name in files:
+            if not name.endswith( '.tmp' ):
+                yield os.path.join( directory, name )
+
+def flatten( root, workers=8 ):
+    """Move every sharded file of an image root back into the root and remove the shard directories.
+
+    Like migrate(), in reverse: the root is switched to 'migrating' so lookups find
+    both layouts, and the shard directories are listed again until a pass moves
+    nothing, because writers keep using shard paths until the root is 'flat'.
+    Writers that have not noticed the switch to 'flat' yet may still write to a
+    shard path, so after REFRESH_INTERVAL one last sweep moves those files too.
+    Safe to rerun after an interruption.
+
+    Returns:
+        Number of files moved
+    """
+    layout = ImageLayout( root )
+    if layout.mode == 'flat':
+        return 0
+    if layout.mode == 'sharded':
+        layout.set_mode( 'migrating' ) # lookups still find both layouts while files move
+        time.sleep( REFRESH_INTERVAL ) # let running processes see 'migrating' before listing
+
+    def move( path ):
+        os.replace( path, os.path.join( root, os.path.basename( path ) ) )
+
+    def move_all( pool ):
+        """Move the sharded files in passes until one finds nothing; return the number moved."""
+        moved = 0
+        while True:
+            files = sharded_files( root )
+            moved_in_pass = 0
+            while True:
+                batch = list( islice( files, MOVE_BATCH ) )
+                if not batch: break
+
+                for _ in pool.map( move, batch ):
+                    pass
+                moved_in_pass += len( batch )
+                print( f"  {root}: {moved + moved_in_pass:,} files moved" )
+
+            moved += moved_in_pass
+            if not moved_in_pass: return moved
+
+    with ThreadPoolExecutor( max_workers=workers ) as pool:
+        moved = move_all( pool )
+        layout.set_mode( 'flat' )
+        time.sleep( REFRESH_INTERVAL ) # writers still on 'migrating' may write shard paths until they reload
+        moved += move_all( pool )
+
+    # Deepest first, so parents are empty by the time they are removed
+    shard_directories = [directory for directory, _, _ in os.walk( root ) if directory != root]
+    for directory in sorted( shard_directories, key=len, reverse=True ):
+        if not os.listdir( directory ):
+            os.rmdir( directory )
+
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Show or change the storage layout of the image directories' )
+    parser.add_argument( '--root', action='append', help='Image root (default: ../images/medium, full and thumbs)' )
+    parser.add_argument( '--status', action='store_true', help='Show the layout of each image root' )
+    parser.add_argument( '--migrate', action='store_true', help='Move flat images into the sharded layout' )
+    parser.add_argument( '--flatten', action='store_true', help='Move sharded images back into a flat layout' )
+    parser.add_argument( '--workers', type=int, default=8, help='Threads moving files (default: 8)' )
+    args = parser.parse_args()
+
+    for root in args.root or IMAGE_ROOTS:
+        if not os.path.isdir( root ):
+            print( f"{root}: not found, skipping" )
+            continue
+
+        if args.migrate:
+            print( f"{root}: {migrate( root, args.workers ):,} files moved into shards" )
+        elif args.flatten:
+            print( f"{root}: {flatten( root, args.workers ):,} files moved back" )
+        else:
+            layout = ImageLayout( root )
+            print( f"{root}: {layout.mode} (depth {layout.layout['depth']}, width {layout.layout['width']})" )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Image processing helpers shared by the scraper and its worker processes.
+
+Kept free of network and database imports so the functions here can be
+pickled into a ProcessPoolExecutor without re-importing the scraper.
+
+compress_image() is configured by a settings dict (see DEFAULT_SETTINGS):
+
+- passthrough: a downloaded JPEG that is already small and at or below the
+  target quality is written as it is, without re-encoding
+- max_size: larger images are shrunk, JPEGs while decoding (Pillow's draft
+  mode decodes at 1/2, 1/4 or 1/8 scale directly from the DCT data)
+- thumbnail_size: a gallery thumbnail is saved from the same decoded image
+- optimize: the extra Huffman pass of the JPEG encoder (about a quarter
+  smaller files for about 5% more CPU time, so it stays on by default)
+"""
+
+import io
+import os
+from PIL import Image
+
+JPEG_QUALITY = 50
+HASH_SIZE = 8   # dHash grid size; 8 gives a 64-bit hash
+HASH_DECODE_SIZE = 64   # JPEGs only hashed are decoded at the smallest scale still at least this size
+
+DEFAULT_SETTINGS = {
+    'quality': JPEG_QUALITY,
+    'optimize': True,
+    'max_size': None,               # longest side of the stored image in pixels (None = keep the size)
+    'passthrough_bytes': 150000,    # keep JPEG downloads up to this many bytes as they are...
+    'passthrough_quality': 60,      # ...when their estimated quality is at most this (0 = never)
+    'thumbnail_size': None,         # longest side of the thumbnail (None = no thumbnail)
+    'thumbnail_quality': 70,
+}
+
+# IJG standard luminance quantization table (quality 50)
+STANDARD_LUMINANCE = (
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99
+)
+
+
+def dhash( img, size=HASH_SIZE ):
+    """Perceptual difference hash of an image as an int of size * size bits.
+
+    The image is shrunk to (size + 1) x size grayscale pixels and each bit records
+    whether a pixel is brighter than its right neighbour, so re-encodes, resizes
+    and small edits change only a few bits.
+    """
+    pixels = img.convert( "L" ).resize( ( size + 1, size ), Image.LANCZOS ).tobytes()
+    value = 0
+    for row in range( size ):
+        for col in range( size ):
+            offset = row * ( size + 1 ) + col
+            value = value << 1 | ( pixels[offset] > pixels[offset + 1] )
+    return value
+
+
+def hash_file( path ):
+    """dHash of an image file, or None if it can't be read.
+
+    JPEGs are decoded at reduced scale (see HASH_DECODE_SIZE), the same way
+    compress_image() hashes the downloads it stores unchanged.
+    """
+    try:
+        with Image.open( path ) as img:
+            img.draft( img.mode, ( HASH_DECODE_SIZE, HASH_DECODE_SIZE ) )
+            return dhash( img )
+    except OSError:
+        return None
+
+
+def jpeg_quality( img ):
+    """Estimate the IJG quality (1-100) a JPEG was saved at from its luminance table, or None."""
+    tables = getattr( img, 'quantization', None )
+    if not tables or 0 not in tables: return None
+
+    scale = sum( tables[0] ) * 100 / sum( STANDARD_LUMINANCE )
+    return round( 100 - scale / 2 ) if scale <= 100 else round( 5000 / scale )
+
+
+def can_pass_through( img, content, settings ):
+    """Check whether downloaded bytes can be stored as they are."""
+    if img.format != 'JPEG' or img.mode not in ( 'RGB', 'L' ): return False
+    if len( content ) > settings['passthrough_bytes']: return False
+    if settings['max_size'] and max( img.size ) > settings['max_size']: return False
+
+    quality = jpeg_quality( img )
+    return quality is not None and quality <= settings['passthrough_quality']
+
+
+def compress_image( content, out_path, settings=None, thumbnail_path=None ):
+    """Store downloaded image bytes as a JPEG, optionally with a thumbnail, and describe the result.
+
+    Args:
+        content: Raw image bytes as downloaded
+        out_path: Destination path of the stored JPEG
+        settings: Overrides of DEFAULT_SETTINGS
+        thumbnail_path: Where to save the thumbnail (needs settings['thumbnail_size'])
+
+    Returns:
+        Dict with the stored image's 'width', 'height', 'file_size' (bytes) and
+        'dhash' (see dhash())
+    """
+    settings = {**DEFAULT_SETTINGS, **( settings or {} )}
+    max_size = settings['max_size']
+    thumbnail_size = settings['thumbnail_size'] if thumbnail_path else None
+
+    img = Image.open( io.BytesIO( content ) )                      # open image from bytes in memory (header only)
+
+    if can_pass_through( img, content, settings ):
+        with open( out_path, 'wb' ) as f:
+            f.write( content )
+        width, height = img.size
+        file_size = len( content )
+
+        # Only the hash and thumbnail need pixels, so decode at reduced scale
+        decode_size = thumbnail_size or HASH_DECODE_SIZE
+        img.draft( img.mode, ( decode_size, decode_size ) )
+
+    else:
+        if max_size and max( img.size ) > max_size:
+            img.draft( 'RGB', ( max_size, max_size ) )              # JPEG only: decode at the smallest scale still >= max_size
+        if img.mode in ( "RGBA", "P" ): img = img.convert( "RGB" )  # remove alpha channel
+        if max_size and max( img.size ) > max_size:
+            img.thumbnail( ( max_size, max_size ), Image.LANCZOS )
+
+        img.save( out_path, "JPEG", quality=settings['quality'], optimize=settings['optimize'] )  # save compressed image
+        width, height = img.size
+        file_size = os.path.getsize( out_path )
+
+    if thumbnail_size:
+        thumbnail = img.convert( "RGB" ) if img.mode not in ( "RGB", "L" ) else img.copy()
+        thumbnail.thumbnail( ( thumbnail_size, thumbnail_size ), Image.LANCZOS )
+        thumbnail.save( thumbnail_path, "JPEG", quality=settings['thumbnail_quality'] )
+
+    return {'width': width, 'height': height, 'file_size': file_size, 'dhash': dhash( img )}
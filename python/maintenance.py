@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Post-scrape maintenance pipeline.
+
+Derived data (style strings, token relationships, the search index, the gallery
+feed, the table counts cache, ...) is refreshed by a list of steps that share one
+database connection and receive the IDs of the images that changed. Each step is
+timed and runs in its own transaction: steps call their helpers with commit=False
+and run_maintenance() commits once the step returns. A step that fails is rolled
+back and recorded in ../data/maintenance_pending.json together with its image IDs,
+so the next run (or `--retry`) repeats only that step while the steps that
+succeeded are not redone. Steps may create missing tables first (CREATE TABLE
+commits implicitly, but before the step has written anything).
+
+Usage:
+    python maintenance.py --image-ids 101,102        # Refresh derived data for these images
+    python maintenance.py --retry                    # Rerun steps that failed last time
+    python maintenance.py --steps table_counts       # Run selected steps only
+"""
+
+import argparse
+import json
+import os
+import time
+
+from build_token_relationships import update_images
+from database import get_connection
+from gallery_feed import ensure_table as ensure_feed_table, refresh_images as refresh_feed
+from search_index import update_index
+from update_style_strings import styles_of_images, update_style_strings
+from update_table_counts import update_table_counts
+
+PENDING_PATH = "../data/maintenance_pending.json"
+
+
+def style_strings_step( db, image_ids ):
+    """Refresh the style strings of the styles the changed images belong to."""
+    cursor = db.cursor()
+    try:
+        style_ids = styles_of_images( cursor, image_ids ) if image_ids else None
+    finally:
+        cursor.close()
+    update_style_strings( db, style_ids )
+
+
+def token_relationships_step( db, image_ids ):
+    """Build token relationships for the prompts of the changed images."""
+    if not image_ids:
+        print( "No changed images, skipping." )
+        return
+
+    cursor = db.cursor()
+    try:
+        update_images( cursor, db, sorted( image_ids ), commit=False )
+    finally:
+        cursor.close()
+
+
+def search_index_step( db, image_ids ):
+    """Index the words of prompts added since the last run (used by the prompt search)."""
+    update_index( db, commit=False )
+
+
+def gallery_feed_step( db, image_ids ):
+    """Refresh the gallery feed rows of the changed images (normally already done by the scraper)."""
+    if not image_ids:
+        print( "No changed images, skipping." )
+        return
+
+    cursor = db.cursor()
+    try:
+        ensure_feed_table( cursor )
+        refresh_feed( cursor, image_ids )
+    finally:
+        cursor.close()
+
+
+def table_counts_step( db, image_ids ):
+    """Refresh the table counts cache used by the web interface."""
+    update_table_counts( db )
+
+
+# Steps run in this order; add future derived-data steps here
+STEPS = {
+    'style_strings': style_strings_step,
+    'token_relationships': token_relationships_step,
+    'search_index': search_index_step,
+    'gallery_feed': gallery_feed_step,
+    'table_counts': table_counts_step
+}
+
+
+def load_pending( path=PENDING_PATH ):
+    """Return {step name: set of image IDs} for steps that failed on an earlier run."""
+    if not os.path.exists( path ): return {}
+
+    with open( path, 'r', encoding='utf-8' ) as f:
+        return {name: set( ids ) for name, ids in json.load( f ).items()}
+
+
+def save_pending( pending, path=PENDING_PATH ):
+    """Write the failed steps, or remove the file once nothing is pending."""
+    if not pending:
+        if os.path.exists( path ): os.remove( path )
+        return
+
+    os.makedirs( os.path.dirname( path ) or '.', exist_ok=True )
+    temp_path = path + '.tmp'
+    with open( temp_path, 'w', encoding='utf-8' ) as f:
+        json.dump( {name: sorted( ids ) for name, ids in pending.items()}, f )
+    os.replace( temp_path, path )
+
+
+def run_maintenance( db, image_ids=(), steps=None, pending_path=PENDING_PATH ):
+    """Run maintenance steps on a shared connection.
+
+    Args:
+        db: Open database connection
+        image_ids: IDs of images added or changed since the last run
+        steps: Step names to run (default: all). Steps still pending from a failed
+               run are always included, with their earlier image IDs merged in.
+        pending_path: Where failed steps are recorded
+
+    Returns:
+        Dict of step name -> 'ok' or 'failed'
+    """
+    pending = load_pending( pending_path )
+    selected = set( STEPS if steps is None else steps ) | set( pending )
+    results = {}
+
+    for name, step in STEPS.items():
+        if name not in selected: continue
+
+        ids = set( image_ids ) | pending.get( name, set() )
+        print( f"\n--- {name} ({len( ids )} images) ---" )
+        start = time.perf_counter()
+
+        try:
+            step( db, ids )
+            db.commit()
+            pending.pop( name, None )
+            results[name] = 'ok'
+        except Exception as e:
+            db.rollback()
+            pending[name] = ids
+            results[name] = 'failed'
+            print( f"Error in {name}: {e}" )
+
+        print( f"{name}: {results[name]} in {time.perf_counter() - start:.1f}s" )
+
+    save_pending( pending, pending_path )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Refresh derived data after new images were added' )
+    parser.add_argument( '--image-ids', type=lambda text: [int( v ) for v in text.split( ',' ) if v.strip()], default=[],
+                        help='IDs of new or changed images (comma-separated)' )
+    parser.add_argument( '--steps', nargs='+', choices=list( STEPS ),
+                        help='Steps to run (default: all)' )
+    parser.add_argument( '--retry', action='store_true',
+                        help='Only rerun steps that failed on an earlier run' )
+    args = parser.parse_args()
+
+    if args.retry:
+        pending = load_pending()
+        if not pending:
+            print( "No failed steps to retry." )
+            return
+        steps = list( pending )
+    else:
+        steps = args.steps
+
+    db = get_connection()
+    try:
+        results = run_maintenance( db, args.image_ids, steps )
+    finally:
+        db.close()
+
+    if 'failed' in results.values():
+        exit( 1 )
+
+
+if __name__ == '__main__':
+    main()
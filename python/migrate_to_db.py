@@ -1,19 +1,21 @@
-import mysql.connector
 from mysql.connector import Error
 import json
 import os
 from pathlib import Path
 from datetime import datetime
 import hashlib
+from results_log import iter_results, results_exist
+from database import DB_CONFIG, get_connection, get_server_connection
+from aggregate_counts import ensure_tables as ensure_count_tables
 
 class OptimalNormalizedDatabaseMigration:
     """Migrates JSON data to optimally normalized MySQL database without redundant hash columns or derived tables"""
     
-    def __init__( self, host='localhost', user='root', password='', database='perchance_gallery', folder='../data' ):
-        self.host = host
-        self.user = user
-        self.password = password
-        self.database = database
+    def __init__( self, host=None, user=None, password=None, database=None, folder='../data' ):
+        self.host = host or DB_CONFIG['host']
+        self.user = user or DB_CONFIG['user']
+        self.password = DB_CONFIG['password'] if password is None else password
+        self.database = database or DB_CONFIG['database']
         self.folder = folder
         self.conn = None
         self.cursor = None
@@ -28,7 +30,7 @@ class OptimalNormalizedDatabaseMigration:
     def connect( self ):
         """Establish database connection and create database if needed"""
         try:
-            self.conn = mysql.connector.connect(
+            self.conn = get_server_connection(
                 host=self.host,
                 user=self.user,
                 password=self.password,
@@ -62,6 +64,17 @@ class OptimalNormalizedDatabaseMigration:
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         ''' )
         
+        # Style fingerprints (what each style string was inferred from, see update_style_strings.py)
+        self.cursor.execute( '''
+            CREATE TABLE IF NOT EXISTS style_fingerprints (
+                art_style_id INT PRIMARY KEY,
+                image_count INT NOT NULL,
+                max_image_id INT NOT NULL,
+                common_span TEXT NULL,
+                FOREIGN KEY (art_style_id) REFERENCES art_styles(id) ON DELETE CASCADE
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        ''' )
+        
         # Positive prompts table
         self.cursor.execute( '''
             CREATE TABLE IF NOT EXISTS positive_prompts (
@@ -117,6 +130,9 @@ class OptimalNormalizedDatabaseMigration:
                 date_downloaded DATE,
                 deleted TINYINT(1) DEFAULT 0,
                 tags TEXT,
+                width SMALLINT UNSIGNED NULL,
+                height SMALLINT UNSIGNED NULL,
+                file_size INT UNSIGNED NULL,
                 FOREIGN KEY (prompt_combination_id) REFERENCES prompt_combinations(id) ON DELETE SET NULL,
                 FOREIGN KEY (art_style_id) REFERENCES art_styles(id) ON DELETE SET NULL,
                 FOREIGN KEY (title_id) REFERENCES titles(id) ON DELETE SET NULL,
@@ -127,6 +143,55 @@ class OptimalNormalizedDatabaseMigration:
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         ''' )
         
+        # Perceptual image hashes for near-duplicate detection (see near_duplicates.py)
+        self.cursor.execute( '''
+            CREATE TABLE IF NOT EXISTS image_hashes (
+                image_id INT PRIMARY KEY,
+                dhash BIGINT UNSIGNED NOT NULL,
+                duplicate_of INT NULL,
+                FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE,
+                INDEX idx_dhash (dhash),
+                INDEX idx_duplicate_of (duplicate_of)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        ''' )
+        
+        # Denormalized gallery feed read by data.php (see gallery_feed.py)
+        self.cursor.execute( '''
+            CREATE TABLE IF NOT EXISTS gallery_feed (
+                image_id INT PRIMARY KEY,
+                newest_first INT NOT NULL,
+                filename VARCHAR(255) NOT NULL,
+                prompt TEXT NULL,
+                prompt_id INT NULL,
+                prompt_hash VARCHAR(64) NULL,
+                prompt_key VARCHAR(191) NULL,
+                negative_prompt TEXT NULL,
+                art_style VARCHAR(100) NULL,
+                style_missing TINYINT(1) NOT NULL,
+                title TEXT NULL,
+                seed VARCHAR(50) NULL,
+                date_downloaded DATE NULL,
+                tags TEXT NULL,
+                INDEX idx_style (style_missing, art_style, newest_first),
+                INDEX idx_prompt (prompt_key, prompt_hash, newest_first),
+                INDEX idx_prompt_hash (prompt_hash, newest_first),
+                INDEX idx_prompt_id (prompt_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        ''' )
+        
+        # Aggregate counters read by tables_data.php (see aggregate_counts.py)
+        ensure_count_tables( self.cursor )
+        
+        # Retention progress (how far each retention tier has processed images, see retention.py)
+        self.cursor.execute( '''
+            CREATE TABLE IF NOT EXISTS retention_progress (
+                tier VARCHAR(20) PRIMARY KEY,
+                last_date DATE NOT NULL,
+                last_id INT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        ''' )
+        
         # Tokens table
         self.cursor.execute( '''
             CREATE TABLE IF NOT EXISTS tokens (
@@ -284,19 +349,17 @@ class OptimalNormalizedDatabaseMigration:
         return combo_id
     
     def migrate_results_json( self ):
-        """Migrate results.json to normalized tables"""
-        json_path = Path( self.folder ) / 'results.json'
+        """Migrate the results backup (results.jsonl plus legacy results.json) to normalized tables"""
+        log_path = Path( self.folder ) / 'results.jsonl'
         
-        if not json_path.exists():
-            print( f"  {json_path.name} not found, skipping" )
+        if not results_exist( str( log_path ) ):
+            print( f"  {log_path.name} not found, skipping" )
             return
         
-        print( f"\nMigrating {json_path.name}..." )
-        
-        with open( json_path, 'r', encoding='utf-8' ) as f:
-            data = json.load( f )
+        print( f"\nMigrating {log_path.name}..." )
         
-        print( f"  Found {len( data )} items" )
+        # Stream items instead of loading the whole backup
+        data = iter_results( str( log_path ) )
         
         inserted = 0
         skipped = 0
@@ -316,6 +379,7 @@ class OptimalNormalizedDatabaseMigration:
                 date_downloaded = item.get( 'date_downloaded', '' )
                 tags = item.get( 'tags', '' )
                 deleted = 1 if not prompt_text else 0
+                dimensions = ( item.get( 'width' ), item.get( 'height' ), item.get( 'file_size' ) )
                 
                 # Get or create foreign key IDs
                 positive_prompt_id = self.get_or_create_positive_prompt( prompt_text )
@@ -327,9 +391,9 @@ class OptimalNormalizedDatabaseMigration:
                 # Insert image
                 self.cursor.execute( '''
                     INSERT IGNORE INTO images 
-                    (filename, prompt_combination_id, art_style_id, title_id, seed, date_downloaded, deleted, tags)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ''', ( filename, prompt_combination_id, style_id, title_id, seed, date_downloaded, deleted, tags ) )
+                    (filename, prompt_combination_id, art_style_id, title_id, seed, date_downloaded, deleted, tags, width, height, file_size)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ''', ( filename, prompt_combination_id, style_id, title_id, seed, date_downloaded, deleted, tags, *dimensions ) )
                 
                 if self.cursor.rowcount > 0:
                     inserted += 1
@@ -552,10 +616,10 @@ def main():
         description='Migrate JSON files to optimally normalized MySQL database',
         epilog='Creates a fully normalized database eliminating all redundancy (no hashes, no derived tables)'
     )
-    parser.add_argument( '--host', default='localhost', help='MySQL host (default: localhost)' )
-    parser.add_argument( '--user', default='root', help='MySQL user (default: root)' )
-    parser.add_argument( '--password', default='', help='MySQL password (default: empty)' )
-    parser.add_argument( '--database', default='perchance_gallery', help='Database name (default: perchance_gallery)' )
+    parser.add_argument( '--host', default=DB_CONFIG['host'], help=f"MySQL host (default: {DB_CONFIG['host']})" )
+    parser.add_argument( '--user', default=DB_CONFIG['user'], help=f"MySQL user (default: {DB_CONFIG['user']})" )
+    parser.add_argument( '--password', default=DB_CONFIG['password'], help='MySQL password (default: from database.py)' )
+    parser.add_argument( '--database', default=DB_CONFIG['database'], help=f"Database name (default: {DB_CONFIG['database']})" )
     parser.add_argument( '--folder', default='data', help='Folder containing JSON files (default: data)' )
     parser.add_argument( '--drop', action='store_true', help='Drop existing database and recreate' )
     
@@ -572,7 +636,7 @@ def main():
     # Check if we should drop database
     if args.drop:
         try:
-            conn = mysql.connector.connect(
+            conn = get_server_connection(
                 host=args.host,
                 user=args.user,
                 password=args.password
@@ -595,20 +659,39 @@ def main():
     print( f"Access via phpMyAdmin: http://localhost/phpmyadmin" )
     print( "="*60 )
     
+    # Fill the gallery feed from the migrated tables
+    print( "\nBuilding gallery feed..." )
+    try:
+        from gallery_feed import rebuild
+        db = get_connection( args.database, host=args.host, user=args.user, password=args.password )
+        try:
+            rebuild( db )
+        finally:
+            db.close()
+    except Exception as e:
+        print( f"Warning: Could not build the gallery feed (run `python gallery_feed.py --rebuild`): {e}" )
+    
+    # Count the migrated rows into the aggregate counters
+    print( "\nCounting aggregate counters..." )
+    try:
+        from aggregate_counts import reconcile
+        db = get_connection( args.database, host=args.host, user=args.user, password=args.password )
+        try:
+            reconcile( db )
+        finally:
+            db.close()
+    except Exception as e:
+        print( f"Warning: Could not fill the aggregate counters (run `python aggregate_counts.py --reconcile`): {e}" )
+    
     # Update table counts cache
     print( "\nUpdating table counts cache..." )
     try:
-        import subprocess
-        script_dir = Path(__file__).parent
-        result = subprocess.run(
-            ['python', str(script_dir / 'update_table_counts.py')],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            print( result.stdout )
-        else:
-            print( f"Warning: Failed to update table counts cache: {result.stderr}" )
+        from update_table_counts import update_table_counts
+        db = get_connection( args.database, host=args.host, user=args.user, password=args.password )
+        try:
+            update_table_counts( db )
+        finally:
+            db.close()
     except Exception as e:
         print( f"Warning: Could not update table counts cache: {e}" )
 
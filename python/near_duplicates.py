@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Perceptual-hash index of downloaded images for finding near duplicates.
+
+Every image gets a 64-bit difference hash (dHash, see imaging.py) stored in the
+image_hashes table. Two images are near duplicates when their hashes differ in
+at most a few bits (DEFAULT_DISTANCE), which catches re-posts of the same render
+and trivial variations while telling apart different seeds.
+
+Lookups go through HammingIndex, a multi-index hash table: each hash is split
+into max_distance + 1 bands and filed under every band value. Two hashes within
+max_distance bits must agree exactly on at least one band, so a query only
+compares against the few hashes sharing a band value instead of scanning all.
+
+The scraper hashes images as it compresses them, and with --skip-near-duplicates
+it keeps the row of a near duplicate (marked deleted, with duplicate_of pointing
+at the original) but not its file. Existing images are hashed by --backfill.
+
+Usage:
+    python near_duplicates.py --backfill --workers 8          # Hash images that have no hash yet
+    python near_duplicates.py --similar abc123.jpg            # List near duplicates of an image
+    python near_duplicates.py --similar abc123.jpg --distance 8
+"""
+
+import argparse
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from database import LOOKUP_BATCH_SIZE, get_connection, iter_rows
+from image_layout import locate_image
+from imaging import hash_file
+
+MEDIUM_DIR = "../images/medium"
+HASH_BITS = 64
+DEFAULT_DISTANCE = 4    # most differing bits for two images to count as near duplicates
+
+HASH_TABLE = """
+    CREATE TABLE IF NOT EXISTS image_hashes (
+        image_id INT PRIMARY KEY,
+        dhash BIGINT UNSIGNED NOT NULL,
+        duplicate_of INT NULL,
+        FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE,
+        INDEX idx_dhash (dhash),
+        INDEX idx_duplicate_of (duplicate_of)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+UNHASHED_QUERY = """
+    SELECT i.id, i.filename
+    FROM images i
+    LEFT JOIN image_hashes h ON h.image_id = i.id
+    WHERE i.id > %s AND i.deleted = 0 AND h.image_id IS NULL
+    ORDER BY i.id
+    LIMIT %s
+"""
+
+def hamming( a, b ):
+    """Number of bits in which two hashes differ."""
+    return bin( a ^ b ).count( '1' )
+
+
+class HammingIndex:
+    """Multi-index hash table answering "hashes within max_distance bits of X"."""
+
+    def __init__( self, max_distance=DEFAULT_DISTANCE, bits=HASH_BITS ):
+        self.max_distance = max_distance
+        self.bands = []   # (shift, mask) per band, as evenly sized as possible
+        count = max_distance + 1
+        shift = 0
+        for band in range( count ):
+            width = bits // count + ( 1 if band < bits % count else 0 )
+            self.bands.append( ( shift, ( 1 << width ) - 1 ) )
+            shift += width
+
+        self.tables = [{} for _ in self.bands]  # band value -> positions in keys/values
+        self.keys = []
+        self.values = array( 'Q' )
+
+    def __len__( self ):
+        return len( self.keys )
+
+    def add( self, key, value ):
+        """File a hash under key (an image ID)."""
+        position = len( self.keys )
+        self.keys.append( key )
+        self.values.append( value )
+        for table, ( shift, mask ) in zip( self.tables, self.bands ):
+            table.setdefault( value >> shift & mask, [] ).append( position )
+
+    def query( self, value, max_distance=None ):
+        """Return [(distance, key)] for hashes within max_distance bits, closest first."""
+        if max_distance is None:
+            max_distance = self.max_distance
+        if max_distance > self.max_distance:
+            raise ValueError( f"index was built for distances up to {self.max_distance}" )
+
+        seen = set()
+        matches = []
+        for table, ( shift, mask ) in zip( self.tables, self.bands ):
+            for position in table.get( value >> shift & mask, () ):
+                if position in seen: continue
+                seen.add( position )
+
+                distance = hamming( value, self.values[position] )
+                if distance <= max_distance:
+                    matches.append( ( distance, self.keys[position] ) )
+
+        matches.sort()
+        return matches
+
+
+def ensure_table( cursor ):
+    """Create image_hashes if it doesn't exist yet."""
+    cursor.execute( HASH_TABLE )
+
+def load_index( db, max_distance=DEFAULT_DISTANCE ):
+    """Build a HammingIndex of the hashes of all images still shown in the gallery."""
+    index = HammingIndex( max_distance )
+    query = "SELECT h.image_id, h.dhash FROM image_hashes h JOIN images i ON i.id = h.image_id WHERE i.deleted = 0"
+    for image_id, value in iter_rows( db, query ):
+        index.add( image_id, value )
+    return index
+
+def save_hashes( cursor, rows ):
+    """Store (image_id, dhash, duplicate_of) rows, replacing earlier hashes of the same images."""
+    for start in range( 0, len( rows ), LOOKUP_BATCH_SIZE ):
+        cursor.executemany( """
+            INSERT INTO image_hashes (image_id, dhash, duplicate_of) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE dhash = VALUES(dhash), duplicate_of = VALUES(duplicate_of)
+        """, rows[start:start + LOOKUP_BATCH_SIZE] )
+
+def image_hash( cursor, filename, root=MEDIUM_DIR ):
+    """Return the stored hash of an image, hashing its file if it has none. None if unknown."""
+    cursor.execute( """
+        SELECT h.dhash FROM images i JOIN image_hashes h ON h.image_id = i.id WHERE i.filename = %s
+    """, ( filename, ) )
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+
+    path = locate_image( root, filename )
+    return hash_file( path ) if path else None
+
+def backfill( db, workers=4, batch_size=LOOKUP_BATCH_SIZE, root=MEDIUM_DIR ):
+    """Hash every shown image that has no stored hash yet, in ID order.
+
+    Files are hashed by a process pool and each batch is committed, so an
+    interrupted backfill continues where it stopped.
+
+    Returns:
+        Dict with counts of 'hashed' and 'missing' (file not found or unreadable) images
+    """
+    cursor = db.cursor()
+    stats = {'hashed': 0, 'missing': 0}
+    last_id = 0
+    start = time.perf_counter()
+
+    try:
+        ensure_table( cursor )
+        with ProcessPoolExecutor( max_workers=workers ) as pool:
+            while True:
+                cursor.execute( UNHASHED_QUERY, ( last_id, batch_size ) )
+                rows = cursor.fetchall()
+                if not rows: break
+                last_id = rows[-1][0]
+
+                paths = [( image_id, locate_image( root, filename ) ) for image_id, filename in rows]
+                found = [( image_id, path ) for image_id, path in paths if path]
+                hashes = pool.map( hash_file, [path for _, path in found], chunksize=32 )
+                hashed = [( image_id, value, None ) for ( image_id, _ ), value in zip( found, hashes ) if value is not None]
+
+                save_hashes( cursor, hashed )
+                db.commit()
+
+                stats['hashed'] += len( hashed )
+                stats['missing'] += len( rows ) - len( hashed )
+                elapsed = time.perf_counter() - start
+                print( f"  {stats['hashed']:,} images hashed ({stats['hashed'] / elapsed:,.0f}/s), {stats['missing']:,} without a readable file" )
+    finally:
+        cursor.close()
+
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser( description='Perceptual-hash index of downloaded images' )
+    parser.add_argument( '--backfill', action='store_true', help='Hash every shown image that has no hash yet' )
+    parser.add_argument( '--similar', nargs='+', metavar='FILENAME', help='List near duplicates of these images' )
+    parser.add_argument( '--distance', type=int, default=DEFAULT_DISTANCE,
+                        help=f'Most differing bits (of {HASH_BITS}) for a near duplicate (default: {DEFAULT_DISTANCE})' )
+    parser.add_argument( '--workers', type=int, default=os.cpu_count() or 1, help='Processes hashing files (default: all cores)' )
+    args = parser.parse_args()
+
+    db = get_connection()
+    try:
+        if args.backfill:
+            stats = backfill( db, args.workers )
+            print( f"Backfill done: {stats['hashed']:,} hashed, {stats['missing']:,} missing" )
+
+        if args.similar:
+            start = time.perf_counter()
+            index = load_index( db, args.distance )
+            print( f"Loaded {len( index ):,} hashes in {time.perf_counter() - start:.1f}s" )
+
+            cursor = db.cursor()
+            for filename in args.similar:
+                value = image_hash( cursor, filename )
+                if value is None:
+                    print( f"{filename}: no hash and no readable file" )
+                    continue
+
+                start = time.perf_counter()
+                matches = index.query( value )
+                elapsed = ( time.perf_counter() - start ) * 1000
+                ids = [image_id for _, image_id in matches]
+                names = {}
+                if ids:
+                    placeholders = ','.join( ['%s'] * len( ids ) )
+                    cursor.execute( f"SELECT id, filename FROM images WHERE id IN ({placeholders})", ids )
+                    names = dict( cursor.fetchall() )
+
+                print( f"{filename}: {len( matches )} within {args.distance} bits ({elapsed:.2f} ms)" )
+                for distance, image_id in matches:
+                    if names.get( image_id ) != filename:
+                        print( f"  {distance:2d}  {names.get( image_id, image_id )}" )
+            cursor.close()
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
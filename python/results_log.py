@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Append-only JSON Lines backup of scraped results.
+
+The scraper appends each page's new items to ../data/results.jsonl (one JSON object
+per line, flushed and fsync'd per batch), so the per-page backup cost depends only on
+the page size. Every script reads the backup through iter_results(), which streams
+the legacy ../data/results.json array first (until it has been compacted away) and
+then the log.
+
+Usage:
+    python results_log.py --compact   # Fold results.json into the log and drop duplicate filenames
+"""
+
+import argparse
+import json
+import os
+
+RESULTS_LOG = "../data/results.jsonl"
+CHUNK_SIZE = 1 << 20    # characters read per chunk when streaming the legacy JSON array
+
+
+class ResultsLog:
+    """Appends batches of result items to a JSON Lines file."""
+
+    def __init__( self, path=RESULTS_LOG ):
+        self.path = path
+
+    def append( self, items ):
+        """Append items as JSON lines and fsync so a crash never leaves a half-written batch behind."""
+        if not items: return
+
+        lines = ''.join( json.dumps( item, ensure_ascii=False ) + '\n' for item in items )
+        if self._has_torn_tail():
+            lines = '\n' + lines # keep a torn line from a crash from swallowing the first new item
+
+        with open( self.path, 'a', encoding='utf-8' ) as f:
+            f.write( lines )
+            f.flush()
+            os.fsync( f.fileno() )
+
+    def _has_torn_tail( self ):
+        """Check whether the log ends without a trailing newline."""
+        if not os.path.exists( self.path ) or os.path.getsize( self.path ) == 0: return False
+
+        with open( self.path, 'rb' ) as f:
+            f.seek( -1, os.SEEK_END )
+            return f.read( 1 ) != b'\n'
+
+
+def legacy_path_for( path ):
+    """Return the legacy JSON array path that sits next to a JSON Lines log."""
+    return os.path.splitext( path )[0] + '.json'
+
+
+def iter_json_lines( path ):
+    """Stream items from a JSON Lines file, skipping a torn final line."""
+    with open( path, 'r', encoding='utf-8' ) as f:
+        for line_number, line in enumerate( f, 1 ):
+            line = line.strip()
+            if not line: continue
+
+            try:
+                yield json.loads( line )
+            except json.JSONDecodeError:
+                print( f"Warning: skipping unreadable line {line_number} in {path}" )
+
+
+def iter_json_lines_from( path, offset=0 ):
+    """Stream (item, end offset) pairs from a JSON Lines file starting at a byte offset.
+
+    Only newline-terminated lines are read, so resuming from the last end offset
+    never skips a line that was still being written.
+    """
+    with open( path, 'rb' ) as f:
+        f.seek( offset )
+        for line in f:
+            if not line.endswith( b'\n' ): return
+            offset += len( line )
+            if not line.strip(): continue
+
+            try:
+                yield json.loads( line ), offset
+            except json.JSONDecodeError:
+                print( f"Warning: skipping unreadable line ending at byte {offset} in {path}" )
+
+
+def iter_json_array( path, chunk_size=CHUNK_SIZE ):
+    """Stream the items of a JSON array file without loading the whole file.
+
+    Stops at the first closing bracket, so a file with a duplicated array appended
+    (the corruption repair_json.py fixes) yields only the first array.
+    """
+    decoder = json.JSONDecoder()
+
+    with open( path, 'r', encoding='utf-8' ) as f:
+        buffer = f.read( chunk_size ).lstrip()
+        if not buffer: return
+        if not buffer.startswith( '[' ):
+            raise ValueError( f"{path} does not contain a JSON array" )
+
+        pos = 1
+        eof = False
+
+        while True:
+            # Skip whitespace and separators, reading more when the buffer runs out
+            while pos < len( buffer ) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+
+            if pos >= len( buffer ):
+                if eof: return # truncated array without a closing bracket
+                chunk = f.read( chunk_size )
+                eof = not chunk
+                buffer, pos = chunk, 0
+                continue
+
+            if buffer[pos] == ']': return
+
+            try:
+                item, pos = decoder.raw_decode( buffer, pos )
+            except json.JSONDecodeError:
+                if eof:
+                    print( f"Warning: {path} ends mid-item, stopping at the last complete item" )
+                    return
+
+                # Item spans the chunk boundary - keep the tail and read more
+                chunk = f.read( chunk_size )
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+
+            yield item
+
+
+def iter_results( path=RESULTS_LOG ):
+    """Stream scraped result items from the backup.
+
+    Args:
+        path: A .jsonl log (its legacy .json sibling is read first if it still exists)
+              or a plain JSON array file
+    """
+    if not path.endswith( '.jsonl' ):
+        if os.path.exists( path ):
+            yield from iter_json_array( path )
+        return
+
+    legacy_path = legacy_path_for( path )
+    if os.path.exists( legacy_path ):
+        yield from iter_json_array( legacy_path )
+
+    if os.path.exists( path ):
+        yield from iter_json_lines( path )
+
+
+def results_exist( path=RESULTS_LOG ):
+    """Check whether iter_results() has anything to read for this path."""
+    if os.path.exists( path ): return True
+    return path.endswith( '.jsonl' ) and os.path.exists( legacy_path_for( path ) )
+
+
+def compact( path=RESULTS_LOG ):
+    """Rewrite the log with one entry per filename and fold in the legacy JSON array.
+
+    The latest entry for a filename wins; entries without a filename are kept.
+    The new log is written to a temp file and swapped in atomically, after which
+    the legacy results.json is renamed to results.json.migrated.
+
+    Returns:
+        Number of items in the compacted log
+    """
+    by_filename = {}
+    unnamed = []
+    for item in iter_results( path ):
+        filename = item.get( 'filename' )
+        if filename:
+            by_filename[filename] = item
+        else:
+            unnamed.append( item )
+
+    temp_path = path + '.tmp'
+    if os.path.exists( temp_path ): os.remove( temp_path )
+    ResultsLog( temp_path ).append( list( by_filename.values() ) + unnamed )
+    if not os.path.exists( temp_path ): open( temp_path, 'w' ).close() # nothing to write
+    os.replace( temp_path, path )
+
+    legacy_path = legacy_path_for( path )
+    if os.path.exists( legacy_path ):
+        os.replace( legacy_path, legacy_path + '.migrated' )
+
+    return len( by_filename ) + len( unnamed )
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Maintain the append-only results backup' )
+    parser.add_argument( '--path', default=RESULTS_LOG, help=f'Results log (default: {RESULTS_LOG})' )
+    parser.add_argument( '--compact', action='store_true',
+                        help='Fold the legacy results.json into the log and drop duplicate filenames' )
+    args = parser.parse_args()
+
+    if args.compact:
+        count = compact( args.path )
+        print( f"Compacted {args.path}: {count} items" )
+    else:
+        count = sum( 1 for _ in iter_results( args.path ) )
+        print( f"{args.path}: {count} items" )
+
+
+if __name__ == '__main__':
+    main()
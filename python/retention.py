@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Retention engine: removes image files once they expire.
+
+Full-size images expire after 30 days and medium images after 90 days. When a
+medium image is removed, the image can no longer be shown, so its row is marked
+images.deleted = 1 (its metadata is kept), it is removed from the gallery
+feed and subtracted from the aggregate counters. Remaining full-size files and
+the thumbnail are removed along with it.
+
+Expired rows are read from the images table in (date_downloaded, id) order
+through the date_downloaded index. Each tier's position in that order is stored
+in retention_progress after every batch. A run therefore only reads rows that
+expired since the last run, and an interrupted run resumes where it stopped.
+Re-processing a batch after a crash is harmless, because files that are already
+gone are skipped.
+
+Files are deleted by a thread pool, to the recycle bin by default. With a disk
+budget, a tier also evicts its oldest files early until its directory fits the
+budget.
+
+Usage:
+    python retention.py                          # Remove expired files
+    python retention.py --dry-run                # Report what would be removed
+    python retention.py --medium-budget 50       # Also evict oldest medium images beyond 50 GB
+    python retention.py --permanent --workers 16 # Delete instead of sending to the recycle bin
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from database import LOOKUP_BATCH_SIZE, get_connection
+from aggregate_counts import add_images as add_counted_images, ensure_tables as ensure_count_tables
+from gallery_feed import ensure_table as ensure_feed_table, remove_images as remove_from_feed
+from image_layout import get_layout, locate_image
+
+FULL_DIR = "../images/full"
+MEDIUM_DIR = "../images/medium"
+THUMB_DIR = "../images/thumbs"
+
+# Tiers run in this order: name -> (retention days, directories to clear, mark rows deleted).
+# A tier's disk budget applies to its first directory.
+TIERS = {
+    'full': ( 30, ( FULL_DIR, ), False ),
+    'medium': ( 90, ( MEDIUM_DIR, FULL_DIR, THUMB_DIR ), True )
+}
+
+PROGRESS_TABLE = """
+    CREATE TABLE IF NOT EXISTS retention_progress (
+        tier VARCHAR(20) PRIMARY KEY,
+        last_date DATE NOT NULL,
+        last_id INT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+BATCH_QUERY = """
+    SELECT id, filename, date_downloaded
+    FROM images
+    WHERE date_downloaded IS NOT NULL
+      AND (date_downloaded > %s OR (date_downloaded = %s AND id > %s))
+      {before}
+    ORDER BY date_downloaded, id
+    LIMIT %s
+"""
+
+def load_progress( cursor, tier ):
+    """Return the (date_downloaded, id) a tier has been processed up to."""
+    cursor.execute( "SELECT last_date, last_id FROM retention_progress WHERE tier = %s", ( tier, ) )
+    row = cursor.fetchone()
+    return ( row[0], row[1] ) if row else ( date.min, 0 )
+
+def save_progress( cursor, tier, position ):
+    """Record that a tier has been processed up to (date_downloaded, id)."""
+    cursor.execute( """
+        INSERT INTO retention_progress (tier, last_date, last_id) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE last_date = VALUES(last_date), last_id = VALUES(last_id)
+    """, ( tier, *position ) )
+
+def fetch_batch( cursor, position, before=None, batch_size=LOOKUP_BATCH_SIZE ):
+    """Fetch the next rows after position in (date_downloaded, id) order, optionally only those downloaded before a date."""
+    last_date, last_id = position
+    params = [last_date, last_date, last_id]
+    if before:
+        params.append( before )
+    cursor.execute(
+        BATCH_QUERY.format( before="AND date_downloaded < %s" if before else "" ),
+        ( *params, batch_size )
+    )
+    return cursor.fetchall()
+
+def directory_usage( directory ):
+    """Total size in bytes of the images stored under an image root (in either layout)."""
+    if not os.path.isdir( directory ): return 0
+    return sum( file_size( path ) for _, path in get_layout( directory ).iter_files() )
+
+def file_size( path ):
+    """Size of a file in bytes, 0 if it doesn't exist."""
+    if path is None: return 0
+    try:
+        return os.stat( path ).st_size
+    except FileNotFoundError:
+        return 0
+
+def rows_to_evict( rows, directory, excess ):
+    """Return the oldest rows whose files in directory add up to at least excess bytes."""
+    selected = []
+    for row in rows:
+        if excess <= 0: break
+        selected.append( row )
+        excess -= file_size( locate_image( directory, row[1] ) )
+    return selected
+
+class Remover:
+    """Deletes files in a thread pool, to the recycle bin unless permanent."""
+
+    def __init__( self, workers=8, permanent=False, dry_run=False ):
+        self.workers = workers
+        self.dry_run = dry_run
+        if permanent or dry_run:
+            self.remove = os.remove
+        else:
+            from send2trash import send2trash   # pip install Send2Trash
+            self.remove = send2trash
+
+    def remove_file( self, path ):
+        """Remove one file if it exists. Returns the bytes freed, or None if there was no file."""
+        if path is None: return None
+        try:
+            size = os.stat( path ).st_size
+            if not self.dry_run:
+                self.remove( path )
+        except FileNotFoundError:
+            return None
+        except OSError:
+            if not os.path.exists( path ): return None # send2trash reports a vanished file as OSError
+            raise
+        return size
+
+    def remove_files( self, paths ):
+        """Remove files in parallel. Returns the result of remove_file() for each path."""
+        if self.workers > 1 and len( paths ) > 1:
+            with ThreadPoolExecutor( max_workers=self.workers ) as pool:
+                return list( pool.map( self.remove_file, paths ) )
+        return [self.remove_file( path ) for path in paths]
+
+def run_tier( db, tier, remover, today=None, budget=None, batch_size=LOOKUP_BATCH_SIZE ):
+    """Remove a tier's expired files, then evict its oldest files while it is over budget.
+
+    Args:
+        db: Open database connection; committed after every batch
+        tier: Key of TIERS
+        remover: Remover that deletes the files
+        today: Date the retention periods are counted from (default: today)
+        budget: Disk budget in bytes for the tier's first directory (None = age-based expiry only)
+
+    Returns:
+        Dict with counts of 'rows', 'files' and 'bytes' removed
+    """
+    days, directories, mark_deleted = TIERS[tier]
+    cutoff = ( today or date.today() ) - timedelta( days=days )
+    usage = directory_usage( directories[0] ) if budget is not None else None
+    stats = {'rows': 0, 'files': 0, 'bytes': 0}
+    cursor = db.cursor()
+
+    try:
+        position = load_progress( cursor, tier )
+        while True:
+            rows = fetch_batch( cursor, position, cutoff, batch_size )
+            if not rows and usage is not None and usage > budget:
+                # Nothing left to expire: evict the oldest remaining files
+                rows = rows_to_evict( fetch_batch( cursor, position, None, batch_size ), directories[0], usage - budget )
+            if not rows: break
+
+            paths = [locate_image( directory, filename ) for _, filename, _ in rows for directory in directories]
+            sizes = remover.remove_files( paths )
+            if usage is not None:
+                usage -= sum( size or 0 for size in sizes[::len( directories )] )
+
+            position = ( rows[-1][2], rows[-1][0] )
+            if not remover.dry_run:
+                if mark_deleted:
+                    ids = [row[0] for row in rows]
+                    placeholders = ','.join( ['%s'] * len( ids ) )
+                    add_counted_images( cursor, ids, -1 )
+                    cursor.execute( f"UPDATE images SET deleted = 1 WHERE id IN ({placeholders})", ids )
+                    remove_from_feed( cursor, ids )
+                save_progress( cursor, tier, position )
+                db.commit()
+
+            stats['rows'] += len( rows )
+            stats['files'] += sum( 1 for size in sizes if size is not None )
+            stats['bytes'] += sum( size or 0 for size in sizes )
+    finally:
+        cursor.close()
+
+    return stats
+
+def run_retention( db, budgets=None, workers=8, permanent=False, dry_run=False, today=None ):
+    """Run every retention tier on a shared connection.
+
+    Args:
+        budgets: Optional {tier: disk budget in bytes}
+
+    Returns:
+        Dict of tier -> stats from run_tier()
+    """
+    cursor = db.cursor()
+    cursor.execute( PROGRESS_TABLE )
+    ensure_feed_table( cursor )
+    ensure_count_tables( cursor )
+    cursor.close()
+
+    remover = Remover( workers, permanent, dry_run )
+    results = {}
+    for tier in TIERS:
+        start = time.perf_counter()
+        results[tier] = stats = run_tier( db, tier, remover, today, ( budgets or {} ).get( tier ) )
+        print( f"{tier}: {stats['rows']:,} images, {stats['files']:,} files, "
+               f"{stats['bytes'] / 1e6:,.1f} MB {'would be ' if dry_run else ''}removed "
+               f"({time.perf_counter() - start:.1f}s)" )
+    return results
+
+def main():
+    parser = argparse.ArgumentParser( description='Remove expired image files' )
+    parser.add_argument( '--full-budget', type=float, help='Evict the oldest full-size images beyond this many GB' )
+    parser.add_argument( '--medium-budget', type=float, help='Evict the oldest medium images beyond this many GB' )
+    parser.add_argument( '--workers', type=int, default=8, help='Threads deleting files (default: 8)' )
+    parser.add_argument( '--permanent', action='store_true', help='Delete files instead of sending them to the recycle bin' )
+    parser.add_argument( '--dry-run', action='store_true', help='Report what would be removed without changing anything' )
+    args = parser.parse_args()
+
+    budgets = {
+        tier: int( gb * 1e9 )
+        for tier, gb in ( ( 'full', args.full_budget ), ( 'medium', args.medium_budget ) ) if gb is not None
+    }
+
+    db = get_connection()
+    try:
+        run_retention( db, budgets, args.workers, args.permanent, args.dry_run )
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,25 @@
 import cloudscraper             # Cloudflare bypassing scraper
 from bs4 import BeautifulSoup   # HTML parsing
-from PIL import Image
-import json
 import os
-import io
 import time
 #import requests
 from requests.exceptions import RequestException
-import subprocess
 import sys
 import re
 from datetime import datetime
 import argparse
-import mysql.connector
 from mysql.connector import Error
 import hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from imaging import compress_image
+from image_layout import image_path, locate_image
+from results_log import RESULTS_LOG, ResultsLog, compact
+from dedup_index import INDEX_PATH, DedupIndex
+from near_duplicates import DEFAULT_DISTANCE, ensure_table, hamming, load_index, save_hashes
+from gallery_feed import ensure_table as ensure_feed_table, refresh_images as refresh_feed
+from aggregate_counts import add_combinations, add_images, add_rows, ensure_tables as ensure_count_tables
+from maintenance import run_maintenance
+from database import DB_CONFIG, LOOKUP_BATCH_SIZE, PreparedStatements, get_connection
 
 BASE_URL = "https://image-generation.perchance.org/gallery"
 
@@ -28,19 +33,27 @@ params = {
     "imageElementsHtmlOnly": "true"
 }
 
+MEDIUM_DIR = "../images/medium"
+THUMB_DIR = "../images/thumbs"
+
+encode_settings = {}    # overrides of imaging.DEFAULT_SETTINGS, set from the command line
+
 scraper = cloudscraper.create_scraper() # create CloudScraper instance
 
 
+def sha256_hex( text ):
+    """Return the SHA256 hex digest used as the deduplication hash for text columns."""
+    return hashlib.sha256( text.encode( 'utf-8' ) ).hexdigest()
+
+
 class DatabaseManager:
     """Manages database connections and image insertion."""
     
-    def __init__(self, host='localhost', user='root', password='', database='perchance_gallery'):
-        self.host = host
-        self.user = user
-        self.password = password
-        self.database = database
+    def __init__(self, database=None):
+        self.database = database or DB_CONFIG['database']
         self.conn = None
         self.cursor = None
+        self.prepared = None    # prepared statements for the per-row lookups
         
         # Caches for deduplication
         self.positive_prompt_cache = {}
@@ -52,24 +65,22 @@ class DatabaseManager:
     def connect(self):
         """Establish database connection."""
         try:
-            self.conn = mysql.connector.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password,
-                database=self.database,
-                charset='utf8mb4',
-                use_unicode=True
-            )
+            self.conn = get_connection(self.database)
             self.cursor = self.conn.cursor()
+            self.prepared = PreparedStatements(self.conn)
             print(f"Connected to database: {self.database}")
         except Error as e:
             print(f"Error connecting to MySQL: {e}")
             raise
     
     def close(self):
-        """Close database connection."""
+        """Close database connection (returning it to the pool)."""
+        if self.prepared:
+            self.prepared.close()
+            self.prepared = None
         if self.conn:
             self.conn.close()
+            self.conn = None
     
     def get_or_create_positive_prompt(self, prompt_text):
         """Get or create a positive prompt, return its ID."""
@@ -81,8 +92,7 @@ class DatabaseManager:
         if prompt_hash in self.positive_prompt_cache:
             return self.positive_prompt_cache[prompt_hash]
         
-        self.cursor.execute('SELECT id FROM positive_prompts WHERE hash = %s', (prompt_hash,))
-        result = self.cursor.fetchone()
+        result = self.prepared.fetchone('SELECT id FROM positive_prompts WHERE hash = %s', (prompt_hash,))
         
         if result:
             prompt_id = result[0]
@@ -92,6 +102,7 @@ class DatabaseManager:
                 (prompt_hash, prompt_text)
             )
             prompt_id = self.cursor.lastrowid
+            add_rows(self.cursor, 'positive-prompts', 1)
         
         self.positive_prompt_cache[prompt_hash] = prompt_id
         return prompt_id
@@ -106,8 +117,7 @@ class DatabaseManager:
         if prompt_hash in self.negative_prompt_cache:
             return self.negative_prompt_cache[prompt_hash]
         
-        self.cursor.execute('SELECT id FROM negative_prompts WHERE hash = %s', (prompt_hash,))
-        result = self.cursor.fetchone()
+        result = self.prepared.fetchone('SELECT id FROM negative_prompts WHERE hash = %s', (prompt_hash,))
         
         if result:
             prompt_id = result[0]
@@ -117,6 +127,7 @@ class DatabaseManager:
                 (prompt_hash, prompt_text)
             )
             prompt_id = self.cursor.lastrowid
+            add_rows(self.cursor, 'negative-prompts', 1)
         
         self.negative_prompt_cache[prompt_hash] = prompt_id
         return prompt_id
@@ -129,8 +140,7 @@ class DatabaseManager:
         if combination_hash in self.prompt_combination_cache:
             return self.prompt_combination_cache[combination_hash]
         
-        self.cursor.execute('SELECT id FROM prompt_combinations WHERE hash = %s', (combination_hash,))
-        result = self.cursor.fetchone()
+        result = self.prepared.fetchone('SELECT id FROM prompt_combinations WHERE hash = %s', (combination_hash,))
         
         if result:
             combo_id = result[0]
@@ -140,6 +150,7 @@ class DatabaseManager:
                 (positive_prompt_id, negative_prompt_id, combination_hash)
             )
             combo_id = self.cursor.lastrowid
+            add_combinations(self.cursor, [combo_id])
         
         self.prompt_combination_cache[combination_hash] = combo_id
         return combo_id
@@ -152,8 +163,7 @@ class DatabaseManager:
         if style_name in self.style_cache:
             return self.style_cache[style_name]
         
-        self.cursor.execute('SELECT id FROM art_styles WHERE name = %s', (style_name,))
-        result = self.cursor.fetchone()
+        result = self.prepared.fetchone('SELECT id FROM art_styles WHERE name = %s', (style_name,))
         
         if result:
             style_id = result[0]
@@ -163,6 +173,7 @@ class DatabaseManager:
                 (style_name, '')
             )
             style_id = self.cursor.lastrowid
+            add_rows(self.cursor, 'art-styles', 1)
         
         self.style_cache[style_name] = style_id
         return style_id
@@ -177,8 +188,7 @@ class DatabaseManager:
         if title_hash in self.title_cache:
             return self.title_cache[title_hash]
         
-        self.cursor.execute('SELECT id FROM titles WHERE hash = %s', (title_hash,))
-        result = self.cursor.fetchone()
+        result = self.prepared.fetchone('SELECT id FROM titles WHERE hash = %s', (title_hash,))
         
         if result:
             title_id = result[0]
@@ -194,8 +204,13 @@ class DatabaseManager:
     
     def image_exists(self, filename):
         """Check if an image with this filename already exists."""
-        self.cursor.execute('SELECT id FROM images WHERE filename = %s', (filename,))
-        return self.cursor.fetchone() is not None
+        return self.prepared.fetchone('SELECT id FROM images WHERE filename = %s', (filename,)) is not None
+    
+    def existing_filenames(self, filenames):
+        """Return the subset of filenames that already exist, using one query per chunk."""
+        found = {}
+        self._select_ids('images', 'filename', list(filenames), found)
+        return set(found)
     
     def insert_image(self, item):
         """Insert a new image into the database. Returns the new image ID."""
@@ -209,48 +224,253 @@ class DatabaseManager:
         # Insert image
         self.cursor.execute('''
             INSERT INTO images 
-            (filename, prompt_combination_id, art_style_id, title_id, seed, date_downloaded, deleted, tags)
-            VALUES (%s, %s, %s, %s, %s, %s, 0, '')
+            (filename, prompt_combination_id, art_style_id, title_id, seed, date_downloaded, deleted, tags, width, height, file_size)
+            VALUES (%s, %s, %s, %s, %s, %s, 0, '', %s, %s, %s)
         ''', (
             item['filename'],
             prompt_combination_id,
             style_id,
             title_id,
             item['seed'],
-            item['date_downloaded']
+            item['date_downloaded'],
+            item.get('width'),
+            item.get('height'),
+            item.get('file_size')
         ))
+        image_id = self.cursor.lastrowid
+        add_images(self.cursor, [image_id])
         
         self.conn.commit()
-        return self.cursor.lastrowid  # Return the ID of the newly inserted image
+        return image_id  # Return the ID of the newly inserted image
+    
+    def _select_ids(self, table, key_column, keys, cache):
+        """Look up IDs for many keys with one WHERE ... IN query per chunk, filling the cache."""
+        for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            chunk = keys[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ','.join(['%s'] * len(chunk))
+            self.cursor.execute(f'SELECT {key_column}, id FROM {table} WHERE {key_column} IN ({placeholders})', chunk)
+            for key, row_id in self.cursor.fetchall():
+                cache[key] = row_id
+    
+    def _resolve_ids(self, table, key_column, columns, rows, cache, created=None, counted=None):
+        """Resolve many lookup rows to IDs with set-based queries, inserting the missing ones.
+        
+        Args:
+            table: Lookup table name
+            key_column: Unique column used for lookups (hash or name)
+            columns: Columns to insert, starting with key_column
+            rows: Dict mapping key -> tuple of column values
+            cache: Key -> ID cache for this table
+            created: Optional list that receives the keys this call inserted
+            counted: Optional table_counts name that the inserted rows are added to
+        """
+        missing = [key for key in rows if key not in cache]
+        if missing:
+            self._select_ids(table, key_column, missing, cache)
+            
+            # Multi-row insert of everything still unknown; ON DUPLICATE KEY keeps it idempotent
+            to_insert = [rows[key] for key in missing if key not in cache]
+            if created is not None:
+                created.extend(key for key in missing if key not in cache)
+            for start in range(0, len(to_insert), LOOKUP_BATCH_SIZE):
+                chunk = to_insert[start:start + LOOKUP_BATCH_SIZE]
+                row_placeholder = '(' + ','.join(['%s'] * len(columns)) + ')'
+                self.cursor.execute(
+                    f'INSERT INTO {table} ({", ".join(columns)}) VALUES {",".join([row_placeholder] * len(chunk))} '
+                    f'ON DUPLICATE KEY UPDATE id = id',
+                    [value for row in chunk for value in row]
+                )
+                if counted:
+                    add_rows(self.cursor, counted, self.cursor.rowcount)
+            
+            if to_insert:
+                self._select_ids(table, key_column, [key for key in missing if key not in cache], cache)
+        
+        return {key: cache[key] for key in rows}
+    
+    def insert_images(self, items):
+        """Insert a page of new images with set-based lookups and a single commit.
+        
+        Resolves prompts, titles, styles and prompt combinations for all items at once,
+        inserts the images with one executemany and commits once. Returns the new image
+        IDs in the same order as items.
+        """
+        if not items:
+            return []
+        
+        try:
+            # Collect distinct lookup values keyed the same way as the per-row caches
+            positive_rows, negative_rows, title_rows, style_rows = {}, {}, {}, {}
+            for item in items:
+                if item['prompt']:
+                    positive_rows[sha256_hex(item['prompt'])] = (sha256_hex(item['prompt']), item['prompt'])
+                if item['negative_prompt']:
+                    negative_rows[sha256_hex(item['negative_prompt'])] = (sha256_hex(item['negative_prompt']), item['negative_prompt'])
+                if item['title']:
+                    title_rows[sha256_hex(item['title'])] = (sha256_hex(item['title']), item['title'])
+                if item['art_style']:
+                    style_rows[item['art_style']] = (item['art_style'], '')
+            
+            positive_ids = self._resolve_ids('positive_prompts', 'hash', ('hash', 'prompt_text'), positive_rows, self.positive_prompt_cache, counted='positive-prompts')
+            negative_ids = self._resolve_ids('negative_prompts', 'hash', ('hash', 'prompt_text'), negative_rows, self.negative_prompt_cache, counted='negative-prompts')
+            title_ids = self._resolve_ids('titles', 'hash', ('hash', 'title_text'), title_rows, self.title_cache)
+            style_ids = self._resolve_ids('art_styles', 'name', ('name', 'style_string'), style_rows, self.style_cache, counted='art-styles')
+            
+            # Combinations depend on the prompt IDs resolved above
+            combination_keys = []
+            combination_rows = {}
+            for item in items:
+                positive_prompt_id = positive_ids.get(sha256_hex(item['prompt'])) if item['prompt'] else None
+                negative_prompt_id = negative_ids.get(sha256_hex(item['negative_prompt'])) if item['negative_prompt'] else None
+                combination_hash = sha256_hex(f"{positive_prompt_id or 'NULL'}|||{negative_prompt_id or 'NULL'}")
+                combination_rows[combination_hash] = (positive_prompt_id, negative_prompt_id, combination_hash)
+                combination_keys.append(combination_hash)
+            
+            created_combinations = []
+            combination_ids = self._resolve_ids('prompt_combinations', 'hash', ('positive_prompt_id', 'negative_prompt_id', 'hash'), combination_rows, self.prompt_combination_cache, created_combinations)
+            add_combinations(self.cursor, [combination_ids[key] for key in created_combinations])
+            
+            # Insert all images in one batch
+            image_rows = [(
+                item['filename'],
+                combination_ids[combination_hash],
+                style_ids.get(item['art_style']) if item['art_style'] else None,
+                title_ids.get(sha256_hex(item['title'])) if item['title'] else None,
+                item['seed'],
+                item['date_downloaded'],
+                item.get('width'),
+                item.get('height'),
+                item.get('file_size')
+            ) for item, combination_hash in zip(items, combination_keys)]
+            
+            self.cursor.executemany('''
+                INSERT INTO images 
+                (filename, prompt_combination_id, art_style_id, title_id, seed, date_downloaded, deleted, tags, width, height, file_size)
+                VALUES (%s, %s, %s, %s, %s, %s, 0, '', %s, %s, %s)
+            ''', image_rows)
+            
+            # Read the new IDs back by filename (auto-increment runs are not guaranteed contiguous)
+            image_ids = {}
+            self._select_ids('images', 'filename', [item['filename'] for item in items], image_ids)
+            add_images(self.cursor, image_ids.values())
+            
+            self.conn.commit()
+            return [image_ids[item['filename']] for item in items]
+        
+        except Error:
+            # Cached IDs from this batch may point at rolled-back rows
+            self.conn.rollback()
+            self.clear_caches()
+            raise
+    
+    def clear_caches(self):
+        """Forget all cached lookup IDs."""
+        self.positive_prompt_cache.clear()
+        self.negative_prompt_cache.clear()
+        self.prompt_combination_cache.clear()
+        self.style_cache.clear()
+        self.title_cache.clear()
 
 
 db = DatabaseManager()
 
 
-def download_and_compress( url, filename ):
-    """Download original image and save at 50% JPEG quality."""
-
-    # Download image
+def fetch_image( url ):
+    """Download raw image bytes, returning None on request errors."""
     try:
         resp = scraper.get( url, timeout=10 )   # response object from scraper call
         resp.raise_for_status()                 # check for request errors
+        return resp.content
 
-        # Open original in memory
-        img = Image.open( io.BytesIO( resp.content ) )                  # open image from bytes in memory
-        if img.mode in ( "RGBA", "P" ): img = img.convert( "RGB" )      # remove alpha channel
-
-        # Save at 50% quality
-        out_path = os.path.join( "../images/medium", filename + ".jpg" )   # construct output path
-        img.save( out_path, "JPEG", quality=50, optimize=True )         # save compressed image
-
-        return filename + ".jpg"
-    
     # Handle download errors
     except RequestException as e:
         print( f"Failed to download {url}: {e}" )
         return None
 
 
+def encode_paths( filename ):
+    """Return the (image, thumbnail or None) paths to store a download at, creating their shard directories."""
+    out_path = image_path( MEDIUM_DIR, filename + ".jpg" )     # construct output path (in its shard, if sharded)
+    thumbnail_path = image_path( THUMB_DIR, filename + ".jpg" ) if encode_settings.get( 'thumbnail_size' ) else None
+    return out_path, thumbnail_path
+
+
+def encode_image( content, filename ):
+    """Compress downloaded bytes to ../images/medium, returning (saved filename, image info) or (None, None).
+
+    The image info is the dict returned by imaging.compress_image().
+    """
+    out_path, thumbnail_path = encode_paths( filename )
+
+    try:
+        info = compress_image( content, out_path, encode_settings, thumbnail_path )
+        return filename + ".jpg", info
+
+    # Handle undecodable images
+    except OSError as e:
+        print( f"Failed to compress {filename}: {e}" )
+        return None, None
+
+
+def download_and_compress( url, filename ):
+    """Download original image and save at 50% JPEG quality, returning (saved filename, image info) or (None, None)."""
+    content = fetch_image( url )
+    if content is None: return None, None
+
+    return encode_image( content, filename )
+
+
+class DownloadPool:
+    """Bounded worker pool that overlaps image downloads with JPEG re-encoding.
+
+    Downloads fan out over a thread pool sharing the module's CloudScraper session,
+    and each finished download is handed straight to a process pool for encoding,
+    so network waits and Pillow CPU work run at the same time.
+    """
+
+    def __init__( self, workers ):
+        self.workers = workers
+        self.download_executor = ThreadPoolExecutor( max_workers=workers )
+        self.encode_executor = ProcessPoolExecutor( max_workers=min( workers, os.cpu_count() or 1 ) )
+
+    def _download( self, url, filename ):
+        """Download one image and queue its encoding, returning the encode future."""
+        content = fetch_image( url )
+        if content is None: return None
+
+        out_path, thumbnail_path = encode_paths( filename )
+        return self.encode_executor.submit( compress_image, content, out_path, encode_settings, thumbnail_path )
+
+    def download_all( self, jobs ):
+        """Download and compress a list of (url, filename) jobs.
+
+        Returns:
+            List of (saved filename, image info) pairs ((None, None) for failures), in the same order as jobs
+        """
+        download_futures = [self.download_executor.submit( self._download, url, filename ) for url, filename in jobs]
+
+        # Collect in submission order so results line up with the page order
+        results = []
+        for ( url, filename ), download_future in zip( jobs, download_futures ):
+            encode_future = download_future.result()
+            if encode_future is None:
+                results.append( ( None, None ) )
+                continue
+
+            try:
+                results.append( ( filename + ".jpg", encode_future.result() ) )
+            except OSError as e:
+                print( f"Failed to compress {filename}: {e}" )
+                results.append( ( None, None ) )
+
+        return results
+
+    def close( self ):
+        """Shut down both executors."""
+        self.download_executor.shutdown()
+        self.encode_executor.shutdown()
+
+
 def extract_art_style( title ):
     """Extract art style from title's opening parentheses."""
 
@@ -263,22 +483,31 @@ def extract_art_style( title ):
     return ""
 
 
-def scrape_page( skip ):
-    """Scrape one page of gallery results (200 items)."""
+def fetch_page( skip, base_url=BASE_URL ):
+    """Fetch the HTML of one gallery page, returning None on request errors."""
 
-    params["skip"] = skip # set skip parameter for pagination
+    page_params = dict( params, skip=skip ) # set skip parameter for pagination
 
     try:
-        resp = scraper.get( BASE_URL, params=params, timeout=15 )
+        resp = scraper.get( base_url, params=page_params, timeout=15 )
         resp.raise_for_status()
+        return resp.text
 
     # Handle request errors 
     except RequestException as e:
         print( f"Skipping batch {skip}: {e}" )
-        return [] # return empty list instead of crashing
+        return None
 
-    soup = BeautifulSoup( resp.text, "html.parser" ) # parse HTML content with BeautifulSoup
-    results = [] # initialize results list
+
+def parse_page( html ):
+    """Parse gallery HTML into result items, each paired with its image URL.
+
+    Returns:
+        List of (item, url) tuples; item["filename"] is filled in by resolve_images()
+    """
+
+    soup = BeautifulSoup( html, "html.parser" ) # parse HTML content with BeautifulSoup
+    entries = [] # initialize entries list
 
     # For each image container, extract metadata
     for ctn in soup.select( ".imageCtn" ):
@@ -291,39 +520,315 @@ def scrape_page( skip ):
         img = ctn.find( "img" )
         url = img["src"] if img else None
 
-        filename = None
-
-        # Download and compress image if URL exists
-        if url:          
-            base = os.path.splitext( os.path.basename( url ) )[0] # derive base filename from URL
-
-            # Only download if not already present
-            if not os.path.exists( os.path.join( "../images/medium", base + ".jpg" ) ):
-                filename = download_and_compress( url, base )
-            else:
-                filename = base + ".jpg" 
-
         date_downloaded = datetime.now().strftime( "%Y-%m-%d" )
         art_style = extract_art_style( title )
 
-        # Append JSON entry to results list
-        results.append( {
+        # Append JSON entry to entries list
+        entries.append( ( {
             "prompt": prompt,
             "negative_prompt": negative_prompt,
             "seed": seed,
             "title": title,
-            "filename": filename,
+            "filename": None,
             "date_downloaded": date_downloaded,
             "art_style": art_style
-        } )
+        }, url ) )
+
+    return entries
 
-    return results
 
+def resolve_images( entries, pool=None ):
+    """Download and compress images for parsed entries, filling in each item's filename.
 
-def save_results( all_results ):
-    '''Save all results to ../data/results.json (kept for backup/compatibility).'''
-    with open( "../data/results.json", "w", encoding="utf-8" ) as f:
-        json.dump( all_results, f, ensure_ascii=False, indent=2 )
+    Downloaded items also get the "width", "height" and "file_size" of the stored
+    image, and a "dhash" key with its perceptual hash, which ScrapeRun.store_items()
+    removes again before the item is stored.
+
+    Args:
+        entries: List of (item, url) tuples from parse_page()
+        pool: Optional DownloadPool; images are downloaded one at a time when None
+
+    Returns:
+        Number of images downloaded
+    """
+    jobs = []       # (url, base) pairs that still need downloading, one per base
+    job_items = {}  # base -> items sharing that image, in page order
+
+    for item, url in entries:
+        if not url: continue
+
+        base = os.path.splitext( os.path.basename( url ) )[0] # derive base filename from URL
+
+        # Only download if not already present, and only once per page, so two
+        # workers never write the same file
+        if base in job_items:
+            job_items[base].append( item )
+        elif locate_image( MEDIUM_DIR, base + ".jpg" ):
+            item["filename"] = base + ".jpg"
+        else:
+            jobs.append( ( url, base ) )
+            job_items[base] = [item]
+
+    if pool:
+        results = pool.download_all( jobs )
+    else:
+        results = [download_and_compress( url, base ) for url, base in jobs]
+
+    for ( url, base ), ( filename, info ) in zip( jobs, results ):
+        for item in job_items[base]:
+            item["filename"] = filename
+            if info:
+                item.update( info )
+
+    return len( jobs )
+
+
+def scrape_page( skip, pool=None ):
+    """Scrape one page of gallery results (200 items)."""
+
+    start = time.perf_counter()
+
+    html = fetch_page( skip )
+    if html is None: return [] # return empty list instead of crashing
+
+    entries = parse_page( html )
+    downloaded = resolve_images( entries, pool )
+
+    # Report wall time so pooled and sequential runs can be compared page for page
+    mode = f"{pool.workers} download workers" if pool else "sequential"
+    elapsed = time.perf_counter() - start
+    print( f"Page skip={skip}: {len( entries )} items, {downloaded} downloaded in {elapsed:.1f}s ({mode})" )
+
+    return [item for item, url in entries]
+
+
+class ScrapeRun:
+    """Tracks what one scrape run has seen and stored, shared by the scraper and crawler entry points."""
+
+    def __init__( self, near_duplicate_distance=None, index_path=INDEX_PATH, results_path=RESULTS_LOG ):
+        self.index = DedupIndex( index_path )
+        self.near_duplicate_distance = near_duplicate_distance  # skip near duplicates within this many bits (None = keep all)
+        self.hash_index = None
+        self.near_duplicates = 0
+        self.known_files = set()    # filenames stored during this run
+        self.new_results = []
+        self.new_image_ids = []  # Track IDs of newly inserted images
+        self.unsaved_results = []   # new items not yet appended to the backup log
+        self.results_log = ResultsLog( results_path )
+
+    def load_known_files( self ):
+        """Open the on-disk dedup index, building it on first use and catching up on rows inserted elsewhere."""
+        if self.index.open():
+            self.index.sync_from_db( db.cursor )
+        else:
+            print( "Building dedup index of known filenames (first run only)..." )
+            self.index.build( db.cursor, self.results_log.path )
+
+        ensure_table( db.cursor )
+        ensure_feed_table( db.cursor )
+        ensure_count_tables( db.cursor )
+        if self.near_duplicate_distance is not None:
+            start = time.perf_counter()
+            self.hash_index = load_index( db.conn, self.near_duplicate_distance )
+            print( f"Loaded {len( self.hash_index ):,} image hashes for near-duplicate checks in {time.perf_counter() - start:.1f}s" )
+
+    def total_known( self ):
+        """Number of filenames known to the dedup index."""
+        return len( self.index )
+
+    def store_items( self, items ):
+        """Insert new items from one page into the database, returning how many were new."""
+        hashes = {item["filename"]: item.pop( "dhash" ) for item in items if "dhash" in item}
+
+        # Collect candidate items not stored during this run (a page can repeat a filename)
+        candidates = []
+        page_files = set()
+        for item in items:
+            if item["filename"] and item["filename"] not in self.known_files and item["filename"] not in page_files:
+                candidates.append( item )
+                page_files.add( item["filename"] )
+
+        # Backup-only names are known outright; other index hits are only probable
+        # (hash collisions), so confirm them with one query
+        existing = {item["filename"] for item in candidates if self.index.is_backup_only( item["filename"] )}
+        probable = [item["filename"] for item in candidates
+                    if item["filename"] not in existing and self.index.might_contain( item["filename"] )]
+        if probable:
+            existing |= db.existing_filenames( probable )
+
+        new_items = [item for item in candidates if item["filename"] not in existing]
+        if not new_items: return 0
+
+        # Insert the whole page at once; fall back to per-image inserts to isolate a bad row
+        try:
+            image_ids = db.insert_images( new_items )
+        except Error as e:
+            print( f"Batch insert failed, retrying one image at a time: {e}" )
+            return self.store_items_individually( new_items, hashes )
+
+        self.store_hashes( list( zip( new_items, image_ids ) ), hashes )
+        self.update_feed( image_ids )
+
+        self.new_results.extend( new_items )
+        self.unsaved_results.extend( new_items )
+        self.new_image_ids.extend( image_ids )  # Track the new image IDs
+        self.known_files.update( item["filename"] for item in new_items )
+        self.index.add( item["filename"] for item in new_items )
+        return len( new_items )
+
+    def store_items_individually( self, items, hashes=None ):
+        """Insert items one row and one commit at a time, returning how many succeeded."""
+        batch_new_count = 0         # track new items in this batch
+        stored = []
+
+        for item in items:
+            # Insert into database
+            try:
+                image_id = db.insert_image( item )
+                self.new_results.append( item )
+                self.unsaved_results.append( item )
+                self.new_image_ids.append( image_id )  # Track the new image ID
+                self.known_files.add( item["filename"] )
+                self.index.add( [item["filename"]] )
+                stored.append( ( item, image_id ) )
+                batch_new_count += 1
+            except Error as e:
+                print( f"Failed to insert {item['filename']}: {e}" )
+
+        self.store_hashes( stored, hashes or {} )
+        self.update_feed( [image_id for _, image_id in stored] )
+        return batch_new_count
+
+    def find_original( self, image_hash, page_hashes ):
+        """Return the image ID or earlier filename on this page that an image hash nearly duplicates, or None."""
+        matches = self.hash_index.query( image_hash )
+        if matches:
+            return matches[0][1]
+
+        for filename, other_hash in page_hashes:
+            if hamming( image_hash, other_hash ) <= self.near_duplicate_distance:
+                return filename
+        return None
+
+    def store_hashes( self, stored, hashes ):
+        """Save the perceptual hashes of newly stored images and drop near duplicates.
+
+        With near-duplicate skipping on, an image within the distance of an image
+        already shown (or of an earlier image on the same page) keeps its row, marked
+        deleted with image_hashes.duplicate_of set, so it is not downloaded again,
+        but its file is removed.
+
+        Args:
+            stored: (item, image ID) pairs of the images just inserted
+            hashes: Filename -> dHash for the images downloaded on this page
+        """
+        stored = [( item, image_id ) for item, image_id in stored if item["filename"] in hashes]
+        if not stored: return
+
+        ids_by_filename = {item["filename"]: image_id for item, image_id in stored}
+        rows = []
+        duplicates = []
+        page_hashes = []
+        for item, image_id in stored:
+            image_hash = hashes[item["filename"]]
+            original = self.find_original( image_hash, page_hashes ) if self.hash_index is not None else None
+            if isinstance( original, str ):
+                original = ids_by_filename[original]
+
+            rows.append( ( image_id, image_hash, original ) )
+            if original is None:
+                page_hashes.append( ( item["filename"], image_hash ) )
+            else:
+                duplicates.append( ( item, image_id ) )
+
+        try:
+            save_hashes( db.cursor, rows )
+            if duplicates:
+                placeholders = ','.join( ['%s'] * len( duplicates ) )
+                add_images( db.cursor, [image_id for _, image_id in duplicates], -1 )
+                db.cursor.execute( f"UPDATE images SET deleted = 1 WHERE id IN ({placeholders})", [image_id for _, image_id in duplicates] )
+            db.conn.commit()
+        except Error as e:
+            db.conn.rollback()
+            print( f"Failed to store image hashes (run `python near_duplicates.py --backfill` later): {e}" )
+            return
+
+        for item, image_id in duplicates:
+            path = locate_image( MEDIUM_DIR, item["filename"] )
+            if path: os.remove( path )
+        self.near_duplicates += len( duplicates )
+
+        if self.hash_index is not None:
+            for filename, image_hash in page_hashes:
+                self.hash_index.add( ids_by_filename[filename], image_hash )
+
+    def update_feed( self, image_ids ):
+        """Add newly stored images to the gallery feed, so they show up before the run ends."""
+        if not image_ids: return
+        try:
+            refresh_feed( db.cursor, image_ids )
+            db.conn.commit()
+        except Error as e:
+            db.conn.rollback()
+            print( f"Failed to update the gallery feed (the maintenance step retries it): {e}" )
+
+    def save_backup( self ):
+        """Append this page's new items to the backup log (cost depends only on the page size)."""
+        self.results_log.append( self.unsaved_results )
+        self.unsaved_results = []
+
+    def save_index( self ):
+        """Write this run's additions to the on-disk dedup index."""
+        self.index.save( max( self.new_image_ids, default=None ) )
+        self.index.close()
+
+
+def run_post_scrape( new_image_ids ):
+    """Update derived data (token relationships, table counts) after new images were added."""
+
+    # Skip grouping script - no longer needed with database
+    print( "Database updated. Grouping is done dynamically via queries." )
+    
+    if len( new_image_ids ) == 0: return
+    
+    # Steps share one connection; a failed step is retried by the next run (see maintenance.py)
+    print( f"\nRunning maintenance for {len(new_image_ids)} new images..." )
+    try:
+        db.connect()
+    except Error:
+        print( "Maintenance skipped; run `python maintenance.py --image-ids ...` once the database is reachable." )
+        return
+    
+    try:
+        run_maintenance( db.conn, new_image_ids )
+    finally:
+        db.close()
+
+
+def add_encode_arguments( parser ):
+    """Add the image-processing options shared by the scraper and crawler."""
+    parser.add_argument( '--max-size', type=int,
+                        help='Shrink stored images to at most N pixels on the longest side (JPEGs while decoding)' )
+    parser.add_argument( '--thumbnails', type=int, nargs='?', const=256, metavar='SIZE',
+                        help='Also save a gallery thumbnail of SIZE pixels (default: 256) to ../images/thumbs' )
+    parser.add_argument( '--no-passthrough', action='store_true',
+                        help='Re-encode every download, even small JPEGs already at the target quality' )
+    parser.add_argument( '--no-optimize', action='store_true',
+                        help='Skip the JPEG optimize pass (faster, larger files)' )
+
+
+def apply_encode_arguments( args ):
+    """Set encode_settings from the options added by add_encode_arguments()."""
+    encode_settings.clear()
+    if args.max_size:
+        encode_settings['max_size'] = args.max_size
+    if args.thumbnails:
+        encode_settings['thumbnail_size'] = args.thumbnails
+        os.makedirs( THUMB_DIR, exist_ok=True )
+    if args.no_passthrough:
+        encode_settings['passthrough_quality'] = 0
+    if args.no_optimize:
+        encode_settings['optimize'] = False
 
 
 if __name__ == "__main__":
@@ -332,56 +837,39 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser( description='Scrape Perchance gallery images' )
     parser.add_argument( '--continue-on-empty', action='store_true',
                         help='Continue scraping even when no new items found in a batch' )
+    parser.add_argument( '--download-workers', type=int, default=0,
+                        help='Download images with N concurrent workers (default: 0, sequential)' )
+    parser.add_argument( '--compact-backup', action='store_true',
+                        help='Compact the results backup log after scraping' )
+    parser.add_argument( '--skip-near-duplicates', type=int, nargs='?', const=DEFAULT_DISTANCE, metavar='BITS',
+                        help=f'Don\'t keep images within BITS (default: {DEFAULT_DISTANCE}) of an image already shown' )
+    add_encode_arguments( parser )
     args = parser.parse_args()
 
     # Ensure folder structure exists
-    os.makedirs( "../images/medium", exist_ok=True )
-    os.makedirs( "data", exist_ok=True )
+    os.makedirs( MEDIUM_DIR, exist_ok=True )
+    apply_encode_arguments( args )
+    os.makedirs( "../data", exist_ok=True )
 
     # Connect to database
     db.connect()
 
-    # Load existing filenames from database to avoid duplicates
-    db.cursor.execute('SELECT filename FROM images WHERE filename IS NOT NULL')
-    known_files = {row[0] for row in db.cursor.fetchall()}
-    
-    # Also load from JSON if it exists (for backward compatibility during transition)
-    if os.path.exists( "../data/results.json" ):
-        with open( "../data/results.json", "r", encoding="utf-8" ) as f:
-            old_results = json.load( f )
-            known_files.update({item["filename"] for item in old_results if item.get("filename")})
-    else:
-        old_results = []
-
-    new_results = []
-    new_image_ids = []  # Track IDs of newly inserted images
+    run = ScrapeRun( args.skip_near_duplicates )
+    run.load_known_files()
     skip = 0
 
+    # Pooled downloads are opt-in; the sequential path stays the default
+    pool = DownloadPool( args.download_workers ) if args.download_workers > 0 else None
+
     try:
         while True:
-            items = scrape_page( skip ) # scrape one page of results
+            items = scrape_page( skip, pool ) # scrape one page of results
             if not items: break         # stop if no items returned
 
-            batch_new_count = 0         # track new items in this batch
-
-            # Collect and insert only new items
-            for item in items:
-                if item["filename"] and item["filename"] not in known_files:
-                    # Insert into database
-                    try:
-                        image_id = db.insert_image(item)
-                        new_results.append(item)
-                        new_image_ids.append(image_id)  # Track the new image ID
-                        known_files.add(item["filename"])
-                        batch_new_count += 1
-                    except Error as e:
-                        print(f"Failed to insert {item['filename']}: {e}")
-
-            # Also save to JSON for backup
-            all_results = new_results + old_results
-            save_results( all_results )
+            batch_new_count = run.store_items( items )
+            run.save_backup()
             
-            total_in_db = len(known_files)
+            total_in_db = run.total_known()
             print( f"Saved {total_in_db} items in database (skip={skip}, {batch_new_count} new this batch)" )
 
             # Stop if no new items found in this batch (unless --continue-on-empty is set)
@@ -393,44 +881,15 @@ if __name__ == "__main__":
             time.sleep( 2 ) # polite delay
 
     finally:
+        if pool: pool.close()
+        run.save_index()
         db.close()
 
-    print( f"Added {len( new_results )} new items. Total now {len( known_files )}." )
-    
-    # Skip grouping script - no longer needed with database
-    print( "Database updated. Grouping is done dynamically via queries." )
-    
-    # Update token relationships if new items were added
-    if len( new_image_ids ) > 0:
-        print( f"\nUpdating token relationships for {len(new_image_ids)} new images..." )
-        import subprocess
-        try:
-            result = subprocess.run(
-                ['python', 'build_token_relationships.py', '--update'],
-                cwd='c:/xampp/htdocs/perchance-scraper/python',
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            print( "Token relationships updated successfully." )
-            print( result.stdout )
-        except subprocess.CalledProcessError as e:
-            print( f"Error updating token relationships: {e}" )
-            print( e.stderr )
-        
-        # Update table counts cache
-        print( "\nUpdating table counts cache..." )
-        try:
-            from pathlib import Path
-            script_dir = Path(__file__).parent
-            result = subprocess.run(
-                ['python', str(script_dir / 'update_table_counts.py')],
-                capture_output=True,
-                text=True
-            )
-            if result.returncode == 0:
-                print( result.stdout )
-            else:
-                print( f"Warning: Failed to update table counts cache: {result.stderr}" )
-        except Exception as e:
-            print( f"Warning: Could not update table counts cache: {e}" )
\ No newline at end of file
+    print( f"Added {len( run.new_results )} new items. Total now {run.total_known()}." )
+    if run.near_duplicates:
+        print( f"Skipped {run.near_duplicates} near-duplicate images (rows kept as deleted)." )
+
+    if args.compact_backup:
+        print( f"Compacted results backup: {compact()} items" )
+
+    run_post_scrape( run.new_image_ids )
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Word index over the positive prompts, used by the gallery's prompt search.
+
+Every prompt is split into words (runs of letters, digits and underscores,
+lowercased) with the same splitter that web/api/utils/search.php applies to a
+search term:
+
+    words         one row per distinct word
+    prompt_words  (word_id, prompt_id) for each word of each prompt
+
+so the prompts containing a word are found with index lookups alone. search.php
+turns a search term into one lookup per word of the term:
+
+- whole words: the prompt must contain each word exactly
+- substring:   the prompt must contain, for each word piece of at least
+               MIN_SUBSTRING_PIECE characters, a word containing that piece
+               (a scan of the words table, which is far smaller than the prompts)
+
+A term that occurs in a prompt has each of its words inside one word of the
+prompt, so the lookups never drop a match. They can keep prompts that don't
+match (a phrase whose words are apart, the words table's case and accent
+insensitive collation), so the candidates are always checked against the prompt
+text with the original LIKE / REGEXP, which runs on a few rows instead of every
+prompt. search_condition() builds the same SQL as search.php; keep the two in sync.
+
+What can still differ from a plain scan:
+
+- words longer than WORD_MAX_LENGTH characters are not indexed, so a substring
+  piece inside one is not found (terms with such a word scan instead)
+- whole words are split on letters and digits of every script; the REGEXP word
+  boundaries of the scan follow the server's regex library, which may treat
+  non-ASCII letters as boundaries
+- Python's \w and PHP's [\p{L}\p{N}_] are the same classes, but each follows the
+  Unicode version of its runtime
+
+The index is updated by the search_index maintenance step for prompts added
+since the last run. search_index_progress records the highest prompt ID indexed,
+and every lookup also takes the prompts above it whose text matches (a primary
+key range over the prompts of the latest scrapes), so a search finds images of
+the latest scrape before the index catches up.
+
+Usage:
+    python search_index.py                           # Index prompts added since the last run
+    python search_index.py --rebuild                 # Re-index every prompt
+    python search_index.py --search "red hair" --whole-words
+"""
+
+import argparse
+import re
+import time
+
+from database import INSERT_BATCH_SIZE, LOOKUP_BATCH_SIZE, get_connection
+
+WORD_PATTERN = re.compile( r'\w+' )     # letters, digits and underscore: [\p{L}\p{N}_] in search.php
+WORD_MAX_LENGTH = 100                   # longer words are not indexed (searches for them fall back to a scan)
+MIN_SUBSTRING_PIECE = 3                 # shorter pieces match too many words to narrow a substring search
+
+WORDS_TABLE = """
+    CREATE TABLE IF NOT EXISTS words (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        word VARCHAR(100) NOT NULL UNIQUE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+PROMPT_WORDS_TABLE = """
+    CREATE TABLE IF NOT EXISTS prompt_words (
+        word_id INT NOT NULL,
+        prompt_id INT NOT NULL,
+        PRIMARY KEY (word_id, prompt_id),
+        INDEX idx_prompt (prompt_id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+PROGRESS_TABLE = """
+    CREATE TABLE IF NOT EXISTS search_index_progress (
+        id TINYINT PRIMARY KEY,
+        last_prompt_id INT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# Prompts (positive_prompts.id) containing a word matching {match}, plus the
+# prompts not indexed yet whose text matches the whole term ({text})
+PROMPTS_WITH_WORD = """
+    SELECT pw.prompt_id
+    FROM words w
+    JOIN prompt_words pw ON pw.word_id = w.id
+    WHERE w.word {match}
+    UNION
+    SELECT pp.id
+    FROM positive_prompts pp
+    WHERE pp.id > (SELECT COALESCE(MAX(last_prompt_id), 0) FROM search_index_progress)
+      AND pp.prompt_text {text}
+"""
+
+
+def split_words( text, minimum=1 ):
+    """Distinct lowercase words of a prompt or search term with minimum to WORD_MAX_LENGTH characters, in order of appearance.
+
+    Words are split before lowercasing, as in searchPieces() in search.php.
+    """
+    return list( dict.fromkeys( word.lower() for word in WORD_PATTERN.findall( text )
+                                if minimum <= len( word ) <= WORD_MAX_LENGTH ) )
+
+def search_pieces( term, whole_words ):
+    """Words of a search term that the index can look up."""
+    return split_words( term, 1 if whole_words else MIN_SUBSTRING_PIECE )
+
+def search_condition( term, whole_words, column='f' ):
+    """SQL condition on gallery_feed (alias column) matching prompts that contain term.
+
+    The word lookups narrow the candidates and the original LIKE '%term%' /
+    REGEXP word-boundary match decides (see the module docstring).
+
+    Returns:
+        (sql, params) with %s placeholders
+    """
+    if whole_words:
+        text, text_param = "REGEXP %s", f"[[:<:]]{term}[[:>:]]"
+    else:
+        text, text_param = "LIKE %s", f"%{term}%"
+
+    conditions = []
+    params = []
+    for piece in search_pieces( term, whole_words ):
+        query = PROMPTS_WITH_WORD.format( match='= %s' if whole_words else 'LIKE %s', text=text )
+        conditions.append( f"{column}.prompt_id IN ({query})" )
+        params.extend( [piece if whole_words else f"%{piece}%", text_param] )
+
+    conditions.append( f"{column}.prompt {text}" )
+    params.append( text_param )
+    return ' AND '.join( conditions ), params
+
+def ensure_tables( cursor ):
+    """Create words, prompt_words and search_index_progress if they don't exist yet.
+
+    Returns:
+        True if the tables were missing or held the earlier token-based index
+        (token_words, which is dropped), so every prompt needs indexing
+    """
+    cursor.execute( "SHOW TABLES LIKE 'prompt_words'" )
+    missing = cursor.fetchone() is None
+    cursor.execute( "DROP TABLE IF EXISTS token_words" )
+    cursor.execute( WORDS_TABLE )
+    cursor.execute( PROMPT_WORDS_TABLE )
+    cursor.execute( PROGRESS_TABLE )
+    return missing
+
+def save_progress( cursor, last_prompt_id ):
+    """Record that the prompts up to last_prompt_id are in the index."""
+    cursor.execute( """
+        INSERT INTO search_index_progress (id, last_prompt_id) VALUES (1, %s)
+        ON DUPLICATE KEY UPDATE last_prompt_id = VALUES(last_prompt_id)
+    """, ( last_prompt_id, ) )
+
+def resolve_word_ids( cursor, words ):
+    """Map words to IDs, creating missing words in bulk."""
+    ids = {}
+    for start in range( 0, len( words ), LOOKUP_BATCH_SIZE ):
+        batch = words[start:start + LOOKUP_BATCH_SIZE]
+        cursor.executemany( "INSERT IGNORE INTO words (word) VALUES (%s)", [( word, ) for word in batch] )
+
+        placeholders = ','.join( ['%s'] * len( batch ) )
+        cursor.execute( f"SELECT id, word FROM words WHERE word IN ({placeholders})", batch )
+        found = {word: word_id for word_id, word in cursor.fetchall()}
+
+        for word in batch:
+            if word in found:
+                ids[word] = found[word]
+            else:
+                # The collation treats it as equal to another word (e.g. accents), so share its row
+                cursor.execute( "SELECT id FROM words WHERE word = %s", ( word, ) )
+                ids[word] = cursor.fetchone()[0]
+    return ids
+
+def update_index( db, rebuild=False, batch_size=INSERT_BATCH_SIZE, commit=True ):
+    """Index the words of prompts added since the last run (every prompt with rebuild).
+
+    Prompt IDs only grow and prompts are never edited, so the prompts above
+    search_index_progress are the new ones. The progress moves with each batch,
+    in the same transaction as its words. Each batch is committed, unless commit
+    is False (the caller commits).
+
+    Returns:
+        Dict with counts of 'prompts' and 'words' (prompt-word pairs) indexed
+    """
+    cursor = db.cursor()
+    stats = {'prompts': 0, 'words': 0}
+    start = time.perf_counter()
+
+    try:
+        if ensure_tables( cursor ):
+            rebuild = True
+        if rebuild:
+            save_progress( cursor, 0 )
+            cursor.execute( "TRUNCATE TABLE prompt_words" )
+            last_id = 0
+        else:
+            cursor.execute( "SELECT COALESCE(MAX(last_prompt_id), 0) FROM search_index_progress" )
+            last_id = cursor.fetchone()[0]
+
+        while True:
+            cursor.execute( "SELECT id, prompt_text FROM positive_prompts WHERE id > %s ORDER BY id LIMIT %s", ( last_id, batch_size ) )
+            prompts = cursor.fetchall()
+            if not prompts: break
+            last_id = prompts[-1][0]
+
+            pairs = [( prompt_id, word ) for prompt_id, prompt_text in prompts for word in split_words( prompt_text or '' )]
+            word_ids = resolve_word_ids( cursor, list( dict.fromkeys( word for _, word in pairs ) ) )
+            rows = [( word_ids[word], prompt_id ) for prompt_id, word in pairs]
+            for offset in range( 0, len( rows ), INSERT_BATCH_SIZE ):
+                cursor.executemany( "INSERT IGNORE INTO prompt_words (word_id, prompt_id) VALUES (%s, %s)",
+                                    rows[offset:offset + INSERT_BATCH_SIZE] )
+            save_progress( cursor, last_id )
+            if commit:
+                db.commit()
+
+            stats['prompts'] += len( prompts )
+            stats['words'] += len( rows )
+            print( f"  {stats['prompts']:,} prompts indexed ({stats['prompts'] / ( time.perf_counter() - start ):,.0f}/s)" )
+    finally:
+        cursor.close()
+
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser( description='Maintain and query the word index of the prompt search' )
+    parser.add_argument( '--rebuild', action='store_true', help='Re-index every prompt instead of only new ones' )
+    parser.add_argument( '--search', metavar='TERM', help='Count gallery images whose prompt matches TERM' )
+    parser.add_argument( '--whole-words', action='store_true', help='Match whole words (with --search)' )
+    args = parser.parse_args()
+
+    db = get_connection()
+    try:
+        if args.search:
+            condition, params = search_condition( args.search, args.whole_words )
+            cursor = db.cursor()
+            start = time.perf_counter()
+            cursor.execute( f"SELECT COUNT(*) FROM gallery_feed f WHERE {condition}", params )
+            count = cursor.fetchone()[0]
+            print( f"{count:,} images match in {( time.perf_counter() - start ) * 1000:.1f} ms" )
+            cursor.close()
+        else:
+            stats = update_index( db, args.rebuild )
+            print( f"Indexed {stats['prompts']:,} prompts ({stats['words']:,} prompt words)" )
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,70 +1,73 @@
+"""
+Infer each art style's style string: the longest substring common to all of its prompts.
+
+Usage:
+    python style_prompt.py                  # Analyze every style in this process
+    python style_prompt.py --workers 8      # Analyze styles across 8 processes
+"""
+
+import argparse
 import json
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from results_log import iter_results
+from common_substring import SAMPLE_SIZE, find_common_substring
 
-def find_common_substrings( strings ):
+def find_common_substrings( strings, sample_size=SAMPLE_SIZE ):
     """Find the longest substring common to all strings in the list."""
-    if not strings:
-        return ""
-    if len( strings ) == 1:
-        return strings[0]
-    
-    # Start with the first string and find substrings
-    base = strings[0]
-    best_match = ""
-    
-    # Try all possible substrings of the first string
-    for length in range( len( base ), 0, -1 ):
-        for start in range( len( base ) - length + 1 ):
-            substring = base[start:start + length]
-            # Check if this substring exists in all other strings
-            if all( substring in s for s in strings[1:] ):
-                if len( substring ) > len( best_match ):
-                    best_match = substring
-        # If we found a match at this length, no need to check shorter ones
-        if best_match:
-            break
-    
-    return best_match.strip()
+    return find_common_substring( strings, sample_size )
+
+def analyze_style( job ):
+    """Compute one style's common string; job is (style, prompts, sample_size)."""
+    style, prompts, sample_size = job
+    return style, len( prompts ), find_common_substrings( prompts, sample_size )
 
 def main():
-    # Load results
-    with open( '../data/results.json', 'r', encoding='utf-8' ) as f:
-        data = json.load( f )
-    
+    parser = argparse.ArgumentParser( description='Find the common style string of each art style' )
+    parser.add_argument( '--workers', type=int, default=1,
+                        help='Analyze styles in N processes (default: 1)' )
+    parser.add_argument( '--sample-size', type=int, default=SAMPLE_SIZE,
+                        help=f'Solve styles with more distinct prompts on a verified sample (default: {SAMPLE_SIZE}, 0 = off)' )
+    args = parser.parse_args()
+
     # Group prompts by art_style, filtering out prompts over 3000 characters
     style_prompts = defaultdict( list )
-    for item in data:
+    for item in iter_results():
         art_style = item.get( 'art_style', '' )
         prompt = item.get( 'prompt', '' )
         if art_style and prompt and len( prompt ) <= 3000:
             style_prompts[art_style].append( prompt )
-    
+
+    # Skip styles with only one prompt; largest styles first so workers finish together
+    jobs = [( style, prompts, args.sample_size ) for style, prompts in style_prompts.items() if len( prompts ) >= 2]
+    jobs.sort( key=lambda job: len( job[1] ), reverse=True )
+
     # Find longest common substring for each style
+    if args.workers > 1:
+        with ProcessPoolExecutor( max_workers=args.workers ) as pool:
+            analyzed = list( pool.map( analyze_style, jobs ) )
+    else:
+        analyzed = [analyze_style( job ) for job in jobs]
+
     results = {}
-    for style, prompts in sorted( style_prompts.items() ):
-        # Skip styles with only one prompt
-        if len( prompts ) < 2:
-            continue
-            
-        common = find_common_substrings( prompts )
-        
+    for style, count, common in sorted( analyzed ):
         # Skip if no common string found
         if not common:
             continue
-            
+
         results[style] = {
-            'count': len( prompts ),
+            'count': count,
             'style_string': common,
             'length': len( common )
         }
-        print( f"{style}: {len( prompts )} prompts, common string length: {len( common )}" )
+        print( f"{style}: {count} prompts, common string length: {len( common )}" )
         if common:
             print( f"  → {common[:100]}{'...' if len( common ) > 100 else ''}" )
-    
+
     # Save results
     with open( '../data/style_prompts.json', 'w', encoding='utf-8' ) as f:
         json.dump( results, f, ensure_ascii=False, indent=2 )
-    
+
     print( f"\nProcessed {len( results )} styles. Results saved to ../data/style_prompts.json" )
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+"""
+Prompt tokenization shared by extract_tokens.py and build_token_relationships.py.
+
+Kept free of database imports so the shard functions here can be run in a
+ProcessPoolExecutor. Prompts are split into shards of consecutive rows (contiguous
+id ranges when the rows are ordered by id), each shard is tokenized by a worker, and
+the partial results are merged in shard order, so the parallel path produces exactly
+the same counts, token order and relationships as tokenizing in a single process.
+"""
+
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+DELIMITERS = re.compile( r'[,.\n]|\\n' )    # comma, period, or common line break indicators
+SHARD_SIZE = 5000                           # prompts per worker task
+
+
+def extract_tokens( text ):
+    """Extract tokens from text using delimiters: comma, period, line breaks."""
+    if not text:
+        return []
+
+    # Clean up tokens: strip whitespace, filter empty strings, lowercase for consistency
+    return [token.strip().lower() for token in DELIMITERS.split( text ) if token.strip()]
+
+
+def count_tokens( rows ):
+    """Count prompt and negative prompt tokens for (prompt, negative_prompt, style_string) rows.
+
+    Returns:
+        (prompt_tokens, negative_prompt_tokens) Counters
+    """
+    prompt_tokens = Counter()
+    negative_prompt_tokens = Counter()
+
+    for prompt, negative_prompt, style_string in rows:
+        prompt = prompt or ''
+
+        # Remove style string from prompt if it exists
+        if style_string:
+            prompt = prompt.replace( style_string, '' )
+
+        prompt_tokens.update( extract_tokens( prompt ) )
+        negative_prompt_tokens.update( extract_tokens( negative_prompt ) )
+
+    return prompt_tokens, negative_prompt_tokens
+
+
+def merge_counts( left, right ):
+    """Merge two count_tokens() results; tokens first seen in right keep their order after left's."""
+    left[0].update( right[0] )
+    left[1].update( right[1] )
+    return left
+
+
+def tokenize_prompts( rows ):
+    """Tokenize (prompt_id, prompt_text) rows into (prompt_id, tokens) pairs."""
+    return [( prompt_id, extract_tokens( prompt_text ) ) for prompt_id, prompt_text in rows]
+
+
+def shards( rows, size=SHARD_SIZE ):
+    """Split an iterable of rows into lists of consecutive rows."""
+    rows = iter( rows )
+    while True:
+        shard = list( islice( rows, size ) )
+        if not shard: return
+        yield shard
+
+
+def map_shards( func, rows, workers=1, shard_size=SHARD_SIZE ):
+    """Apply func to consecutive shards of rows, yielding results in shard order.
+
+    With workers > 1 the shards run in a process pool. At most two shards per
+    worker are in flight, so a streamed input is never read far ahead of the workers.
+    """
+    if workers <= 1:
+        for shard in shards( rows, shard_size ):
+            yield func( shard )
+        return
+
+    with ProcessPoolExecutor( max_workers=workers ) as pool:
+        pending = []
+        for shard in shards( rows, shard_size ):
+            pending.append( pool.submit( func, shard ) )
+            if len( pending ) >= workers * 2:
+                yield pending.pop( 0 ).result()
+
+        for future in pending:
+            yield future.result()
+
+
+def tree_reduce( results, merge ):
+    """Merge an ordered stream of partial results pairwise, like a balanced binary tree.
+
+    Partials of equal size are merged as soon as both exist, so each merge combines
+    similarly sized halves and only O(log n) partials are held at once. Merges always
+    fold the later partial into the earlier one, preserving order.
+    """
+    stack = []  # (level, partial), levels strictly decreasing from bottom to top
+
+    for result in results:
+        level = 0
+        while stack and stack[-1][0] == level:
+            result = merge( stack.pop()[1], result )
+            level += 1
+        stack.append( ( level, result ) )
+
+    if not stack: return None
+
+    merged = stack.pop()[1]
+    while stack:
+        merged = merge( stack.pop()[1], merged )
+    return merged
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Incrementally infer art_styles.style_string from the prompts in the database.
+
+Each style's style string is the longest substring common to all of its prompts
+(see common_substring.py). Instead of recomputing every style from results.json
+like style_prompt.py, this job keeps a fingerprint per style in style_fingerprints
+(number of images and highest image ID when the string was last inferred, and
+the common span it was cut from, before whitespace was stripped):
+
+- unchanged fingerprint: the style is skipped
+- only new images (higher IDs) were added: the stored span is checked against
+  the new prompts alone and kept if every one of them contains it, since adding
+  prompts can only shorten the common span. The stripped string is not enough:
+  a new prompt can contain it without the whitespace around it, and then the
+  recomputed span differs
+- anything else (string missing or no longer common, images removed or moved to
+  another style): the style is recomputed from all of its prompts
+
+Usage:
+    python update_style_strings.py                    # Refresh styles that gained or lost images
+    python update_style_strings.py --full             # Recompute every style
+    python update_style_strings.py --workers 8        # Recompute styles across 8 processes
+"""
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from common_substring import SAMPLE_SIZE, find_common_span
+from database import LOOKUP_BATCH_SIZE, get_connection, iter_rows
+
+MAX_PROMPT_LENGTH = 3000    # longer prompts are ignored, as in style_prompt.py
+
+FINGERPRINT_TABLE = """
+    CREATE TABLE IF NOT EXISTS style_fingerprints (
+        art_style_id INT PRIMARY KEY,
+        image_count INT NOT NULL,
+        max_image_id INT NOT NULL,
+        common_span TEXT NULL,
+        FOREIGN KEY (art_style_id) REFERENCES art_styles(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# Fingerprint tables created before common_span was stored
+FINGERPRINT_SPAN_COLUMN = "ALTER TABLE style_fingerprints ADD COLUMN IF NOT EXISTS common_span TEXT NULL"
+
+STYLE_PROMPTS_QUERY = """
+    SELECT pp.prompt_text
+    FROM images i
+    JOIN prompt_combinations pc ON i.prompt_combination_id = pc.id
+    JOIN positive_prompts pp ON pc.positive_prompt_id = pp.id
+    WHERE i.art_style_id = %s AND i.id > %s
+      AND pp.prompt_text <> '' AND CHAR_LENGTH(pp.prompt_text) <= %s
+    ORDER BY i.id
+"""
+
+def current_fingerprints( cursor, style_ids=None ):
+    """Return {style_id: (image_count, max_image_id)} from the images table.
+
+    Args:
+        style_ids: Only fingerprint these styles (default: all)
+    """
+    fingerprints = {}
+    if style_ids is None:
+        cursor.execute( "SELECT art_style_id, COUNT(*), MAX(id) FROM images WHERE art_style_id IS NOT NULL GROUP BY art_style_id" )
+        fingerprints.update( ( row[0], tuple( row[1:] ) ) for row in cursor.fetchall() )
+        return fingerprints
+
+    style_ids = list( style_ids )
+    for start in range( 0, len( style_ids ), LOOKUP_BATCH_SIZE ):
+        batch = style_ids[start:start + LOOKUP_BATCH_SIZE]
+        placeholders = ','.join( ['%s'] * len( batch ) )
+        cursor.execute( f"SELECT art_style_id, COUNT(*), MAX(id) FROM images WHERE art_style_id IN ({placeholders}) GROUP BY art_style_id", batch )
+        fingerprints.update( ( row[0], tuple( row[1:] ) ) for row in cursor.fetchall() )
+    return fingerprints
+
+def stored_fingerprints( cursor ):
+    """Return {style_id: (image_count, max_image_id, common_span)} as of the last run."""
+    cursor.execute( "SELECT art_style_id, image_count, max_image_id, common_span FROM style_fingerprints" )
+    return {row[0]: tuple( row[1:] ) for row in cursor.fetchall()}
+
+def styles_of_images( cursor, image_ids ):
+    """Return the IDs of the art styles used by the given images."""
+    image_ids = list( image_ids )
+    style_ids = set()
+    for start in range( 0, len( image_ids ), LOOKUP_BATCH_SIZE ):
+        batch = image_ids[start:start + LOOKUP_BATCH_SIZE]
+        placeholders = ','.join( ['%s'] * len( batch ) )
+        cursor.execute( f"SELECT DISTINCT art_style_id FROM images WHERE id IN ({placeholders}) AND art_style_id IS NOT NULL", batch )
+        style_ids.update( row[0] for row in cursor.fetchall() )
+    return style_ids
+
+def style_prompts( db, style_id, after_id=0 ):
+    """Return a style's prompts in image ID order, optionally only for images after after_id."""
+    return [row[0] for row in iter_rows( db, STYLE_PROMPTS_QUERY, ( style_id, after_id, MAX_PROMPT_LENGTH ) )]
+
+def count_images_after( cursor, style_id, after_id ):
+    """Count a style's images with IDs above after_id."""
+    cursor.execute( "SELECT COUNT(*) FROM images WHERE art_style_id = %s AND id > %s", ( style_id, after_id ) )
+    return cursor.fetchone()[0]
+
+def infer_style( job ):
+    """Compute one style's common span (unstripped); job is (style_id, prompts, sample_size). None if under 2 prompts."""
+    style_id, prompts, sample_size = job
+    if len( prompts ) < 2:
+        return style_id, None
+    return style_id, find_common_span( prompts, sample_size )
+
+def update_style_strings( db, style_ids=None, full=False, sample_size=SAMPLE_SIZE, workers=1 ):
+    """Refresh art_styles.style_string for styles whose images changed.
+
+    Args:
+        db: Open database connection; the caller commits
+        style_ids: Only consider these styles (default: all)
+        full: Ignore fingerprints and recompute every considered style
+        sample_size: Passed to find_common_substring
+        workers: Recompute styles in this many processes (1 = in this process)
+
+    Returns:
+        Dict with counts of 'unchanged', 'verified' and 'recomputed' styles
+    """
+    cursor = db.cursor()
+    stats = {'unchanged': 0, 'verified': 0, 'recomputed': 0}
+
+    try:
+        cursor.execute( FINGERPRINT_TABLE )
+        cursor.execute( FINGERPRINT_SPAN_COLUMN )
+        start = time.perf_counter()
+        current = current_fingerprints( cursor, style_ids )
+        stored = {} if full else stored_fingerprints( cursor )
+
+        jobs = []
+        for style_id, fingerprint in current.items():
+            image_count, max_image_id = fingerprint
+            previous = stored.get( style_id )
+
+            if previous and previous[:2] == fingerprint:
+                stats['unchanged'] += 1
+                continue
+
+            # Images were only appended: keep the string if every new prompt still contains its span
+            if previous and previous[2] and max_image_id > previous[1] and \
+                    image_count == previous[0] + count_images_after( cursor, style_id, previous[1] ):
+                span = previous[2]
+                if all( span in prompt for prompt in style_prompts( db, style_id, previous[1] ) ):
+                    stats['verified'] += 1
+                    save_fingerprint( cursor, style_id, fingerprint, span )
+                    continue
+
+            jobs.append( ( style_id, style_prompts( db, style_id ), sample_size ) )
+
+        # Largest styles first so workers finish together
+        jobs.sort( key=lambda job: len( job[1] ), reverse=True )
+        if workers > 1 and len( jobs ) > 1:
+            with ProcessPoolExecutor( max_workers=workers ) as pool:
+                inferred = list( pool.map( infer_style, jobs ) )
+        else:
+            inferred = [infer_style( job ) for job in jobs]
+
+        for style_id, span in inferred:
+            if span is not None:
+                cursor.execute( "UPDATE art_styles SET style_string = %s WHERE id = %s", ( span.strip(), style_id ) )
+            save_fingerprint( cursor, style_id, current[style_id], span )
+            stats['recomputed'] += 1
+
+        print( f"Style strings: {stats['recomputed']} recomputed, {stats['verified']} verified, "
+               f"{stats['unchanged']} unchanged ({time.perf_counter() - start:.1f}s)" )
+    finally:
+        cursor.close()
+
+    return stats
+
+def save_fingerprint( cursor, style_id, fingerprint, span=None ):
+    """Record the (image_count, max_image_id) a style's string was inferred from, and its unstripped span."""
+    cursor.execute( """
+        INSERT INTO style_fingerprints (art_style_id, image_count, max_image_id, common_span)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE image_count = VALUES(image_count), max_image_id = VALUES(max_image_id),
+                                common_span = VALUES(common_span)
+    """, ( style_id, *fingerprint, span ) )
+
+def main():
+    parser = argparse.ArgumentParser( description='Infer art style strings from the prompts in the database' )
+    parser.add_argument( '--full', action='store_true',
+                        help='Recompute every style instead of only those whose images changed' )
+    parser.add_argument( '--workers', type=int, default=1,
+                        help='Recompute styles in N processes (default: 1)' )
+    parser.add_argument( '--sample-size', type=int, default=SAMPLE_SIZE,
+                        help=f'Solve styles with more distinct prompts on a verified sample (default: {SAMPLE_SIZE}, 0 = off)' )
+    args = parser.parse_args()
+
+    db = get_connection()
+    try:
+        update_style_strings( db, full=args.full, sample_size=args.sample_size, workers=args.workers )
+        db.commit()
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,81 +1,112 @@
 #!/usr/bin/env python3
 """
 Update table counts cache for the web interface.
-Run this after the scraper completes or after deleting images.
+
+The counts are exact: they are read from the table_counts rows that the
+writers keep up to date in their own transactions (see aggregate_counts.py),
+so reading them costs one primary key scan of a few rows, like the MAX(id)
+queries used before (which overcounted after deletes, tag ID gaps and
+soft-deleted images). 'images' counts live images only.
+
+Every change to a count bumps its generation. The cache file records the sum
+of the generations and is only rewritten (atomically) when that sum changed.
+Run this after the scraper completes or after deleting images; the
+maintenance pipeline runs it as its table_counts step.
+
+Usage:
+    python update_table_counts.py            # Rewrite the cache if the counts changed
+    python update_table_counts.py --force    # Rewrite it regardless
 """
 
+import argparse
 import json
-import mysql.connector
+import os
 from pathlib import Path
 
-def get_table_counts():
-    """Query database for table counts and return as dictionary."""
-    print("Connecting to database...")
-    db = mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='',
-        database='perchance_gallery'
-    )
-    cursor = db.cursor(dictionary=True)
-    
-    counts = {}
-    
-    # Art Styles count
-    print("Counting art styles...", end='', flush=True)
-    cursor.execute("SELECT MAX(id) as count FROM art_styles")
-    counts['art-styles'] = cursor.fetchone()['count'] or 0
-    print(f" {counts['art-styles']:,}")
-    
-    # Positive Prompts count
-    print("Counting positive prompts...", end='', flush=True)
-    cursor.execute("SELECT MAX(id) as count FROM positive_prompts")
-    counts['positive-prompts'] = cursor.fetchone()['count'] or 0
-    print(f" {counts['positive-prompts']:,}")
-    
-    # Negative Prompts count
-    print("Counting negative prompts...", end='', flush=True)
-    cursor.execute("SELECT MAX(id) as count FROM negative_prompts")
-    counts['negative-prompts'] = cursor.fetchone()['count'] or 0
-    print(f" {counts['negative-prompts']:,}")
-    
-    # Tags count
-    print("Counting tags...", end='', flush=True)
-    cursor.execute("SELECT MAX(id) as count FROM tags")
-    counts['tags'] = cursor.fetchone()['count'] or 0
-    print(f" {counts['tags']:,}")
-    
-    # Tokens count
-    print("Counting tokens...", end='', flush=True)
-    cursor.execute("SELECT MAX(id) as count FROM tokens")
-    counts['tokens'] = cursor.fetchone()['count'] or 0
-    print(f" {counts['tokens']:,}")
-    
-    cursor.close()
-    db.close()
-    
+from aggregate_counts import TABLE_COUNTS, ensure_tables, reconcile
+from database import get_connection
+
+CACHE_PATH = Path( __file__ ).parent.parent / 'web' / 'api' / 'table_counts.json'
+
+
+def get_table_counts( db=None ):
+    """Read the stored row counts.
+
+    The first read on a database whose table_counts is still empty counts the
+    tables once with COUNT(*).
+
+    Args:
+        db: Optional open connection to reuse; a new one is opened (and closed) if omitted
+
+    Returns:
+        (counts, generation): dict of cache key -> row count, and the sum of the generations
+    """
+    own_connection = db is None
+    if own_connection:
+        db = get_connection()
+    cursor = db.cursor()
+
+    try:
+        ensure_tables( cursor )
+        cursor.execute( "SELECT name, row_count, generation FROM table_counts" )
+        rows = cursor.fetchall()
+        if not rows:
+            print( "Counting table rows..." )
+            reconcile( db, ['table_counts'] )
+            cursor.execute( "SELECT name, row_count, generation FROM table_counts" )
+            rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        if own_connection:
+            db.close()
+
+    counts = dict.fromkeys( TABLE_COUNTS, 0 )
+    counts.update( ( name, row_count ) for name, row_count, _ in rows if name in TABLE_COUNTS )
+    return counts, sum( generation for _, _, generation in rows )
+
+def cached_generation( path=CACHE_PATH ):
+    """Return the generation recorded in the cache file, or None if there is no usable file."""
+    try:
+        with open( path, 'r', encoding='utf-8' ) as f:
+            return json.load( f ).get( 'generation' )
+    except ( OSError, ValueError, AttributeError ):
+        return None
+
+def save_counts_cache( counts, generation, path=CACHE_PATH ):
+    """Write the counts and their generation to the cache file (write and rename, so readers never see half a file)."""
+    path.parent.mkdir( parents=True, exist_ok=True )
+    temp_path = path.with_name( path.name + '.tmp' )
+    with open( temp_path, 'w', encoding='utf-8' ) as f:
+        json.dump( {**counts, 'generation': generation}, f, indent=2 )
+    os.replace( temp_path, path )
+
+def update_table_counts( db=None, force=False, path=CACHE_PATH ):
+    """Rewrite the cache file if the counts changed since it was written.
+
+    Returns:
+        Dict of cache key -> row count
+    """
+    counts, generation = get_table_counts( db )
+    if not force and cached_generation( path ) == generation:
+        print( f"Table counts unchanged (generation {generation:,})" )
+        return counts
+
+    for name, count in counts.items():
+        print( f"  {name}: {count:,}" )
+    save_counts_cache( counts, generation, path )
+    print( f"✓ Cache saved to: {path} (generation {generation:,})" )
     return counts
 
-def save_counts_cache(counts):
-    """Save counts to JSON cache file."""
-    # Get the project root (parent of python directory)
-    script_dir = Path(__file__).parent
-    project_root = script_dir.parent
-    cache_file = project_root / 'web' / 'api' / 'table_counts.json'
-    
-    # Ensure directory exists
-    cache_file.parent.mkdir(parents=True, exist_ok=True)
-    
-    # Write counts to file
-    with open(cache_file, 'w', encoding='utf-8') as f:
-        json.dump(counts, f, indent=2)
-    
-    print(f"\n✓ Cache saved to: {cache_file}")
+def main():
+    parser = argparse.ArgumentParser( description='Update the table counts cache for the web interface' )
+    parser.add_argument( '--force', action='store_true', help='Rewrite the cache even if the generation is unchanged' )
+    args = parser.parse_args()
 
-if __name__ == '__main__':
     try:
-        counts = get_table_counts()
-        save_counts_cache(counts)
+        update_table_counts( force=args.force )
     except Exception as e:
-        print(f"Error updating table counts: {e}")
-        exit(1)
+        print( f"Error updating table counts: {e}" )
+        exit( 1 )
+
+if __name__ == '__main__':
+    main()
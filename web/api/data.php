@@ -11,11 +11,21 @@
  * - wholeWords: Whole word matching (true/false, default: false)
  * - searchLimit: Max results when searching (optional)
  * - limit: Results per page (default: 200)
- * - offset: Starting record (default: 0)
+ * - cursor: Continue after the page that returned this 'next' cursor (optional)
+ * - offset: Starting record, for jumping to a page without a cursor (default: 0)
  * - sort: Sort mode - 'recent', 'style', or 'prompt' (default: recent)
+ * 
+ * Response: { items: [...], next: cursor of the following page, or null on the last page }
+ * 
+ * Reads the gallery_feed table, which holds one pre-joined row per shown image
+ * (rebuild it with `python gallery_feed.py --rebuild`). Each sort mode is served
+ * by one of its indexes. Prompts are ordered by their first 191 characters.
  */
 
+require_once __DIR__ . '/utils/cursor.php';
 require_once __DIR__ . '/utils/db_utils.php';
+require_once __DIR__ . '/utils/image_paths.php';
+require_once __DIR__ . '/utils/search.php';
 
 try {
     $db = getDbConnection();
@@ -27,126 +37,102 @@ try {
     $searchLimit = isset( $_GET['searchLimit'] ) && $_GET['searchLimit'] !== '' ? intval( $_GET['searchLimit'] ) : null;
     $limit = intval( $_GET['limit'] ?? 200 );
     $offset = intval( $_GET['offset'] ?? 0 );
+    $cursor = $_GET['cursor'] ?? '';
     $sortMode = $_GET['sort'] ?? 'recent';
     
-    // Build base query - joins all related tables for image metadata
+    // Sort key of each mode (for prompt mode, of the prompt groups), ending with a unique column
+    $sortKeys = [
+        'recent' => [ [ 'f.image_id', 'DESC' ] ],
+        'style' => [ [ 'f.style_missing', 'ASC' ], [ 'f.art_style', 'ASC' ], [ 'f.newest_first', 'ASC' ] ],
+        'prompt' => [ [ 'f.prompt_key', 'ASC' ], [ 'f.prompt_hash', 'ASC' ] ]
+    ];
+    if( !isset( $sortKeys[$sortMode] ) ) {
+        $sortMode = 'recent';
+    }
+    $browsing = $searchTerm === '';
+    
+    // Single-table query on the denormalized gallery feed (maintained by python/gallery_feed.py)
     $sql = "
         SELECT 
-            i.id as image_id,
-            i.filename,
-            pp.prompt_text as prompt,
-            np.prompt_text as negative_prompt,
-            a.name as art_style,
-            t.title_text as title,
-            i.seed,
-            i.date_downloaded,
-            (SELECT GROUP_CONCAT(DISTINCT t2.name ORDER BY t2.name ASC SEPARATOR ',')
-             FROM image_tags it2
-             JOIN tags t2 ON it2.tag_id = t2.id
-             WHERE it2.image_id = i.id) as tags
-        FROM images i
-        LEFT JOIN prompt_combinations pc ON i.prompt_combination_id = pc.id
-        LEFT JOIN positive_prompts pp ON pc.positive_prompt_id = pp.id
-        LEFT JOIN negative_prompts np ON pc.negative_prompt_id = np.id
-        LEFT JOIN art_styles a ON i.art_style_id = a.id
-        LEFT JOIN titles t ON i.title_id = t.id
-        WHERE i.deleted = 0
+            f.image_id,
+            f.newest_first,
+            f.style_missing,
+            f.filename,
+            f.prompt,
+            f.negative_prompt,
+            f.art_style,
+            f.title,
+            f.seed,
+            f.date_downloaded,
+            f.tags
+        FROM gallery_feed f
+        WHERE 1 = 1
     ";
     
-    // Add search filtering if search term provided
+    // Search filter, shared by the main query and the prompt group query
+    $filterSql = '';
     if( $searchTerm !== '' ) {
         $searchEscaped = $db->real_escape_string( $searchTerm );
         
         if( $searchBy === 'tag' ) {
             // Tag search - uses EXISTS subquery to check image_tags junction table
-            $sql .= " AND EXISTS (
+            $filterSql .= " AND EXISTS (
                 SELECT 1 FROM image_tags it
                 JOIN tags tag ON it.tag_id = tag.id
-                WHERE it.image_id = i.id";
+                WHERE it.image_id = f.image_id";
             
             if( $wholeWords ) {
                 // Whole word matching using MySQL REGEXP word boundaries
-                $sql .= " AND tag.name REGEXP '[[:<:]]" . $searchEscaped . "[[:>:]]'";
+                $filterSql .= " AND tag.name REGEXP '[[:<:]]" . $searchEscaped . "[[:>:]]'";
             } else {
                 // Substring matching using LIKE
-                $sql .= " AND tag.name LIKE '%" . $searchEscaped . "%'";
+                $filterSql .= " AND tag.name LIKE '%" . $searchEscaped . "%'";
             }
             
-            $sql .= " )";
+            $filterSql .= " )";
         } else {
-            // Prompt search (default) - searches in positive prompt text
-            if( $wholeWords ) {
-                // Whole word matching using MySQL REGEXP word boundaries
-                $sql .= " AND pp.prompt_text REGEXP '[[:<:]]" . $searchEscaped . "[[:>:]]'";
-            } else {
-                // Substring matching using LIKE
-                $sql .= " AND pp.prompt_text LIKE '%" . $searchEscaped . "%'";
-            }
+            // Prompt search (default) - positive prompt text, narrowed through the word index
+            $filterSql .= " AND " . promptSearchCondition( $db, $searchTerm, $wholeWords );
         }
     }
+    $sql .= $filterSql;
+    
+    // Pagination: an explicit limit when searching, pages when browsing.
+    // A cursor seeks past the previous page through the sort index instead of skipping rows.
+    $pageSql = '';
+    $cursorSql = '';
+    if( !$browsing && $searchLimit !== null ) {
+        $pageSql = " LIMIT " . intval( $searchLimit );
+    } else if( $browsing && $cursor !== '' ) {
+        $sortKey = $sortKeys[$sortMode];
+        $cursorSql = " AND " . keysetCondition( $db, $sortKey, decodeCursor( $cursor, count( $sortKey ) ) );
+        $pageSql = " LIMIT " . intval( $limit );
+    } else if( $browsing ) {
+        $pageSql = " LIMIT " . intval( $limit ) . " OFFSET " . intval( $offset );
+    }
+    $next = null;
     
     // Apply sorting and pagination based on sort mode
     if( $sortMode === 'style' ) {
-        // Sort by art style name (NULL styles last)
-        $sql .= " GROUP BY i.id";
-        $sql .= " ORDER BY CASE WHEN a.name IS NULL THEN 1 ELSE 0 END, a.name ASC, i.id DESC";
-        
-        // Add pagination
-        if( $searchTerm !== '' && $searchLimit !== null ) {
-            // Searching with explicit limit
-            $sql .= " LIMIT " . intval( $searchLimit );
-        } else if( $searchTerm === '' ) {
-            // Normal browsing pagination
-            $sql .= " LIMIT " . intval( $limit ) . " OFFSET " . intval( $offset );
-        }
+        // Sort by art style name (NULL styles last), newest first within a style (idx_style)
+        $sql .= $cursorSql;
+        $sql .= " ORDER BY f.style_missing, f.art_style, f.newest_first";
+        $sql .= $pageSql;
         
     } else if( $sortMode === 'prompt' ) {
         // Sort by prompt text - groups images by prompt hash first to paginate groups
         // This prevents splitting images with the same prompt across pages
         
-        // First, get distinct prompt hashes for this page
+        // First, get distinct prompt hashes for this page (idx_prompt)
         $groupSql = "
-            SELECT pp.hash
-            FROM images i
-            JOIN prompt_combinations pc ON i.prompt_combination_id = pc.id
-            LEFT JOIN positive_prompts pp ON pc.positive_prompt_id = pp.id
-            WHERE i.deleted = 0
+            SELECT f.prompt_key, f.prompt_hash
+            FROM gallery_feed f
+            WHERE f.prompt_hash IS NOT NULL
         ";
-        
-        // Apply same search filters to group query
-        if( $searchTerm !== '' ) {
-            $searchEscaped = $db->real_escape_string( $searchTerm );
-            
-            if( $searchBy === 'tag' ) {
-                $groupSql .= " AND EXISTS (
-                    SELECT 1 FROM image_tags it
-                    JOIN tags tag ON it.tag_id = tag.id
-                    WHERE it.image_id = i.id";
-                
-                if( $wholeWords ) {
-                    $groupSql .= " AND tag.name REGEXP '[[:<:]]" . $searchEscaped . "[[:>:]]'";
-                } else {
-                    $groupSql .= " AND tag.name LIKE '%" . $searchEscaped . "%'";
-                }
-                
-                $groupSql .= " )";
-            } else {
-                if( $wholeWords ) {
-                    $groupSql .= " AND pp.prompt_text REGEXP '[[:<:]]" . $searchEscaped . "[[:>:]]'";
-                } else {
-                    $groupSql .= " AND pp.prompt_text LIKE '%" . $searchEscaped . "%'";
-                }
-            }
-        }
-        
-        $groupSql .= " GROUP BY pp.hash ORDER BY MIN(pp.prompt_text) ASC";
-        
-        // Paginate the groups
-        if( $searchTerm !== '' && $searchLimit !== null ) {
-            $groupSql .= " LIMIT " . intval( $searchLimit );
-        } else if( $searchTerm === '' ) {
-            $groupSql .= " LIMIT " . intval( $limit ) . " OFFSET " . intval( $offset );
-        }
+        $groupSql .= $filterSql;
+        $groupSql .= $cursorSql;
+        $groupSql .= " GROUP BY f.prompt_key, f.prompt_hash ORDER BY f.prompt_key, f.prompt_hash";
+        $groupSql .= $pageSql;
         
         $groupResult = $db->query( $groupSql );
         
@@ -157,33 +143,32 @@ try {
         
         // Collect prompt hashes from paginated groups
         $promptHashes = [];
+        $lastGroup = null;
         while( $row = $groupResult->fetch_assoc() ) {
-            $promptHashes[] = "'" . $db->real_escape_string( $row['hash'] ) . "'";
+            $promptHashes[] = "'" . $db->real_escape_string( $row['prompt_hash'] ) . "'";
+            $lastGroup = $row;
         }
         
         if( empty( $promptHashes ) ) {
             $db->close();
-            sendJsonResponse( [] );
+            sendJsonResponse( [ 'items' => [], 'next' => null ] );
+        }
+        
+        if( $browsing && count( $promptHashes ) === $limit ) {
+            $next = encodeCursor( [ $lastGroup['prompt_key'], $lastGroup['prompt_hash'] ] );
         }
         
-        // Now fetch all images matching these prompt hashes
-        $sql .= " AND pp.hash IN (" . implode( ',', $promptHashes ) . ")";
-        $sql .= " GROUP BY i.id";
-        $sql .= " ORDER BY pp.prompt_text ASC, i.id DESC";
+        // Now fetch all images matching these prompt hashes (idx_prompt_hash)
+        $sql .= " AND f.prompt_hash IN (" . implode( ',', $promptHashes ) . ")";
+        $sql .= " ORDER BY f.prompt_key, f.prompt_hash, f.newest_first";
         
         // No additional pagination - already limited by prompt groups
         
     } else {
-        // Default: most recent first (by image ID descending)
-        $sql .= " GROUP BY i.id";
-        $sql .= " ORDER BY i.id DESC";
-        
-        // Add pagination
-        if( $searchTerm !== '' && $searchLimit !== null ) {
-            $sql .= " LIMIT " . intval( $searchLimit );
-        } else if( $searchTerm === '' ) {
-            $sql .= " LIMIT " . intval( $limit ) . " OFFSET " . intval( $offset );
-        }
+        // Default: most recent first (primary key read backwards)
+        $sql .= $cursorSql;
+        $sql .= " ORDER BY f.image_id DESC";
+        $sql .= $pageSql;
     }
     
     // Execute main query
@@ -196,7 +181,10 @@ try {
     
     // Process results
     $data = [];
+    $lastRow = null;
     while( $row = $result->fetch_assoc() ) {
+        $lastRow = $row;
+        
         // Convert comma-separated tags string to array
         if( !empty( $row['tags'] ) ) {
             $row['tags'] = explode( ',', $row['tags'] );
@@ -204,14 +192,24 @@ try {
             $row['tags'] = [];
         }
         
-        // Remove internal image_id field (not needed in API response)
-        unset( $row['image_id'] );
+        // Remove internal sort fields (not needed in API response)
+        unset( $row['image_id'], $row['newest_first'], $row['style_missing'] );
+        
+        // Image URL relative to the web root (images may be stored in shard directories)
+        $row['src'] = '../images/medium/' . imageRelativePath( $row['filename'] );
         
         $data[] = $row;
     }
     
+    // A full page may be followed by more; the cursor is the sort key of its last row
+    if( $browsing && $sortMode !== 'prompt' && $lastRow !== null && count( $data ) === $limit ) {
+        $next = encodeCursor( $sortMode === 'style'
+            ? [ intval( $lastRow['style_missing'] ), $lastRow['art_style'], intval( $lastRow['newest_first'] ) ]
+            : [ intval( $lastRow['image_id'] ) ] );
+    }
+    
     $db->close();
-    sendJsonResponse( $data );
+    sendJsonResponse( [ 'items' => $data, 'next' => $next ] );
     
 } catch( Exception $e ) {
     error_log( "Error fetching gallery data: " . $e->getMessage() );
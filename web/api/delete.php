@@ -2,12 +2,15 @@
 /**
  * Delete Images API Endpoint
  * 
- * Marks images as deleted in the database and removes physical files.
+ * Marks images as deleted in the database, removes them from the gallery feed
+ * and the aggregate counters, and removes physical files.
  * Expects JSON input with 'filenames' array.
  * Token relationships are automatically cleaned up via CASCADE foreign keys.
  */
 
+require_once __DIR__ . '/utils/counts.php';
 require_once __DIR__ . '/utils/db_utils.php';
+require_once __DIR__ . '/utils/image_paths.php';
 
 // Get and validate POST data
 $data = json_decode( file_get_contents( 'php://input' ), true );
@@ -20,38 +23,65 @@ if( empty( $filenames ) ) {
 try {
     $db = getDbConnection();
     
-    // Delete physical image files from filesystem
+    // Delete physical image files (and thumbnails) from filesystem
     foreach( $filenames as $filename ) {
-        $imagePath = __DIR__ . '/../../images/medium/' . basename( $filename );
-        if( file_exists( $imagePath ) ) {
-            unlink( $imagePath );
+        foreach( [ IMAGE_ROOT, THUMB_ROOT ] as $root ) {
+            $imagePath = imagePath( $filename, $root );
+            if( file_exists( $imagePath ) ) {
+                unlink( $imagePath );
+            }
         }
     }
     
+    $placeholders = implode( ',', array_fill( 0, count( $filenames ), '?' ) );
+    $types = str_repeat( 's', count( $filenames ) );
+    
+    // IDs of the images, to subtract them from the aggregate counters
+    $stmt = $db->prepare( "SELECT id FROM images WHERE filename IN ($placeholders)" );
+    $stmt->bind_param( $types, ...$filenames );
+    $stmt->execute();
+    $result = $stmt->get_result();
+    $imageIds = [];
+    while( $row = $result->fetch_assoc() ) {
+        $imageIds[] = $row['id'];
+    }
+    $stmt->close();
+    
+    // Counters, flag and feed change in one transaction
+    $db->begin_transaction();
+    adjustImageCounts( $db, $imageIds, -1 );
+    
     // Mark images as deleted and nullify all metadata columns in database
     // This preserves the record while removing all associated data
-    $placeholders = implode( ',', array_fill( 0, count( $filenames ), '?' ) );
     $stmt = $db->prepare( "UPDATE images SET deleted = 1, prompt_combination_id = NULL, art_style_id = NULL, title_id = NULL, seed = NULL, date_downloaded = NULL, tags = NULL WHERE filename IN ($placeholders)" );
     
     if( !$stmt ) {
+        $db->rollback();
         $db->close();
         sendErrorResponse( 'Failed to prepare delete statement: ' . $db->error, 500 );
     }
     
     // Bind parameters dynamically (all strings)
-    $types = str_repeat( 's', count( $filenames ) );
     $stmt->bind_param( $types, ...$filenames );
     
     if( !$stmt->execute() ) {
         $stmt->close();
+        $db->rollback();
         $db->close();
         sendErrorResponse( 'Failed to mark images as deleted: ' . $stmt->error, 500 );
     }
     
     $stmt->close();
+    
+    // Remove the images from the gallery feed
+    $stmt = $db->prepare( "DELETE f FROM gallery_feed f JOIN images i ON i.id = f.image_id WHERE i.filename IN ($placeholders)" );
+    $stmt->bind_param( $types, ...$filenames );
+    $stmt->execute();
+    $stmt->close();
+    $db->commit();
     $db->close();
     
-    // Update cache asynchronously (fast MAX queries)
+    // Rewrite the counts cache if the stored counts changed
     updateTableCountsCache();
     
     sendJsonResponse( [
@@ -60,6 +90,10 @@ try {
     ] );
     
 } catch( Exception $e ) {
+    if( isset( $db ) ) {
+        $db->rollback();
+        $db->close();
+    }
     error_log( "Error deleting images: " . $e->getMessage() );
     sendErrorResponse( 'Failed to delete images: ' . $e->getMessage(), 500 );
 }
@@ -3,10 +3,11 @@
  * Table Counts API Endpoint
  * 
  * Returns cached table row counts from JSON file.
- * The cache is updated by update_table_counts.py and by various API endpoints
- * after data modifications (using MAX(id) for instant queries).
+ * The cache is written by update_table_counts.py and by various API endpoints
+ * after data modifications, from the exact counts kept in table_counts, and
+ * only when their generation changed.
  * 
- * Response format: {"art-styles": 80, "positive-prompts": 73151, ...}
+ * Response format: {"art-styles": 80, "positive-prompts": 73151, ..., "images": 120034, "generation": 5123}
  */
 
 require_once __DIR__ . '/utils/db_utils.php';
@@ -8,17 +8,28 @@
  * Query Parameters:
  * - table: Table name to query (required)
  * - limit: Number of records per page (default: 200)
- * - offset: Starting record number (default: 0)
+ * - cursor: Continue after the page that returned this 'next' cursor (optional)
+ * - offset: Starting record number, for jumping to a page without a cursor (default: 0)
  * - sort: Column to sort by (default: image_count)
  * - order: Sort direction ASC or DESC (default: DESC)
+ * 
+ * Response: { items: [...], next: cursor of the following page, or null on the last page }
+ * 
+ * Rows are ordered by the sort column, then by ID. A cursor holds both values of
+ * the last row shown, and the next page starts after that row instead of
+ * skipping OFFSET rows. Counts are read from the counter tables (see
+ * python/aggregate_counts.py); entities that nothing refers to are listed
+ * once the reconcile job has given them a zero row.
  */
 
+require_once __DIR__ . '/utils/cursor.php';
 require_once __DIR__ . '/utils/db_utils.php';
 
 // Get and validate query parameters
 $table = $_GET['table'] ?? '';
 $limit = intval( $_GET['limit'] ?? 200 );
 $offset = intval( $_GET['offset'] ?? 0 );
+$cursor = $_GET['cursor'] ?? '';
 $sort = $_GET['sort'] ?? 'image_count';
 $order = strtoupper( $_GET['order'] ?? 'DESC' );
 
@@ -31,218 +42,180 @@ if( empty( $table ) ) {
     sendErrorResponse( 'No table specified' );
 }
 
-try {
-    $db = getDbConnection();
-    $data = [];
-    
-    // Map sort column names to actual SQL columns for each table type
-    // This prevents SQL injection and ensures valid sorting
-    $sortColumnMap = [
-        'art-styles' => [
-            'id' => 'ast.id',
+// Query of each table type. Counts come from the counter tables maintained by
+// python/aggregate_counts.py, whose (count, id) indexes serve the count sorts.
+// 'columns' maps the sortable columns to SQL; this prevents SQL injection and
+// ensures valid sorting.
+$tableQueries = [
+    'art-styles' => [
+        // Art Styles: ID, Style String, Image Count (non-deleted images)
+        'select' => "
+            c.art_style_id AS id,
+            ast.style_string,
+            c.image_count
+        ",
+        'from' => "
+            art_style_counts c
+            JOIN art_styles ast ON ast.id = c.art_style_id
+        ",
+        'id' => 'c.art_style_id',
+        'where' => [],
+        'columns' => [
+            'id' => 'c.art_style_id',
             'style_string' => 'ast.style_string',
-            'image_count' => 'image_count'
+            'image_count' => 'c.image_count'
         ],
-        'positive-prompts' => [
-            'id' => 'pp.id',
+        'counts' => [ 'image_count' ]
+    ],
+    'positive-prompts' => [
+        // Positive Prompts: ID, Text, Combinations Count, Image Count
+        'select' => "
+            c.positive_prompt_id AS id,
+            pp.prompt_text,
+            c.combinations_count,
+            c.image_count
+        ",
+        'from' => "
+            positive_prompt_counts c
+            JOIN positive_prompts pp ON pp.id = c.positive_prompt_id
+        ",
+        'id' => 'c.positive_prompt_id',
+        'where' => [],
+        'columns' => [
+            'id' => 'c.positive_prompt_id',
             'prompt_text' => 'pp.prompt_text',
-            'combinations_count' => 'combinations_count',
-            'image_count' => 'image_count'
+            'combinations_count' => 'c.combinations_count',
+            'image_count' => 'c.image_count'
         ],
-        'negative-prompts' => [
-            'id' => 'np.id',
+        'counts' => [ 'combinations_count', 'image_count' ]
+    ],
+    'negative-prompts' => [
+        // Negative Prompts: ID, Text, Combinations Count, Image Count
+        'select' => "
+            c.negative_prompt_id AS id,
+            np.prompt_text,
+            c.combinations_count,
+            c.image_count
+        ",
+        'from' => "
+            negative_prompt_counts c
+            JOIN negative_prompts np ON np.id = c.negative_prompt_id
+        ",
+        'id' => 'c.negative_prompt_id',
+        'where' => [],
+        'columns' => [
+            'id' => 'c.negative_prompt_id',
             'prompt_text' => 'np.prompt_text',
-            'combinations_count' => 'combinations_count',
-            'image_count' => 'image_count'
+            'combinations_count' => 'c.combinations_count',
+            'image_count' => 'c.image_count'
         ],
-        'tags' => [
-            'id' => 't.id',
+        'counts' => [ 'combinations_count', 'image_count' ]
+    ],
+    'tags' => [
+        // Tags: ID, Tag Name, Image Count (non-deleted images)
+        'select' => "
+            c.tag_id AS id,
+            t.name,
+            c.image_count
+        ",
+        'from' => "
+            tag_counts c
+            JOIN tags t ON t.id = c.tag_id
+        ",
+        'id' => 'c.tag_id',
+        'where' => [],
+        'columns' => [
+            'id' => 'c.tag_id',
             'name' => 't.name',
-            'image_count' => 'image_count'
+            'image_count' => 'c.image_count'
         ],
-        'tokens' => [
-            'id' => 't.id',
+        'counts' => [ 'image_count' ]
+    ],
+    'tokens' => [
+        // Tokens: ID, Token Text, Positive Prompt Count, Negative Prompt Count
+        // Only includes tokens that appear in at least one prompt
+        'select' => "
+            c.token_id AS id,
+            t.token,
+            c.positive_count,
+            c.negative_count
+        ",
+        'from' => "
+            token_counts c
+            JOIN tokens t ON t.id = c.token_id
+        ",
+        'id' => 'c.token_id',
+        'where' => [ '(c.positive_count > 0 OR c.negative_count > 0)' ],
+        'columns' => [
+            'id' => 'c.token_id',
             'token' => 't.token',
-            'positive_count' => 'positive_count',
-            'negative_count' => 'negative_count'
-        ]
-    ];
+            'positive_count' => 'c.positive_count',
+            'negative_count' => 'c.negative_count'
+        ],
+        'counts' => [ 'positive_count', 'negative_count' ]
+    ]
+];
+
+try {
+    $db = getDbConnection();
+    $data = [];
+    
+    if( !isset( $tableQueries[$table] ) ) {
+        $db->close();
+        sendErrorResponse( 'Invalid table specified', 400 );
+    }
+    $query = $tableQueries[$table];
     
     // Validate and get sort column
-    $sortColumn = 'image_count'; // Default fallback
-    if( isset( $sortColumnMap[$table][$sort] ) ) {
-        $sortColumn = $sortColumnMap[$table][$sort];
+    if( !isset( $query['columns'][$sort] ) ) {
+        $sort = isset( $query['columns']['image_count'] ) ? 'image_count' : 'id'; // Default fallback
     }
+    $sortColumn = $query['columns'][$sort];
     
-    // Query appropriate table based on selection
-    switch( $table ) {
-        case 'art-styles':
-            // Art Styles: ID, Style String, Image Count (non-deleted images)
-            $sql = "
-                SELECT 
-                    ast.id,
-                    ast.style_string,
-                    COUNT(DISTINCT i.id) as image_count
-                FROM art_styles ast
-                LEFT JOIN images i ON i.art_style_id = ast.id AND i.deleted = 0
-                GROUP BY ast.id
-                ORDER BY $sortColumn $order, ast.id ASC
-                LIMIT ? OFFSET ?
-            ";
-            
-            $stmt = $db->prepare( $sql );
-            $stmt->bind_param( 'ii', $limit, $offset );
-            $stmt->execute();
-            $result = $stmt->get_result();
-            
-            while( $row = $result->fetch_assoc() ) {
-                $data[] = [
-                    'id' => $row['id'],
-                    'style_string' => $row['style_string'],
-                    'image_count' => intval( $row['image_count'] )
-                ];
-            }
-            $stmt->close();
-            break;
-
-        case 'positive-prompts':
-            // Positive Prompts: ID, Text, Combinations Count, Image Count
-            $sql = "
-                SELECT 
-                    pp.id,
-                    pp.prompt_text,
-                    COUNT(DISTINCT pc.id) as combinations_count,
-                    COUNT(DISTINCT i.id) as image_count
-                FROM positive_prompts pp
-                LEFT JOIN prompt_combinations pc ON pc.positive_prompt_id = pp.id
-                LEFT JOIN images i ON i.prompt_combination_id = pc.id AND i.deleted = 0
-                GROUP BY pp.id
-                ORDER BY $sortColumn $order, pp.id ASC
-                LIMIT ? OFFSET ?
-            ";
-            
-            $stmt = $db->prepare( $sql );
-            $stmt->bind_param( 'ii', $limit, $offset );
-            $stmt->execute();
-            $result = $stmt->get_result();
-            
-            while( $row = $result->fetch_assoc() ) {
-                $data[] = [
-                    'id' => $row['id'],
-                    'prompt_text' => $row['prompt_text'],
-                    'combinations_count' => intval( $row['combinations_count'] ),
-                    'image_count' => intval( $row['image_count'] )
-                ];
-            }
-            $stmt->close();
-            break;
-
-        case 'negative-prompts':
-            // Negative Prompts: ID, Text, Combinations Count, Image Count
-            $sql = "
-                SELECT 
-                    np.id,
-                    np.prompt_text,
-                    COUNT(DISTINCT pc.id) as combinations_count,
-                    COUNT(DISTINCT i.id) as image_count
-                FROM negative_prompts np
-                LEFT JOIN prompt_combinations pc ON pc.negative_prompt_id = np.id
-                LEFT JOIN images i ON i.prompt_combination_id = pc.id AND i.deleted = 0
-                GROUP BY np.id
-                ORDER BY $sortColumn $order, np.id ASC
-                LIMIT ? OFFSET ?
-            ";
-            
-            $stmt = $db->prepare( $sql );
-            $stmt->bind_param( 'ii', $limit, $offset );
-            $stmt->execute();
-            $result = $stmt->get_result();
-            
-            while( $row = $result->fetch_assoc() ) {
-                $data[] = [
-                    'id' => $row['id'],
-                    'prompt_text' => $row['prompt_text'],
-                    'combinations_count' => intval( $row['combinations_count'] ),
-                    'image_count' => intval( $row['image_count'] )
-                ];
-            }
-            $stmt->close();
-            break;
-
-        case 'tags':
-            // Tags: ID, Tag Name, Image Count (counts images via junction table)
-            $sql = "
-                SELECT 
-                    t.id,
-                    t.name,
-                    COUNT(DISTINCT it.image_id) as image_count
-                FROM tags t
-                LEFT JOIN image_tags it ON it.tag_id = t.id
-                LEFT JOIN images i ON i.id = it.image_id AND i.deleted = 0
-                GROUP BY t.id
-                ORDER BY $sortColumn $order, t.id ASC
-                LIMIT ? OFFSET ?
-            ";
-            
-            $stmt = $db->prepare( $sql );
-            $stmt->bind_param( 'ii', $limit, $offset );
-            $stmt->execute();
-            $result = $stmt->get_result();
-            
-            while( $row = $result->fetch_assoc() ) {
-                $data[] = [
-                    'id' => $row['id'],
-                    'name' => $row['name'],
-                    'image_count' => intval( $row['image_count'] )
-                ];
-            }
-            $stmt->close();
-            break;
-
-        case 'tokens':
-            // Tokens: ID, Token Text, Positive Prompt Count, Negative Prompt Count
-            // Only includes tokens that appear in at least one prompt
-            $sql = "
-                SELECT 
-                    t.id,
-                    t.token,
-                    COUNT(DISTINCT ppt.positive_prompt_id) as positive_count,
-                    COUNT(DISTINCT npt.negative_prompt_id) as negative_count
-                FROM tokens t
-                LEFT JOIN positive_prompt_tokens ppt ON ppt.token_id = t.id
-                LEFT JOIN negative_prompt_tokens npt ON npt.token_id = t.id
-                GROUP BY t.id
-                HAVING positive_count > 0 OR negative_count > 0
-                ORDER BY $sortColumn $order, t.id ASC
-                LIMIT ? OFFSET ?
-            ";
-            
-            $stmt = $db->prepare( $sql );
-            $stmt->bind_param( 'ii', $limit, $offset );
-            $stmt->execute();
-            $result = $stmt->get_result();
-            
-            while( $row = $result->fetch_assoc() ) {
-                $data[] = [
-                    'id' => $row['id'],
-                    'token' => $row['token'],
-                    'positive_count' => intval( $row['positive_count'] ),
-                    'negative_count' => intval( $row['negative_count'] )
-                ];
-            }
-            $stmt->close();
-            break;
-
-        default:
-            $db->close();
-            sendErrorResponse( 'Invalid table specified', 400 );
+    // Ties are broken by ID in the same direction, so a count sort reads its (count, id) index in one direction
+    $sortKey = [ [ $sortColumn, $order ], [ $query['id'], $order ] ];
+    
+    // Seek past the previous page
+    $where = $query['where'];
+    $pageSql = "LIMIT " . intval( $limit ) . " OFFSET " . intval( $offset );
+    if( $cursor !== '' ) {
+        $where[] = keysetCondition( $db, $sortKey, decodeCursor( $cursor, count( $sortKey ) ) );
+        $pageSql = "LIMIT " . intval( $limit );
+    }
+    
+    $sql = "SELECT " . $query['select'] . " FROM " . $query['from'];
+    if( !empty( $where ) ) {
+        $sql .= " WHERE " . implode( ' AND ', $where );
+    }
+    $sql .= " ORDER BY $sortColumn $order, " . $query['id'] . " $order ";
+    $sql .= $pageSql;
+    
+    $result = $db->query( $sql );
+    
+    if( !$result ) {
+        $db->close();
+        sendErrorResponse( 'Failed to fetch table data: ' . $db->error, 500 );
+    }
+    
+    while( $row = $result->fetch_assoc() ) {
+        $row['id'] = intval( $row['id'] );
+        foreach( $query['counts'] as $count ) {
+            $row[$count] = intval( $row[$count] );
+        }
+        $data[] = $row;
+    }
+    
+    // A full page may be followed by more; the cursor is the sort value and ID of its last row
+    $next = null;
+    if( count( $data ) === $limit && $limit > 0 ) {
+        $last = end( $data );
+        $next = encodeCursor( [ $last[$sort], $last['id'] ] );
     }
     
     $db->close();
-    sendJsonResponse( $data );
+    sendJsonResponse( [ 'items' => $data, 'next' => $next ] );
     
 } catch( Exception $e ) {
     error_log( "Error fetching table data: " . $e->getMessage() );
     sendErrorResponse( 'Failed to fetch table data: ' . $e->getMessage(), 500 );
 }
-
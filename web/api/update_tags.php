@@ -6,6 +6,7 @@
  * Expects JSON input with 'filename' and 'tags' (comma-separated string).
  */
 
+require_once __DIR__ . '/utils/counts.php';
 require_once __DIR__ . '/utils/db_utils.php';
 
 // Get and validate POST data
@@ -63,7 +64,8 @@ try {
     // Start transaction for atomic update
     $db->begin_transaction();
     
-    // Delete existing tags for all affected images
+    // Subtract the old tags from the tag counters, then delete them for all affected images
+    adjustTagCounts( $db, $imageIds, -1 );
     $placeholders = implode( ',', array_fill( 0, count( $imageIds ), '?' ) );
     $stmt = $db->prepare( "DELETE FROM image_tags WHERE image_id IN ($placeholders)" );
     $stmt->bind_param( str_repeat( 'i', count( $imageIds ) ), ...$imageIds );
@@ -83,10 +85,14 @@ try {
         }
     }
     
+    // Count the new tags, and keep the pre-joined tags of the gallery feed in step
+    adjustTagCounts( $db, $imageIds, 1 );
+    refreshFeedTags( $db, $imageIds );
+    
     $db->commit();
     $db->close();
     
-    // Update cache asynchronously (fast MAX queries)
+    // Rewrite the counts cache if the stored counts changed
     updateTableCountsCache();
     
     sendJsonResponse( [
@@ -0,0 +1,119 @@
+<?php
+/**
+ * Aggregate Counter Utilities
+ *
+ * Keeps the stored counters of the tables view (art_style_counts,
+ * positive_prompt_counts, negative_prompt_counts, tag_counts; see
+ * python/aggregate_counts.py) in step with deletes and tag edits. Each update
+ * adds the counts of the affected rows as a delta, inside the caller's
+ * transaction. The queries must stay in sync with COUNTERS in aggregate_counts.py.
+ */
+
+require_once __DIR__ . '/db_utils.php';
+
+/**
+ * Get the counters that follow an image's live state
+ *
+ * @return array [ table, key column, count column, query ] with {value} and {condition} placeholders
+ */
+function imageCounterQueries() {
+    return [
+        [ 'art_style_counts', 'art_style_id', 'image_count', "
+            SELECT i.art_style_id, {value} FROM images i
+            WHERE i.deleted = 0 AND i.art_style_id IS NOT NULL AND {condition}
+            GROUP BY i.art_style_id
+        " ],
+        [ 'positive_prompt_counts', 'positive_prompt_id', 'image_count', "
+            SELECT pc.positive_prompt_id, {value} FROM images i
+            JOIN prompt_combinations pc ON pc.id = i.prompt_combination_id
+            WHERE i.deleted = 0 AND pc.positive_prompt_id IS NOT NULL AND {condition}
+            GROUP BY pc.positive_prompt_id
+        " ],
+        [ 'negative_prompt_counts', 'negative_prompt_id', 'image_count', "
+            SELECT pc.negative_prompt_id, {value} FROM images i
+            JOIN prompt_combinations pc ON pc.id = i.prompt_combination_id
+            WHERE i.deleted = 0 AND pc.negative_prompt_id IS NOT NULL AND {condition}
+            GROUP BY pc.negative_prompt_id
+        " ],
+        tagCounterQuery()
+    ];
+}
+
+/**
+ * Get the tag counter (live images per tag)
+ *
+ * @return array [ table, key column, count column, query ]
+ */
+function tagCounterQuery() {
+    return [ 'tag_counts', 'tag_id', 'image_count', "
+        SELECT it.tag_id, {value} FROM image_tags it
+        JOIN images i ON i.id = it.image_id
+        WHERE i.deleted = 0 AND {condition}
+        GROUP BY it.tag_id
+    " ];
+}
+
+/**
+ * Add sign times the counts of the rows matching a condition to a counter
+ *
+ * @param mysqli $db Database connection
+ * @param array $counter Counter from imageCounterQueries() or tagCounterQuery()
+ * @param string $condition SQL condition selecting the rows
+ * @param int $sign 1 to add, -1 to subtract
+ * @throws Exception if the update fails
+ */
+function addCounts( $db, $counter, $condition, $sign ) {
+    list( $table, $key, $column, $query ) = $counter;
+    $select = str_replace( [ '{value}', '{condition}' ], [ intval( $sign ) . ' * COUNT(*)', $condition ], $query );
+    $sql = "INSERT INTO $table ($key, $column) $select ON DUPLICATE KEY UPDATE $column = $table.$column + VALUES($column)";
+
+    if( !$db->query( $sql ) ) {
+        throw new Exception( "Failed to update $table: " . $db->error );
+    }
+}
+
+/**
+ * Count live images into or out of the style, prompt and tag counters
+ *
+ * Call with -1 before marking images deleted. Deleted images are never
+ * counted, so subtracting them twice has no effect. The live images are also
+ * added to the 'images' row count of table_counts.
+ *
+ * @param mysqli $db Database connection
+ * @param array $imageIds Image IDs
+ * @param int $sign 1 to add, -1 to subtract
+ */
+function adjustImageCounts( $db, $imageIds, $sign ) {
+    if( empty( $imageIds ) ) {
+        return;
+    }
+
+    $condition = "i.id IN (" . implode( ',', array_map( 'intval', $imageIds ) ) . ")";
+    foreach( imageCounterQueries() as $counter ) {
+        addCounts( $db, $counter, $condition, $sign );
+    }
+    
+    $result = $db->query( "SELECT COUNT(*) AS live FROM images i WHERE i.deleted = 0 AND $condition" );
+    if( !$result ) {
+        throw new Exception( "Failed to count live images: " . $db->error );
+    }
+    addTableRows( $db, 'images', intval( $sign ) * (int)$result->fetch_assoc()['live'] );
+}
+
+/**
+ * Count the current tag links of live images into or out of tag_counts
+ *
+ * Call with -1 before removing an image's tags and with 1 after adding them.
+ *
+ * @param mysqli $db Database connection
+ * @param array $imageIds Image IDs
+ * @param int $sign 1 to add, -1 to subtract
+ */
+function adjustTagCounts( $db, $imageIds, $sign ) {
+    if( empty( $imageIds ) ) {
+        return;
+    }
+
+    $condition = "it.image_id IN (" . implode( ',', array_map( 'intval', $imageIds ) ) . ")";
+    addCounts( $db, tagCounterQuery(), $condition, $sign );
+}
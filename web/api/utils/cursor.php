@@ -0,0 +1,91 @@
+<?php
+/**
+ * Keyset Pagination Utilities
+ *
+ * Pages continue from an opaque cursor instead of an OFFSET. The cursor holds the
+ * sort values of the last row shown (ending with its unique ID), and the next
+ * page is read with a WHERE condition that seeks past that row through the sort
+ * index, so a deep page costs the same as the first one. A cursor is the
+ * base64url-encoded JSON array of those values.
+ */
+
+require_once __DIR__ . '/db_utils.php';
+
+/**
+ * Encode the sort values of the last row of a page as a cursor
+ *
+ * @param array $values Sort values in ORDER BY order
+ * @return string Opaque cursor
+ */
+function encodeCursor( $values ) {
+    return rtrim( strtr( base64_encode( json_encode( array_values( $values ) ) ), '+/', '-_' ), '=' );
+}
+
+/**
+ * Decode a cursor, sending a 400 error if it is malformed
+ *
+ * @param string $cursor Cursor from encodeCursor()
+ * @param int $count Number of sort values expected
+ * @return array Sort values in ORDER BY order
+ */
+function decodeCursor( $cursor, $count ) {
+    $values = json_decode( base64_decode( strtr( $cursor, '-_', '+/' ) ), true );
+
+    if( !is_array( $values ) || count( $values ) !== $count ) {
+        sendErrorResponse( 'Invalid cursor' );
+    }
+    foreach( $values as $value ) {
+        if( $value !== null && !is_scalar( $value ) ) {
+            sendErrorResponse( 'Invalid cursor' );
+        }
+    }
+    return array_values( $values );
+}
+
+/**
+ * Format a cursor value as an SQL literal
+ *
+ * @param mysqli $db Database connection (for escaping)
+ * @param mixed $value Integer, float or string
+ * @return string SQL literal
+ */
+function cursorLiteral( $db, $value ) {
+    if( is_int( $value ) || is_float( $value ) ) {
+        return (string)$value;
+    }
+    return "'" . $db->real_escape_string( (string)$value ) . "'";
+}
+
+/**
+ * Build the condition selecting the rows that come after a cursor
+ *
+ * Expands (a, b, c) > (x, y, z) into nested comparisons, which MySQL and
+ * MariaDB both turn into an index range. Follows MySQL's ordering of NULLs
+ * (first when ascending, last when descending).
+ *
+ * @param mysqli $db Database connection (for escaping)
+ * @param array $columns Sort columns as [ expression, 'ASC' or 'DESC' ] pairs in ORDER BY order
+ * @param array $values Sort values of the last row (from decodeCursor())
+ * @return string SQL condition
+ */
+function keysetCondition( $db, $columns, $values ) {
+    $condition = null;
+
+    for( $i = count( $columns ) - 1; $i >= 0; $i-- ) {
+        list( $column, $direction ) = $columns[$i];
+        $value = $values[$i];
+
+        if( $value === null ) {
+            $after = $direction === 'ASC' ? "$column IS NOT NULL" : "0 = 1";
+            $equal = "$column IS NULL";
+        } else {
+            $literal = cursorLiteral( $db, $value );
+            $after = $direction === 'ASC' ? "$column > $literal" : "($column < $literal OR $column IS NULL)";
+            $equal = "$column = $literal";
+        }
+
+        $condition = $condition === null ? $after : "($after OR ($equal AND $condition))";
+    }
+
+    return $condition;
+}
@@ -24,10 +24,37 @@ function getDbConnection() {
 }
 
 /**
- * Update the table counts cache using fast MAX(id) queries
+ * Add rows to a table's count in table_counts and bump its generation
  * 
- * This function is called after operations that modify table data
- * (deletions, tag updates, etc.) to keep the cached counts current.
+ * Called inside the transaction that inserts or deletes the rows, so the
+ * counts read by updateTableCountsCache() stay exact (see
+ * python/aggregate_counts.py).
+ * 
+ * @param mysqli $db Database connection
+ * @param string $name Count name ('tags', 'images', ...)
+ * @param int $delta Rows added (negative when removed)
+ * @throws Exception if the update fails
+ */
+function addTableRows( $db, $name, $delta ) {
+    if( $delta == 0 ) {
+        return;
+    }
+    
+    $stmt = $db->prepare( "INSERT INTO table_counts (name, row_count, generation) VALUES (?, ?, 1) ON DUPLICATE KEY UPDATE row_count = row_count + VALUES(row_count), generation = generation + 1" );
+    $stmt->bind_param( 'si', $name, $delta );
+    if( !$stmt->execute() ) {
+        throw new Exception( "Failed to update table_counts: " . $stmt->error );
+    }
+    $stmt->close();
+}
+
+/**
+ * Update the table counts cache from the stored row counts
+ * 
+ * Reads the few table_counts rows (as cheap as the MAX(id) queries used
+ * before, but exact) and rewrites table_counts.json only when the sum of
+ * their generations differs from the one in the file. The file is written to
+ * a temporary name and renamed, so readers never see a partial file.
  * 
  * @return bool True on success, false on failure
  */
@@ -36,26 +63,34 @@ function updateTableCountsCache() {
     
     try {
         $db = getDbConnection();
-        $counts = [];
+        $result = $db->query( "SELECT name, row_count, generation FROM table_counts" );
+        if( !$result ) {
+            throw new Exception( $db->error );
+        }
         
-        // Use MAX(id) for instant counts (works because we have no gaps except in tags)
-        $tables = [
-            'art-styles' => 'art_styles',
-            'positive-prompts' => 'positive_prompts',
-            'negative-prompts' => 'negative_prompts',
-            'tags' => 'tags',
-            'tokens' => 'tokens'
-        ];
+        $counts = [];
+        $generation = 0;
+        while( $row = $result->fetch_assoc() ) {
+            $counts[$row['name']] = (int)$row['row_count'];
+            $generation += (int)$row['generation'];
+        }
+        $db->close();
         
-        foreach( $tables as $key => $table ) {
-            $result = $db->query( "SELECT MAX(id) as count FROM $table" );
-            $counts[$key] = (int)($result->fetch_assoc()['count'] ?? 0);
+        // Never counted yet: leave the file to python/update_table_counts.py
+        if( empty( $counts ) ) {
+            return false;
         }
         
-        $db->close();
+        $cached = file_exists( $cacheFile ) ? json_decode( file_get_contents( $cacheFile ), true ) : null;
+        if( is_array( $cached ) && ( $cached['generation'] ?? null ) === $generation ) {
+            return true;
+        }
         
-        // Write to cache file with pretty formatting
-        file_put_contents( $cacheFile, json_encode( $counts, JSON_PRETTY_PRINT ) );
+        $counts['generation'] = $generation;
+        $tempFile = $cacheFile . '.' . getmypid() . '.tmp';
+        if( file_put_contents( $tempFile, json_encode( $counts, JSON_PRETTY_PRINT ) ) === false || !rename( $tempFile, $cacheFile ) ) {
+            throw new Exception( "Could not write $cacheFile" );
+        }
         
         return true;
         
@@ -90,7 +125,39 @@ function getOrCreateTag( $db, $tagName ) {
     $stmt = $db->prepare( "INSERT INTO tags (name) VALUES (?)" );
     $stmt->bind_param( 's', $tagName );
     $stmt->execute();
-    return $db->insert_id;
+    $tagId = $db->insert_id;
+    addTableRows( $db, 'tags', 1 );
+    return $tagId;
+}
+
+/**
+ * Rewrite the tag strings of images in the gallery feed
+ * 
+ * The feed (see python/gallery_feed.py) holds each image's tags pre-joined,
+ * so it has to be refreshed whenever image_tags changes.
+ * 
+ * @param mysqli $db Database connection
+ * @param array $imageIds IDs of the images whose tags changed
+ */
+function refreshFeedTags( $db, $imageIds ) {
+    if( empty( $imageIds ) ) {
+        return;
+    }
+    
+    $placeholders = implode( ',', array_fill( 0, count( $imageIds ), '?' ) );
+    $stmt = $db->prepare( "
+        UPDATE gallery_feed f
+        SET f.tags = (
+            SELECT GROUP_CONCAT(DISTINCT t.name ORDER BY t.name ASC SEPARATOR ',')
+            FROM image_tags it
+            JOIN tags t ON it.tag_id = t.id
+            WHERE it.image_id = f.image_id
+        )
+        WHERE f.image_id IN ($placeholders)
+    " );
+    $stmt->bind_param( str_repeat( 'i', count( $imageIds ) ), ...$imageIds );
+    $stmt->execute();
+    $stmt->close();
 }
 
 /**
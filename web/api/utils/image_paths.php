@@ -0,0 +1,78 @@
+<?php
+/**
+ * Image Path Utilities
+ *
+ * Resolves image filenames to their paths under an image root, following the
+ * layout recorded in the root's layout.json (written by python/image_layout.py):
+ * flat (medium/<name>.jpg) or sharded by the MD5 of the filename
+ * (medium/ab/cd/<name>.jpg). Must stay in sync with shard_path() in image_layout.py.
+ */
+
+define( 'IMAGE_ROOT', __DIR__ . '/../../../images/medium' );
+define( 'THUMB_ROOT', __DIR__ . '/../../../images/thumbs' );
+
+/**
+ * Read the layout of an image root (cached per request)
+ *
+ * @param string $root Image root directory
+ * @return array Layout with 'mode' ('flat', 'sharded' or 'migrating'), 'depth' and 'width'
+ */
+function imageLayout( $root = IMAGE_ROOT ) {
+    static $layouts = [];
+
+    if( !isset( $layouts[$root] ) ) {
+        $layout = [ 'mode' => 'flat', 'depth' => 2, 'width' => 2 ];
+        $layoutFile = $root . '/layout.json';
+        if( file_exists( $layoutFile ) ) {
+            $stored = json_decode( file_get_contents( $layoutFile ), true );
+            if( is_array( $stored ) ) {
+                $layout = array_merge( $layout, $stored );
+            }
+        }
+        $layouts[$root] = $layout;
+    }
+
+    return $layouts[$root];
+}
+
+/**
+ * Get the path of an image relative to its image root
+ *
+ * While a migration is running, images that have not been moved yet are
+ * still found at their flat path.
+ *
+ * @param string $filename Image filename
+ * @param string $root Image root directory
+ * @return string Relative path such as "ab/cd/<filename>"
+ */
+function imageRelativePath( $filename, $root = IMAGE_ROOT ) {
+    $filename = basename( $filename );
+    $layout = imageLayout( $root );
+    if( $layout['mode'] === 'flat' ) {
+        return $filename;
+    }
+
+    $digest = md5( $filename );
+    $parts = [];
+    for( $level = 0; $level < $layout['depth']; $level++ ) {
+        $parts[] = substr( $digest, $level * $layout['width'], $layout['width'] );
+    }
+    $parts[] = $filename;
+    $relative = implode( '/', $parts );
+
+    if( $layout['mode'] === 'migrating' && !file_exists( $root . '/' . $relative ) ) {
+        return $filename;
+    }
+    return $relative;
+}
+
+/**
+ * Get the filesystem path of an image
+ *
+ * @param string $filename Image filename
+ * @param string $root Image root directory
+ * @return string Absolute path under the image root
+ */
+function imagePath( $filename, $root = IMAGE_ROOT ) {
+    return $root . '/' . imageRelativePath( $filename, $root );
+}
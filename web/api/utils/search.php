@@ -0,0 +1,86 @@
+<?php
+/**
+ * Prompt Search Utilities
+ *
+ * Builds the SQL condition of a prompt search on gallery_feed from the word
+ * index maintained by python/search_index.py (words -> prompt_words), so a
+ * search reads index entries instead of scanning every prompt. The index only
+ * narrows the candidates; the original LIKE / REGEXP on the prompt text decides.
+ * Prompts above search_index_progress.last_prompt_id (scraped since the index
+ * was last updated) are matched on their text instead, so new images are found
+ * before the index catches up. Must stay in sync with search_condition() in
+ * search_index.py, whose docstring lists where results can still differ from
+ * a plain scan.
+ */
+
+define( 'SEARCH_WORD_MAX_LENGTH', 100 );
+define( 'SEARCH_MIN_SUBSTRING_PIECE', 3 );
+
+/**
+ * Get the words of a search term that the word index can look up
+ *
+ * @param string $term Search term
+ * @param bool $wholeWords Whole word matching (substring pieces need SEARCH_MIN_SUBSTRING_PIECE characters)
+ * @return array Distinct lowercase words in order of appearance (split before lowercasing, like the prompts)
+ */
+function searchPieces( $term, $wholeWords ) {
+    $minimum = $wholeWords ? 1 : SEARCH_MIN_SUBSTRING_PIECE;
+    preg_match_all( '/[\p{L}\p{N}_]+/u', $term, $matches );
+
+    $pieces = [];
+    foreach( $matches[0] as $word ) {
+        $length = mb_strlen( $word );
+        $word = mb_strtolower( $word );
+        if( $length >= $minimum && $length <= SEARCH_WORD_MAX_LENGTH && !in_array( $word, $pieces, true ) ) {
+            $pieces[] = $word;
+        }
+    }
+    return $pieces;
+}
+
+/**
+ * Build the SQL condition matching gallery_feed rows whose prompt contains a term
+ *
+ * Each word of the term narrows the candidates through the index, and the
+ * plain LIKE '%term%' / REGEXP word-boundary match on the prompt text decides.
+ * Each lookup also takes the prompts not indexed yet whose text matches the term.
+ *
+ * @param mysqli $db Database connection (for escaping)
+ * @param string $term Search term
+ * @param bool $wholeWords Whole word matching
+ * @return string SQL condition on the alias f
+ */
+function promptSearchCondition( $db, $term, $wholeWords ) {
+    $pieces = searchPieces( $term, $wholeWords );
+    $conditions = [];
+
+    $searchEscaped = $db->real_escape_string( $term );
+    if( $wholeWords ) {
+        // Whole word matching using MySQL REGEXP word boundaries
+        $textMatch = "REGEXP '[[:<:]]" . $searchEscaped . "[[:>:]]'";
+    } else {
+        // Substring matching using LIKE
+        $textMatch = "LIKE '%" . $searchEscaped . "%'";
+    }
+
+    foreach( $pieces as $piece ) {
+        $escaped = $db->real_escape_string( $piece );
+        $match = $wholeWords ? "= '" . $escaped . "'" : "LIKE '%" . $escaped . "%'";
+        $conditions[] = "f.prompt_id IN (
+            SELECT pw.prompt_id
+            FROM words w
+            JOIN prompt_words pw ON pw.word_id = w.id
+            WHERE w.word " . $match . "
+            UNION
+            SELECT pp.id
+            FROM positive_prompts pp
+            WHERE pp.id > (SELECT COALESCE(MAX(last_prompt_id), 0) FROM search_index_progress)
+              AND pp.prompt_text " . $textMatch . "
+        )";
+    }
+
+    // The index can let through prompts that don't match (phrases, collation), so the text always decides
+    $conditions[] = "f.prompt " . $textMatch;
+
+    return implode( ' AND ', $conditions );
+}
@@ -98,6 +98,23 @@ class APIClient {
     } );
   }
 
+  /**
+   * Fetches one page of a cursor-paginated endpoint.
+   * The endpoint answers { items, next }; pass next back as the cursor to get the following page.
+   * @param {string} endpoint - The API endpoint
+   * @param {Object} params - Query parameters
+   * @param {string|null} cursor - Cursor returned with the previous page (null for the first page or an offset)
+   * @param {Object} options - Additional fetch options
+   * @returns {Promise<{items: Array, next: string|null}>} Page items and the cursor of the following page
+   */
+  async getPage( endpoint, params = {}, cursor = null, options = {} ) {
+    const response = await this.get( endpoint, { ...params, cursor }, options );
+    return {
+      items: Array.isArray( response?.items ) ? response.items : [],
+      next: response?.next ?? null
+    };
+  }
+
   /**
    * Makes a POST request.
    * @param {string} endpoint - The API endpoint
@@ -13,6 +13,8 @@ class GalleryState {
     this.defaults = defaults;
     this.state = {};
     this.listeners = {}; // For change notifications
+    this.pageCursors = {}; // Cursors of visited pages (kept in memory only)
+    this.pageContext = null; // Sort/page size the cursors belong to
 
     // Load initial state from localStorage
     this._loadState();
@@ -167,6 +169,34 @@ class GalleryState {
     return { ...this.state };
   }
 
+  /**
+   * Gets the cursor that continues to a page, if that page was reached by paging.
+   * @param {string} context - Sort mode and page size the cursor must belong to
+   * @param {number} page - Zero-based page number
+   * @returns {string|null} Cursor, or null to fall back to an offset
+   */
+  getPageCursor( context, page ) {
+    if( context !== this.pageContext ) {
+      return null;
+    }
+    return this.pageCursors[page] ?? null;
+  }
+
+  /**
+   * Records the cursor of a page (as returned with the page before it).
+   * Cursors of another context are discarded, since they are only valid for one sort and page size.
+   * @param {string} context - Sort mode and page size the cursor belongs to
+   * @param {number} page - Zero-based page number
+   * @param {string|null} cursor - Cursor of the page
+   */
+  setPageCursor( context, page, cursor ) {
+    if( context !== this.pageContext ) {
+      this.pageContext = context;
+      this.pageCursors = {};
+    }
+    this.pageCursors[page] = cursor;
+  }
+
   /**
    * Resets a specific key to its default value.
    * @param {string} key - The state key to reset
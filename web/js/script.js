@@ -131,7 +131,7 @@ function createTagInput( item, containerStyles = {} ) {
  * @returns {HTMLElement} The img element with event handlers attached
  */
 function createImageElement( item ) {
-  return DOMHelper.img( `../images/medium/${item.filename}`, {
+  return DOMHelper.img( item.src || `../images/medium/${item.filename}`, {
     class: selector.isSelected( item.filename ) ? 'selected' : '',
     data: { filename: item.filename },
     styles: { maxWidth: '300px', cursor: 'pointer' },
@@ -200,7 +200,7 @@ function renderPromptMode( filtered, gallery ) {
     // Top: metadata (skip if images-only mode active)
     if( !imagesOnlyActive ) {
       const item = groupItems[0];
-      const skipKeys = ['filename', 'date_downloaded', 'title', 'tags'];
+      const skipKeys = ['filename', 'src', 'date_downloaded', 'title', 'tags'];
       if( groupItems.length > 1 ) skipKeys.push( 'seed' );
 
       const cardTop = DOMHelper.div( {
@@ -293,7 +293,7 @@ function renderNormalMode( filtered, gallery ) {
 
     // Right side: metadata (skip if images-only mode active)
     if( !imagesOnlyActive ) {
-      const skipKeys = ['filename', 'date_downloaded', 'title', 'tags'];
+      const skipKeys = ['filename', 'src', 'date_downloaded', 'title', 'tags'];
 
       const cardRight = DOMHelper.div( {
         class: 'card-right'
@@ -314,11 +314,16 @@ function renderNormalMode( filtered, gallery ) {
 /**
  * Fetches and renders gallery data from the server.
  * Handles both search queries and paginated results.
+ * Pages reached with next/prev continue from the server's cursor; jumping to an
+ * unvisited page falls back to its offset.
  * Determines which render mode to use based on sortMode.
  * Updates pagination controls and page info after rendering.
  */
 async function loadData() {
   const params = {};
+  const page = Math.floor( offset / limit );
+  const pageContext = `${sortMode}|${limit}`;
+  let cursor = null;
 
   if( searchString ) {
     // Server-side search
@@ -335,14 +340,13 @@ async function loadData() {
     params.limit = limit;
     params.offset = offset;
     params.sort = sortMode;
+    cursor = state.getPageCursor( pageContext, page );
   }
 
-  const items = await api.get( 'api/data.php', params );
+  const { items, next } = await api.getPage( 'api/data.php', params, cursor );
 
-  // Safeguard: ensure items is always an array
-  if( !Array.isArray( items ) ) {
-    console.error( 'items is not an array:', items );
-    return;
+  if( !searchString ) {
+    state.setPageCursor( pageContext, page + 1, next );
   }
 
   //console.log( 'Loaded items sample (first item):', items[0] );
@@ -358,7 +362,7 @@ async function loadData() {
   }
 
   // Update pagination controls
-  const currentPage = Math.floor( offset / limit ) + 1;
+  const currentPage = page + 1;
   DOMHelper.query( '#pageInfo' ).textContent =
     searchString
       ? `Search results: ${items.length} items`
@@ -366,7 +370,7 @@ async function loadData() {
 
   DOMHelper.query( '#page' ).value = currentPage;
   DOMHelper.query( '#prev' ).disabled = ( offset === 0 );
-  DOMHelper.query( '#next' ).disabled = ( !searchString && items.length < limit );
+  DOMHelper.query( '#next' ).disabled = ( !searchString && !next );
 
   updateSelectAllButton();
 }
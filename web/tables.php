@@ -266,11 +266,12 @@
         // Load state from localStorage or use defaults
         let currentTable = localStorage.getItem('tables_currentTable') || 'art-styles';
         let currentOffset = 0;
+        let pageCursors = ['']; // Cursor of each page visited (page 0 needs none)
         let currentLimit = parseInt(localStorage.getItem('tables_currentLimit')) || 200;
         let currentSortColumn = localStorage.getItem('tables_currentSortColumn') || 'image_count';
         let currentSortOrder = localStorage.getItem('tables_currentSortOrder') || 'desc';
         
-        // Cache for preloaded table data
+        // Cache of each table's first page, with the sort and page size it was loaded with
         const tableCache = {
             'art-styles': null,
             'positive-prompts': null,
@@ -300,7 +301,7 @@
         
         tableSelect.addEventListener('change', function() {
             currentTable = this.value;
-            currentOffset = 0;
+            resetPages();
             
             // Set appropriate default sort column for each table
             if (currentTable === 'tokens') {
@@ -326,16 +327,28 @@
                 selectedContainer.classList.add('active');
                 updateSortIndicators();
                 
-                // If cached, render immediately; otherwise load
-                if (tableCache[currentTable]) {
-                    renderTableData(tableCache[currentTable]);
+                // If the first page is cached for this sort and page size, render immediately; otherwise load
+                const cached = tableCache[currentTable];
+                if (cached && cached.key === firstPageKey(currentSortColumn, currentSortOrder)) {
+                    renderTableData(cached.data);
                 } else {
                     loadTableData();
                 }
             }
         });
 
-        // Navigation controls
+        // Return to the first page (cursors are only valid for one table, sort and page size)
+        function resetPages() {
+            currentOffset = 0;
+            pageCursors = [''];
+        }
+
+        // Identifies a cached first page: it is only valid for the same sort and page size
+        function firstPageKey(sortColumn, sortOrder) {
+            return `${sortColumn}:${sortOrder}:${currentLimit}`;
+        }
+
+        // Navigation controls: each page continues from the cursor returned with the previous one
         prevBtn.addEventListener('click', function() {
             if (currentOffset > 0) {
                 currentOffset = Math.max(0, currentOffset - currentLimit);
@@ -344,13 +357,15 @@
         });
 
         nextBtn.addEventListener('click', function() {
-            currentOffset += currentLimit;
-            loadTableData();
+            if (pageCursors[currentOffset / currentLimit + 1]) {
+                currentOffset += currentLimit;
+                loadTableData();
+            }
         });
 
         limitInput.addEventListener('change', function() {
             currentLimit = parseInt(this.value) || 200;
-            currentOffset = 0;
+            resetPages();
             localStorage.setItem('tables_currentLimit', currentLimit);
             loadTableData();
         });
@@ -374,7 +389,7 @@
                         
                         currentSortColumn = sortColumn;
                         currentSortOrder = sortOrder;
-                        currentOffset = 0; // Reset to first page when sorting
+                        resetPages(); // Reset to first page when sorting
                         
                         // Save to localStorage
                         localStorage.setItem('tables_currentSortColumn', currentSortColumn);
@@ -427,7 +442,8 @@
                 const tableName = tableNames[currentTable] || currentTable.replace('-', ' ');
                 loading.innerHTML = `Loading${countText} ${tableName}...<br><small style="font-size: 14px; color: var(--text-secondary);">(Please wait, this may take a moment)</small>`;
                 
-                const response = await fetch(`api/tables_data.php?table=${currentTable}&limit=${currentLimit}&offset=${currentOffset}&sort=${currentSortColumn}&order=${currentSortOrder}`);
+                const cursor = pageCursors[currentOffset / currentLimit] || '';
+                const response = await fetch(`api/tables_data.php?table=${currentTable}&limit=${currentLimit}&offset=${currentOffset}&cursor=${encodeURIComponent(cursor)}&sort=${currentSortColumn}&order=${currentSortOrder}`);
                 
                 if (!response.ok) throw new Error('Network response was not ok');
                 
@@ -437,8 +453,10 @@
                     throw new Error(data.error);
                 }
                 
-                // Cache the data for this table
-                tableCache[currentTable] = data;
+                // Cache the first page only: deeper pages depend on the cursors of the pages before them
+                if (currentOffset === 0) {
+                    tableCache[currentTable] = { key: firstPageKey(currentSortColumn, currentSortOrder), data: data };
+                }
                 
                 renderTableData(data);
                 
@@ -455,12 +473,15 @@
             const table = container.querySelector('.data-table');
             const tbody = container.querySelector('tbody');
             
+            // Remember where the following page starts
+            pageCursors[currentOffset / currentLimit + 1] = data.next;
+            
             // Populate table
             tbody.innerHTML = '';
-            if (data.length === 0) {
+            if (data.items.length === 0) {
                 tbody.innerHTML = '<tr><td colspan="100%" style="text-align: center; padding: 40px;">No data found</td></tr>';
             } else {
-                data.forEach(row => {
+                data.items.forEach(row => {
                     const tr = document.createElement('tr');
                     
                     switch (currentTable) {
@@ -506,7 +527,7 @@
             
             // Update button states
             prevBtn.disabled = currentOffset === 0;
-            nextBtn.disabled = data.length < currentLimit;
+            nextBtn.disabled = !data.next;
         }
         
         // Preload all tables on page load
@@ -537,7 +558,7 @@
                         if (response.ok) {
                             const data = await response.json();
                             if (!data.error) {
-                                tableCache[tableName] = data;
+                                tableCache[tableName] = { key: firstPageKey(sortColumn, 'desc'), data: data };
                             }
                         }
                     } catch (error) {